@@ -65,7 +65,8 @@ from call_manager import CallManager
 from config_helper import ConfigHelper
 
 # Global instances
-call_manager = CallManager()
+# This broadcaster sends full snapshots, so batch a second of changes per update
+call_manager = CallManager(update_latency=1.0)
 config_helper = ConfigHelper()
 sip_server = None
 
@@ -151,20 +152,19 @@ def start_sip_server():
 def broadcast_call_updates():
     """Broadcast call updates to all connected clients"""
     def update_loop():
-        import time
+        seen = 0
         while True:
-            if call_manager.has_updates():
-                active_calls = call_manager.get_active_calls()
-                socketio.emit('call_update', active_calls)
-                
-                # Send quality metrics for active calls
-                for call in active_calls:
-                    if call.get('quality_metrics'):
-                        socketio.emit('quality_update', {
-                            'call_id': call['call_id'],
-                            'metrics': call['quality_metrics']
-                        })
-            time.sleep(1)
+            seen = call_manager.wait_for_updates(seen)
+            active_calls = call_manager.get_active_calls()
+            socketio.emit('call_update', active_calls)
+            
+            # Send quality metrics for active calls
+            for call in active_calls:
+                if call.get('quality_metrics'):
+                    socketio.emit('quality_update', {
+                        'call_id': call['call_id'],
+                        'metrics': call['quality_metrics']
+                    })
     
     thread = threading.Thread(target=update_loop, daemon=True)
     thread.start()
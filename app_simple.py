@@ -4,7 +4,7 @@ A real-time VoIP call quality monitoring system
 """
 import os
 from flask import Flask, render_template, jsonify, request, session, redirect, url_for
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import threading
 import time
 from datetime import datetime, timedelta
@@ -17,6 +17,7 @@ from config_helper import ConfigHelper
 from sip_registrar import SIPRegistrar
 from mos_calculator import MOSCalculator
 from certificate_manager import CertificateManager
+from socket_rooms import RoomPublisher, is_valid_room, call_room
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -24,6 +25,7 @@ app.secret_key = "voip-quality-app-secret-key"
 
 # Initialize SocketIO
 socketio = SocketIO(app, cors_allowed_origins="*")
+room_publisher = RoomPublisher(socketio)
 
 # Simple authentication setup
 login_manager = LoginManager()
@@ -67,7 +69,8 @@ def make_session_permanent():
     session.permanent = True
 
 # Initialize core components
-call_manager = CallManager()
+# Minimum delay between a call change and its dashboard broadcast, to batch bursts
+call_manager = CallManager(update_latency=float(os.environ.get('DASHBOARD_UPDATE_LATENCY', '0.05')))
 config_helper = ConfigHelper()
 certificate_manager = CertificateManager()
 sip_server = None
@@ -107,10 +110,34 @@ def get_active_calls():
 @app.route('/api/calls/history')
 @require_login
 def get_call_history():
-    """Get historical call data"""
-    limit = request.args.get('limit', 100, type=int)
-    history = call_manager.get_call_history(limit)
-    return jsonify(history)
+    """Get historical call data
+    
+    Query parameters: limit, offset, cursor (from the X-Next-Cursor header of
+    the previous page), start/end (ISO datetimes), from, to, status, min_mos, max_mos
+    """
+    args = request.args
+    try:
+        limit = min(max(args.get('limit', 100, type=int), 1), 1000)
+        offset = max(args.get('offset', 0, type=int), 0)
+        start_time = datetime.fromisoformat(args['start']) if args.get('start') else None
+        end_time = datetime.fromisoformat(args['end']) if args.get('end') else None
+        filters = {
+            'from': args.get('from'),
+            'to': args.get('to'),
+            'status': args.get('status'),
+            'min_mos': args.get('min_mos', type=float),
+            'max_mos': args.get('max_mos', type=float)
+        }
+        history, next_cursor = call_manager.query_call_history(
+            limit, args.get('cursor'), offset, start_time, end_time, filters
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    response = jsonify(history)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 @app.route('/api/calls/history/clear', methods=['DELETE'])
 @require_login
@@ -252,7 +279,9 @@ def get_gateway_status():
             'gateway_connected': gateway_connected,
             'registered_extensions': len(devices),
             'extensions': [device['extension'] for device in devices],
-            'last_activity': devices[0]['last_seen'] if devices else None
+            'last_activity': devices[0]['last_seen'] if devices else None,
+            'message_queue': sip_server.sip_workers.get_stats(),
+            'transactions': sip_server.transactions.get_stats()
         }
         return jsonify(status)
     
@@ -419,41 +448,90 @@ def handle_disconnect():
     """Handle WebSocket disconnection"""
     print("Client disconnected from WebSocket")
 
+@socketio.on('subscribe')
+def handle_subscribe(data=None):
+    """Join the requested rooms: 'calls', 'summary', 'sip-trace', 'call:<id>', 'ext:<extension>'"""
+    rooms = (data or {}).get('rooms', []) if isinstance(data, dict) else []
+    joined = [room for room in rooms if is_valid_room(room)]
+    for room in joined:
+        join_room(room)
+    emit('subscribed', {'rooms': joined})
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe(data=None):
+    """Leave the given rooms"""
+    rooms = (data or {}).get('rooms', []) if isinstance(data, dict) else []
+    left = [room for room in rooms if is_valid_room(room)]
+    for room in left:
+        leave_room(room)
+    emit('unsubscribed', {'rooms': left})
+
+@socketio.on('resync')
+def handle_resync(data=None):
+    """Send the full active-call state to a client that missed deltas (or just connected)"""
+    snapshot = call_manager.get_snapshot()
+    snapshot['summary_stats'] = call_manager.get_summary_stats()
+    snapshot['timestamp'] = datetime.now().isoformat()
+    emit('call_snapshot', snapshot)
+
 # Background services
 def start_sip_server():
     """Start the SIP Registrar for Asterisk gateway"""
     global sip_server
     try:
-        sip_server = SIPRegistrar(call_manager, socketio)
+        sip_server = SIPRegistrar(call_manager, socketio, room_publisher)
         sip_server.start()
         print("SIP Registrar started successfully - ready for Asterisk gateway connections")
     except Exception as e:
         print(f"Failed to start SIP Registrar: {e}")
 
 def broadcast_call_updates():
-    """Broadcast call updates to all connected clients"""
+    """Broadcast call changes to the subscribed rooms
+    
+    Each 'call_delta' to the 'calls' room carries the changes between
+    base_version and version; clients whose state is older than base_version
+    ask for a 'resync'. Summary stats go to the 'summary' room and new samples
+    of a call to its 'call:<id>' room, both rate limited by room_publisher.
+    """
     def update_loop():
+        last_version = 0
+        last_history_version = 0
+        seen = 0
         while True:
             try:
-                if call_manager.has_updates():
-                    # Get current data
-                    active_calls = call_manager.get_active_calls()
-                    summary_stats = call_manager.get_summary_stats()
-                    
-                    print(f"Broadcasting update: {len(active_calls)} active calls")
-                    if active_calls:
-                        for call in active_calls:
-                            if 'current_mos' in call:
-                                print(f"  Call {call['call_id']}: MOS={call.get('current_mos', 'N/A')}")
-                    
-                    # Broadcast to all connected clients
-                    socketio.emit('call_update', {
-                        'active_calls': active_calls,
-                        'summary_stats': summary_stats,
-                        'timestamp': datetime.now().isoformat()
-                    })
+                # Sleeps until a call changes, then waits update_latency to batch the burst;
+                # the timeout bounds the delay if a wakeup is ever missed
+                seen = call_manager.wait_for_updates(seen, timeout=5.0)
+                history_version = call_manager.history_version
+                history_cleared = history_version != last_history_version
+                last_history_version = history_version
+                delta = call_manager.get_changes(last_version)
+                if not (delta['resync'] or delta['calls'] or delta['metrics'] or delta['ended']):
+                    # Nothing to send; keep last_version at what clients hold so the
+                    # next delta's base_version still matches their state
+                    if history_cleared:
+                        room_publisher.publish('summary', 'summary_update', call_manager.get_summary_stats(), mode='latest')
+                    continue
+                last_version = delta['version']
+                
+                # Summary stats only change when calls start or end, or the history is cleared
+                started = [call_id for call_id, fields in delta.get('calls', {}).items() if 'call_id' in fields]
+                if delta['resync'] or started or delta['ended'] or history_cleared:
+                    room_publisher.publish('summary', 'summary_update', call_manager.get_summary_stats(), mode='latest')
+                delta['timestamp'] = datetime.now().isoformat()
                 
-                time.sleep(2)  # Update every 2 seconds
+                print(f"Broadcasting delta v{delta['version']}: {len(delta.get('calls', {}))} changed calls, "
+                      f"{sum(len(samples) for samples in delta.get('metrics', {}).values())} new samples, "
+                      f"{len(delta.get('ended', []))} ended")
+                
+                # Deltas are never coalesced: a skipped one would force every client to resync
+                socketio.emit('call_delta', delta, to='calls')
+                for call_id, samples in delta.get('metrics', {}).items():
+                    room_publisher.publish(call_room(call_id), 'call_metrics', {
+                        'call_id': call_id,
+                        'fields': delta['calls'].get(call_id, {}),
+                        'samples': samples
+                    })
             except Exception as e:
                 print(f"Error in broadcast loop: {e}")
                 time.sleep(5)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Contention benchmark for CallManager
+Worker threads push RTP metric updates for their own calls while a reader
+thread polls get_active_calls like the dashboard broadcaster; run with one
+shard (every writer contends on a single lock, readers take none) and with
+the default sharding
+"""
+import os
+import sys
+import threading
+import time
+from call_manager import CallManager
+from call_storage import SQLHistoryStore
+
+CALLS = 256
+DURATION = 2.0
+THREAD_COUNTS = (1, 2, 4, 8)
+SHARD_COUNTS = (1, 16)
+
+def run(shard_count, thread_count):
+    """Run one configuration and return (updates/s, snapshot reads/s)"""
+    manager = CallManager(history_store=SQLHistoryStore('sqlite://'), shard_count=shard_count)
+    call_ids = [f"bench-{i}" for i in range(CALLS)]
+    for call_id in call_ids:
+        manager.start_call(call_id, {'from': 'bench', 'to': 'bench'})
+
+    metrics = {
+        'timestamp': time.time(), 'mos_score': 4.2, 'packet_loss_rate': 0.5,
+        'jitter': 3.0, 'delay': 50, 'packets_received': 100, 'codec': 'G.711'
+    }
+    stop = threading.Event()
+    updates = [0] * thread_count
+    reads = [0]
+
+    def worker(index):
+        own_calls = call_ids[index::thread_count]
+        count = 0
+        while not stop.is_set():
+            for call_id in own_calls:
+                manager.update_call_metrics(call_id, metrics)
+            count += len(own_calls)
+        updates[index] = count
+
+    def reader():
+        while not stop.is_set():
+            manager.get_active_calls()
+            reads[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(thread_count)]
+    threads.append(threading.Thread(target=reader))
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    manager.timers.stop()
+    manager.history_store.close()
+    return sum(updates) / DURATION, reads[0] / DURATION
+
+def main():
+    results = []
+    # CallManager logs every call it starts; keep the benchmark output readable
+    real_stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        for shard_count in SHARD_COUNTS:
+            for thread_count in THREAD_COUNTS:
+                sys.stdout = devnull
+                try:
+                    update_rate, read_rate = run(shard_count, thread_count)
+                finally:
+                    sys.stdout = real_stdout
+                results.append((shard_count, thread_count, update_rate, read_rate))
+                print(f"shards={shard_count:<3} threads={thread_count}  updates/s={update_rate:>10.0f}  snapshots/s={read_rate:>8.1f}")
+
+    print("\nScaling vs 1 thread:")
+    for shard_count in SHARD_COUNTS:
+        rows = [row for row in results if row[0] == shard_count]
+        base = rows[0][2] or 1
+        scaling = ", ".join(f"{row[1]}t={row[2] / base:.2f}x" for row in rows)
+        print(f"  shards={shard_count}: {scaling}")
+
+if __name__ == "__main__":
+    main()
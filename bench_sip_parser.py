@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+SIP parser benchmark
+Compares the registrar's original decode/split/dict parsing with the lazy
+SIPMessage parser on the SIP messages captured in attached_assets/ (UDP
+payloads from the pcapng capture and raw messages from the Linphone logs)
+"""
+import glob
+import os
+import re
+import struct
+import time
+from sip_message import SIPMessage
+
+ASSETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'attached_assets')
+DURATION = 0.5
+ROUNDS = 5  # Best of, alternating variants, to ride out CPU frequency noise
+# Headers a REGISTER/INVITE handler typically reads
+ACCESSED_HEADERS = ('via', 'from', 'to', 'call-id', 'cseq')
+
+SIP_START = re.compile(rb'^(?:[A-Z]+ sips?:\S+ SIP/2\.0|SIP/2\.0 \d{3} )')
+LOG_LINE = re.compile(rb'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+
+def load_pcapng(path):
+    """UDP port 5060 payloads of an Ethernet/IPv4 pcapng capture"""
+    messages = []
+    with open(path, 'rb') as f:
+        data = f.read()
+    pos = 0
+    while pos + 12 <= len(data):
+        block_type, block_length = struct.unpack_from('<II', data, pos)
+        if block_length < 12:
+            break
+        if block_type == 6:  # Enhanced Packet Block
+            captured = struct.unpack_from('<I', data, pos + 20)[0]
+            packet = data[pos + 28:pos + 28 + captured]
+            if packet[12:14] == b'\x08\x00' and packet[23] == 17:
+                udp = 14 + (packet[14] & 0x0F) * 4
+                source_port, dest_port = struct.unpack_from('>HH', packet, udp)
+                if 5060 in (source_port, dest_port):
+                    messages.append(packet[udp + 8:])
+        pos += block_length
+    return messages
+
+def load_log(path):
+    """Raw SIP messages printed between timestamped lines of a Linphone log"""
+    messages = []
+    current = None
+    with open(path, 'rb') as f:
+        for line in f:
+            # The log writes message lines as "...\r\r\n"
+            line = line.rstrip(b'\r\n')
+            if LOG_LINE.match(line):
+                if current:
+                    messages.append(b'\r\n'.join(current).rstrip(b'\r\n') + b'\r\n\r\n')
+                current = None
+            elif current is not None:
+                current.append(line)
+            elif SIP_START.match(line):
+                current = [line]
+    if current:
+        messages.append(b'\r\n'.join(current).rstrip(b'\r\n') + b'\r\n\r\n')
+    return messages
+
+def load_captures():
+    messages = []
+    for path in sorted(glob.glob(os.path.join(ASSETS, '*'))):
+        if path.endswith('.pcapng'):
+            messages.extend(load_pcapng(path))
+        elif not path.endswith(('.png', '.txt')):
+            # Wireshark .txt exports show decoded trees, not raw messages
+            messages.extend(load_log(path))
+    return [message for message in messages if SIP_START.match(message)]
+
+def legacy_parse(data):
+    """The registrar's original parsing: decode, split every line, dict of all headers"""
+    message = data.decode('utf-8', errors='ignore')
+    head, _, body = message.partition('\r\n\r\n')
+    lines = head.split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    return lines[0], headers, body
+
+def legacy_route(request_line):
+    """The original handle_sip_message dispatch on the raw request line"""
+    for method in ('REGISTER', 'INVITE', 'ACK', 'BYE', 'OPTIONS', 'CANCEL'):
+        if request_line.startswith(method):
+            return method
+    return None
+
+def legacy_dispatch(data):
+    request_line, headers, body = legacy_parse(data)
+    return legacy_route(request_line)
+
+def legacy_access(data):
+    request_line, headers, body = legacy_parse(data)
+    for name in ACCESSED_HEADERS:
+        headers.get(name)
+    return legacy_route(request_line)
+
+def lazy_dispatch(data):
+    return SIPMessage(data).method
+
+def lazy_access(data):
+    # Handlers read the header index like the old dict
+    message = SIPMessage(data)
+    headers = message.index()
+    for name in ACCESSED_HEADERS:
+        headers.get(name)
+    return message.method
+
+def measure(function, messages):
+    """Messages per second over DURATION seconds"""
+    count = 0
+    started = time.perf_counter()
+    deadline = started + DURATION
+    while time.perf_counter() < deadline:
+        for message in messages:
+            function(message)
+        count += len(messages)
+    return count / (time.perf_counter() - started)
+
+def main():
+    messages = load_captures()
+    if not messages:
+        print(f"No SIP messages found in {ASSETS}")
+        return
+    size = sum(len(message) for message in messages) / len(messages)
+    print(f"{len(messages)} captured SIP messages, {size:.0f} bytes on average\n")
+
+    for label, legacy, lazy in (("start line only (routing)", legacy_dispatch, lazy_dispatch),
+                                (f"start line + {len(ACCESSED_HEADERS)} headers", legacy_access, lazy_access)):
+        legacy_rate = lazy_rate = 0
+        for _ in range(ROUNDS):
+            legacy_rate = max(legacy_rate, measure(legacy, messages))
+            lazy_rate = max(lazy_rate, measure(lazy, messages))
+        print(f"{label}:")
+        print(f"  legacy parse_headers  {legacy_rate:>10.0f} msg/s")
+        print(f"  SIPMessage            {lazy_rate:>10.0f} msg/s  ({lazy_rate / legacy_rate:.2f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+"""
+Append-only call history journal for VoIP Quality Monitor
+Completed calls are appended as JSON Lines by a background writer thread,
+which batches writes and fsyncs once per batch, so ending a call costs O(1)
+I/O regardless of history size. A sidecar index (<path>.idx) holds the
+offset, length and summary (everything but the quality samples) of every
+record, so startup reads the index instead of decoding every sample, and
+the samples of a completed call are read back from its offset on demand.
+Every compact_interval seconds (CALL_JOURNAL_COMPACT_INTERVAL) the writer
+rewrites both files if corrupt or superseded records left space to reclaim.
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+SAMPLES_FIELD = 'quality_metrics'
+
+def summarize(record):
+    """Record without its quality samples, as kept in memory and in the index"""
+    return {key: value for key, value in record.items() if key != SAMPLES_FIELD}
+
+def encode(value):
+    return (json.dumps(value, separators=(',', ':')) + '\n').encode('utf-8')
+
+class CallJournal:
+    def __init__(self, path='data/calls.jsonl', legacy_file='data/calls.json', batch_window=0.1,
+                 compact_interval=None):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.legacy_file = legacy_file
+        self.batch_window = batch_window  # Seconds to gather appends before one fsync
+        if compact_interval is None:
+            compact_interval = float(os.environ.get('CALL_JOURNAL_COMPACT_INTERVAL', '3600'))
+        self.compact_interval = compact_interval  # Seconds between checks for reclaimable space
+        self.queue = queue.Queue()
+        self.file = None
+        self.index_file = None
+        self.thread = None
+        self.lock = threading.Lock()  # Guards entries/pending against the writer and compactions
+        self.entries = {}       # {call_id: (offset, length, summary)} of the records on disk
+        self.pending = {}       # {call_id: record} queued but not written yet
+        self.size = 0           # End of the last complete record in the journal
+        self.dead_bytes = 0     # Corrupt or superseded records, reclaimed by compaction
+        self.index_stale = False  # The index misses records, rewritten by compaction
+        self.next_compaction = 0.0
+        self.records_written = 0
+        self.fsync_count = 0
+        self.compactions = 0
+
+    def load(self):
+        """Read the index (migrating the legacy JSON file on first run) and start the writer
+
+        Only records missing from the index (e.g. appended just before a
+        crash) are decoded from the journal itself.
+
+        Returns:
+            list: Call summaries (records without quality samples) in journal order
+        """
+        if os.path.exists(self.path):
+            start = self._read_index()
+            self._scan(start)
+            if self.index_stale:
+                self._rewrite_index()
+            if self.dead_bytes:
+                print(f"Call journal {self.path} has {self.dead_bytes} bytes of corrupt or "
+                      "superseded records, reclaimed by the next compaction")
+        elif self.legacy_file and os.path.exists(self.legacy_file):
+            try:
+                with open(self.legacy_file, 'r') as f:
+                    records = json.load(f)
+                print(f"Migrating {len(records)} calls from {self.legacy_file} to {self.path}")
+            except Exception as e:
+                print(f"Error reading legacy call history {self.legacy_file}: {e}")
+                records = []
+            self._write_snapshot(records)
+
+        self.start()
+        return [entry[2] for entry in sorted(self.entries.values(), key=lambda entry: entry[0])]
+
+    def _read_index(self):
+        """Load entries from the index; returns the journal offset to scan from"""
+        if not os.path.exists(self.index_path):
+            self.index_stale = True
+            return 0
+
+        journal_size = os.path.getsize(self.path)
+        entries = {}
+        end = 0
+        with open(self.index_path, 'rb') as f:
+            for line in f:
+                try:
+                    offset, length, summary = json.loads(line)
+                    call_id = summary['call_id']
+                except (ValueError, TypeError, KeyError):
+                    # Torn index write: the journal scan below recovers the rest
+                    self.index_stale = True
+                    break
+                if offset < end or offset + length > journal_size:
+                    self.index_stale = True
+                    break
+                if call_id in entries:
+                    self.dead_bytes += entries[call_id][1]
+                entries[call_id] = (offset, length, summary)
+                end = offset + length
+
+        # The index must describe this journal: check the last record it points at
+        if entries and not self._matches(entries):
+            print(f"Call journal index {self.index_path} does not match the journal, rebuilding")
+            self.index_stale = True
+            self.dead_bytes = 0
+            return 0
+        self.entries = entries
+        return end
+
+    def _matches(self, entries):
+        offset, length, summary = max(entries.values(), key=lambda entry: entry[0])
+        try:
+            with open(self.path, 'rb') as f:
+                if offset:
+                    f.seek(offset - 1)
+                    if f.read(1) != b'\n':
+                        return False
+                f.seek(offset)
+                return json.loads(f.read(length)).get('call_id') == summary['call_id']
+        except (OSError, ValueError, AttributeError):
+            return False
+
+    def _scan(self, start):
+        """Decode the journal records after start, which the index doesn't cover"""
+        offset = start
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn trailing write from a crash: cut it so new appends start on a clean line
+                    break
+                try:
+                    record = json.loads(line)
+                    call_id = record['call_id']
+                except (ValueError, TypeError, KeyError):
+                    if line.strip():
+                        self.dead_bytes += len(line)
+                    offset += len(line)
+                    continue
+                if call_id in self.entries:
+                    self.dead_bytes += self.entries[call_id][1]
+                self.entries[call_id] = (offset, len(line), summarize(record))
+                self.index_stale = True
+                offset += len(line)
+
+        if offset < os.path.getsize(self.path):
+            print(f"Call journal {self.path} ends with a torn record, truncating")
+            os.truncate(self.path, offset)
+        self.size = offset
+
+    def _rewrite_index(self):
+        """Rebuild the index from the loaded entries (after a crash, or for a journal without one)"""
+        with open(self.index_path + '.tmp', 'wb') as index:
+            for entry in sorted(self.entries.values(), key=lambda entry: entry[0]):
+                index.write(encode(list(entry)))
+            index.flush()
+            os.fsync(index.fileno())
+        os.replace(self.index_path + '.tmp', self.index_path)
+        self.index_stale = False
+
+    def start(self):
+        """Open the journal and index for appending and start the writer thread"""
+        if self.thread:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+        self.index_file = open(self.index_path, 'ab')
+        self.schedule_compaction()
+        self.thread = threading.Thread(target=self.writer_loop, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def append(self, record):
+        """Queue a completed call record; never blocks on disk I/O
+
+        Returns:
+            dict: The record's summary, which the index keeps for it
+        """
+        summary = summarize(record)
+        with self.lock:
+            self.pending[record['call_id']] = record
+        self.queue.put(('append', (record, summary)))
+        return summary
+
+    def compact(self, records):
+        """Queue an atomic rewrite of the journal with exactly these records"""
+        self.queue.put(('compact', list(records)))
+
+    def read_record(self, call_id):
+        """Read back a full record (with its quality samples) from its journal offset
+
+        Returns:
+            dict: The record, or None if the journal has no such call
+        """
+        with self.lock:
+            record = self.pending.get(call_id)
+            if record is not None:
+                return record
+            entry = self.entries.get(call_id)
+            if entry is None:
+                return None
+            # Under the lock so a compaction can't swap the file between lookup and read
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(entry[0])
+                    return json.loads(f.read(entry[1]))
+            except (OSError, ValueError) as e:
+                print(f"Error reading call {call_id} from journal: {e}")
+                return None
+
+    def close(self):
+        """Flush pending records and stop the writer thread"""
+        if not self.thread:
+            return
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+        self.thread = None
+        for handle in (self.file, self.index_file):
+            if handle:
+                handle.close()
+        self.file = None
+        self.index_file = None
+
+    def writer_loop(self):
+        """Group commit loop: one write and one fsync per batch of queued operations"""
+        while True:
+            try:
+                timeout = self.next_compaction - time.monotonic() if self.compact_interval > 0 else None
+                item = self.queue.get(timeout=None if timeout is None else max(0.0, timeout))
+            except queue.Empty:
+                self.scheduled_compaction()
+                continue
+            if item is not None and self.batch_window:
+                time.sleep(self.batch_window)
+
+            batch = [item]
+            try:
+                while True:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            stop = False
+            records = []
+            try:
+                for entry in batch:
+                    if entry is None:
+                        stop = True
+                        continue
+                    action, payload = entry
+                    if action == 'append':
+                        records.append(payload)
+                    else:
+                        # A compaction supersedes everything appended before it
+                        with self.lock:
+                            for record, _ in records:
+                                self.pending.pop(record['call_id'], None)
+                        records = []
+                        self._write_snapshot(payload)
+
+                if records:
+                    self._write_records(records)
+            except Exception as e:
+                print(f"Error writing call journal: {e}")
+
+            if stop:
+                return
+            if time.monotonic() >= self.next_compaction:
+                self.scheduled_compaction()
+
+    def _write_records(self, records):
+        """Append a batch to the journal (one fsync) and to the index"""
+        lines = [encode(record) for record, _ in records]
+        self.file.write(b''.join(lines))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records_written += len(lines)
+        self.fsync_count += 1
+
+        # The journal is authoritative: records after the last good index line are
+        # recovered by the startup scan, so after a failed index write nothing more is
+        # appended (a hole would hide records) until the compaction rewrites the index
+        index_lines = []
+        with self.lock:
+            for (record, summary), line in zip(records, lines):
+                call_id = record['call_id']
+                entry = (self.size, len(line), summary)
+                if call_id in self.entries:
+                    self.dead_bytes += self.entries[call_id][1]
+                self.entries[call_id] = entry
+                if self.pending.get(call_id) is record:
+                    del self.pending[call_id]
+                index_lines.append(encode(list(entry)))
+                self.size += len(line)
+        if self.index_stale:
+            return
+        try:
+            self.index_file.write(b''.join(index_lines))
+            self.index_file.flush()
+        except Exception as e:
+            print(f"Error writing call journal index: {e}")
+            self.index_stale = True
+
+    def scheduled_compaction(self):
+        """Periodic check: rewrite journal and index if there is space to reclaim or the index is stale"""
+        self.schedule_compaction()
+        if not self.dead_bytes and not self.index_stale:
+            return
+        try:
+            self._compact_entries()
+        except Exception as e:
+            print(f"Error compacting call journal: {e}")
+
+    def schedule_compaction(self):
+        """Set the time of the next compaction check (never if compact_interval <= 0)"""
+        if self.compact_interval > 0:
+            self.next_compaction = time.monotonic() + self.compact_interval
+        else:
+            self.next_compaction = float('inf')
+
+    def _compact_entries(self):
+        """Copy the live records by offset (no decoding) into a fresh journal and index"""
+        entries = sorted(self.entries.items(), key=lambda item: item[1][0])
+        reclaimed = self.dead_bytes
+        new_entries = {}
+        offset = 0
+        with open(self.path, 'rb') as source, \
+                open(self.path + '.tmp', 'wb') as journal, open(self.index_path + '.tmp', 'wb') as index:
+            for call_id, (old_offset, length, summary) in entries:
+                source.seek(old_offset)
+                journal.write(source.read(length))
+                new_entries[call_id] = (offset, length, summary)
+                index.write(encode([offset, length, summary]))
+                offset += length
+            for handle in (journal, index):
+                handle.flush()
+                os.fsync(handle.fileno())
+
+        self._install(new_entries, offset)
+        print(f"Compacted call journal {self.path}: {len(new_entries)} calls, {reclaimed} bytes reclaimed")
+
+    def _write_snapshot(self, records):
+        """Atomically replace the journal and its index with the given records"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        entries = {}
+        offset = 0
+        with open(self.path + '.tmp', 'wb') as journal, open(self.index_path + '.tmp', 'wb') as index:
+            for record in records:
+                line = encode(record)
+                journal.write(line)
+                entry = (offset, len(line), summarize(record))
+                entries[record['call_id']] = entry
+                index.write(encode(list(entry)))
+                offset += len(line)
+            for handle in (journal, index):
+                handle.flush()
+                os.fsync(handle.fileno())
+        self._install(entries, offset)
+
+    def _install(self, entries, size):
+        """Swap the .tmp journal and index into place and reopen them for appending"""
+        with self.lock:
+            for handle in (self.file, self.index_file):
+                if handle:
+                    handle.close()
+            # Journal first: an index left over from before the swap fails the startup check
+            os.replace(self.path + '.tmp', self.path)
+            os.replace(self.index_path + '.tmp', self.index_path)
+            self.entries = entries
+            self.size = size
+            self.dead_bytes = 0
+            self.index_stale = False
+            self.compactions += 1
+            if self.thread:
+                self.file = open(self.path, 'ab')
+                self.index_file = open(self.index_path, 'ab')
+
+    def get_stats(self):
+        """Get journal write statistics"""
+        return {
+            'path': self.path,
+            'records': len(self.entries),
+            'records_written': self.records_written,
+            'fsync_count': self.fsync_count,
+            'dead_bytes': self.dead_bytes,
+            'compactions': self.compactions,
+            'pending': self.queue.qsize()
+        }
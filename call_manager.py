@@ -1,26 +1,63 @@
-import json
+import itertools
 import threading
+from collections import deque
 from datetime import datetime, timedelta
-from collections import defaultdict
-import os
+from call_metrics import MetricsRing
+from call_storage import create_history_store
+from update_notifier import UpdateNotifier
+from timer_wheel import TimerWheel
+
+class CallShard:
+    """Active calls whose call-id hashes to the same shard, guarded by one lock"""
+    __slots__ = ('lock', 'calls', 'metrics', 'changes', 'timers')
 
-class CallManager:
     def __init__(self):
-        self.active_calls = {}
-        self.call_history = []
         self.lock = threading.Lock()
-        self.data_file = 'data/calls.json'
-        self.has_new_updates = False
+        self.calls = {}    # {call_id: call_data}
+        self.metrics = {}  # {call_id: MetricsRing}
+        self.changes = {}  # {call_id: {field: version of its last change}}
+        self.timers = {}   # {call_id: orphan check Timer}
+
+class CallManager:
+    def __init__(self, history_store=None, shard_count=16, update_latency=0.05, timers=None):
+        # Active calls are sharded by call-id hash: writers only lock their
+        # shard, readers take lock-free snapshots (dict copies are atomic under the GIL)
+        self.shards = [CallShard() for _ in range(shard_count)]
+        self.metrics_capacity = 100  # Samples kept per active call
+        # Wakes the dashboard broadcaster; update_latency is its minimum batching delay
+        self.updates = UpdateNotifier(min_latency=update_latency)
+        
+        # Change tracking for delta broadcasts: every change takes a version
+        # from one monotonic counter while holding its shard lock
+        self.versions = itertools.count(1)
+        self.ended_calls = deque(maxlen=1000)  # (version, call_id) of recently ended calls
+        
+        # Completed calls live in a pluggable backend (journal or SQL database)
+        self.history_store = history_store or create_history_store()
+        self.history_version = 0  # Bumped when the history is cleared, so summaries are resent
+        
+        # One timing wheel schedules orphan-call checks here and the SIP timers
+        # (answers, registration expiry, transactions) of the registrar
+        self.timers = timers or TimerWheel(name='call-scheduler')
+        self.timers.start()
+        self.orphan_timeout = 600        # Seconds a call may stay active without any metrics
+        self.max_call_duration = 1800    # Seconds after which any call is considered orphaned
         
-        # Load existing call history
-        self.load_call_history()
+    def get_shard(self, call_id):
+        """Shard owning a call"""
+        return self.shards[hash(call_id) % len(self.shards)]
         
-        # Start cleanup timer for orphaned calls
-        self.start_cleanup_timer()
+    def iter_active_calls(self):
+        """Snapshot of (call_id, call_data, metrics ring) for every active call, without locking"""
+        for shard in self.shards:
+            metrics = shard.metrics
+            for call_id, call_data in list(shard.calls.items()):
+                yield call_id, call_data, metrics.get(call_id)
         
     def start_call(self, call_id, session_info):
         """Start tracking a new call"""
-        with self.lock:
+        shard = self.get_shard(call_id)
+        with shard.lock:
             call_data = {
                 'call_id': call_id,
                 'start_time': datetime.now().isoformat(),
@@ -31,7 +68,6 @@ class CallManager:
                 'from_address': session_info.get('from', ''),
                 'to_address': session_info.get('to', ''),
                 'status': 'active',
-                'quality_metrics': [],
                 'avg_mos': 0,
                 'min_mos': 5.0,
                 'max_mos': 1.0,
@@ -40,17 +76,23 @@ class CallManager:
                 'avg_delay': 0
             }
             
-            self.active_calls[call_id] = call_data
-            self.has_new_updates = True
+            # Register the ring first so a visible call always has one
+            version = next(self.versions)
+            shard.metrics[call_id] = MetricsRing(self.metrics_capacity)
+            shard.changes[call_id] = dict.fromkeys(call_data, version)
+            shard.calls[call_id] = call_data
+            shard.timers[call_id] = self.timers.call_later(self.orphan_timeout, self.check_orphaned_call, call_id)
             
             print(f"Call started: {call_id}")
+        
+        self.updates.notify()
             
     def end_call(self, call_id):
         """End a call and move to history"""
-        with self.lock:
-            if call_id in self.active_calls:
-                call_data = self.active_calls[call_id]
-                
+        shard = self.get_shard(call_id)
+        with shard.lock:
+            call_data = shard.calls.pop(call_id, None)
+            if call_data is not None:
                 # Calculate final statistics
                 end_time = datetime.now()
                 start_time = datetime.fromisoformat(call_data['start_time'])
@@ -61,242 +103,211 @@ class CallManager:
                 call_data['status'] = 'completed'
                 
                 # Calculate average metrics
-                if call_data['quality_metrics']:
-                    metrics = call_data['quality_metrics']
-                    call_data['avg_mos'] = sum(m['mos_score'] for m in metrics) / len(metrics)
-                    call_data['avg_jitter'] = sum(m['jitter'] for m in metrics) / len(metrics)
-                    call_data['avg_delay'] = sum(m['delay'] for m in metrics) / len(metrics)
-                    call_data['min_mos'] = min(m['mos_score'] for m in metrics)
-                    call_data['max_mos'] = max(m['mos_score'] for m in metrics)
+                ring = shard.metrics.pop(call_id, None)
+                summary = ring.summary() if ring else None
+                if summary:
+                    call_data['avg_mos'] = summary['avg_mos']
+                    call_data['avg_jitter'] = summary['avg_jitter']
+                    call_data['avg_delay'] = summary['avg_delay']
+                    call_data['min_mos'] = summary['min_mos']
+                    call_data['max_mos'] = summary['max_mos']
+                call_data['quality_metrics'] = ring.to_list() if ring else []
                 
-                # Move to history
-                self.call_history.append(call_data)
-                del self.active_calls[call_id]
+                shard.changes.pop(call_id, None)
+                timer = shard.timers.pop(call_id, None)
+                if timer is not None:
+                    timer.cancel()
+                self.ended_calls.append((next(self.versions), call_id))
                 
-                # Save to file
-                self.save_call_history()
-                self.has_new_updates = True
-                
-                print(f"Call ended: {call_id}, Duration: {duration:.2f}s")
+        # Storage I/O happens outside the shard lock so RTP metric updates never wait on it
+        if call_data is not None:
+            self.updates.notify()
+            try:
+                self.history_store.add_call(call_data)
+            except Exception as e:
+                print(f"Error saving call {call_id} to history: {e}")
+            print(f"Call ended: {call_id}, Duration: {duration:.2f}s")
                 
     def update_call_metrics(self, call_id, metrics):
         """Update quality metrics for an active call"""
-        with self.lock:
-            if call_id in self.active_calls:
-                call_data = self.active_calls[call_id]
-                call_data['quality_metrics'].append(metrics)
-                
-                # Keep only last 100 metrics to prevent memory issues
-                if len(call_data['quality_metrics']) > 100:
-                    call_data['quality_metrics'] = call_data['quality_metrics'][-100:]
-                
-                # Update current statistics
-                current_metrics = call_data['quality_metrics']
-                if current_metrics:
-                    latest = current_metrics[-1]
-                    call_data['current_mos'] = latest['mos_score']
-                    call_data['current_jitter'] = latest['jitter']
-                    call_data['current_packet_loss'] = latest['packet_loss_rate']
-                    call_data['codec'] = latest['codec']
-                    print(f"CALL MANAGER UPDATE - Call {call_id}: MOS={latest['mos_score']:.2f}, Loss={latest['packet_loss_rate']:.2f}%, Jitter={latest['jitter']:.2f}ms")
-                
-                # Mark as having updates for WebSocket broadcast
-                self.has_new_updates = True
-                
-                if current_metrics:
-                    latest = current_metrics[-1]
-                    call_data['current_mos'] = latest['mos_score']
-                    call_data['packet_loss_rate'] = latest['packet_loss_rate']
-                    call_data['current_jitter'] = latest['jitter']
-                    call_data['current_delay'] = latest['delay']
-                
-                self.has_new_updates = True
+        shard = self.get_shard(call_id)
+        with shard.lock:
+            call_data = shard.calls.get(call_id)
+            if call_data is None:
+                return
+            
+            version = next(self.versions)
+            shard.metrics[call_id].append(metrics, version)
+            
+            # Update current statistics, recording which fields really changed
+            changes = shard.changes[call_id]
+            for field, value in (('current_mos', metrics['mos_score']),
+                                 ('current_jitter', metrics['jitter']),
+                                 ('current_packet_loss', metrics['packet_loss_rate']),
+                                 ('current_delay', metrics['delay']),
+                                 ('packet_loss_rate', metrics['packet_loss_rate']),
+                                 ('codec', metrics['codec'])):
+                if call_data.get(field) != value:
+                    call_data[field] = value
+                    changes[field] = version
+        
+        # Wake the WebSocket broadcaster
+        self.updates.notify()
                 
     def get_active_calls(self):
         """Get list of currently active calls"""
-        with self.lock:
-            return list(self.active_calls.values())
+        return [
+            dict(call_data, quality_metrics=ring.to_list() if ring is not None else [])
+            for call_id, call_data, ring in self.iter_active_calls()
+        ]
+            
+    def get_snapshot(self):
+        """Full active-call state for a (re)syncing client
+        
+        Returns:
+            dict: {'version': int, 'active_calls': [call with quality_metrics]}
+        """
+        version = next(self.versions)
+        active_calls = []
+        for shard in self.shards:
+            with shard.lock:
+                for call_id, call_data in shard.calls.items():
+                    active_calls.append(dict(
+                        call_data,
+                        quality_metrics=shard.metrics[call_id].between_versions(0, version)
+                    ))
+        return {'version': version, 'active_calls': active_calls}
+        
+    def get_changes(self, since_version):
+        """Changes after since_version: changed fields, new metric samples and ended calls
+        
+        Every version below the one taken here was issued before the scan, and
+        its writer held the shard lock until the change was complete, so taking
+        each shard lock once is enough to see all of them.
+        
+        Args:
+            since_version: Version of the client state (snapshot or previous delta)
             
+        Returns:
+            dict: {'base_version', 'version', 'calls': {call_id: {field: value}},
+                   'metrics': {call_id: [samples]}, 'ended': [call_id], 'resync': bool}
+        """
+        version = next(self.versions)
+        ended_log = list(self.ended_calls)
+        if len(ended_log) == self.ended_calls.maxlen and ended_log[0][0] > since_version:
+            # Ended calls between since_version and the log start were forgotten
+            return {'base_version': since_version, 'version': version, 'resync': True}
+        
+        calls = {}
+        metrics = {}
+        for shard in self.shards:
+            with shard.lock:
+                for call_id, changes in shard.changes.items():
+                    call_data = shard.calls[call_id]
+                    fields = {
+                        field: call_data[field] for field, changed in changes.items()
+                        if since_version < changed < version
+                    }
+                    if fields:
+                        calls[call_id] = fields
+                    samples = shard.metrics[call_id].between_versions(since_version, version)
+                    if samples:
+                        metrics[call_id] = samples
+        
+        return {
+            'base_version': since_version,
+            'version': version,
+            'calls': calls,
+            'metrics': metrics,
+            'ended': [call_id for ended, call_id in ended_log if since_version < ended < version],
+            'resync': False
+        }
+        
     def get_call_history(self, limit=100):
-        """Get call history with optional limit"""
-        with self.lock:
-            # Sort by start time (most recent first)
-            sorted_history = sorted(
-                self.call_history,
-                key=lambda x: x['start_time'],
-                reverse=True
-            )
-            return sorted_history[:limit]
+        """Get call history (most recent first) with optional limit"""
+        return self.history_store.get_calls(limit)
+        
+    def query_call_history(self, limit=100, cursor=None, offset=0, start_time=None, end_time=None, filters=None):
+        """Get a page of call history, returning (calls, next_cursor)"""
+        return self.history_store.query_calls(limit, cursor, offset, start_time, end_time, filters)
+        
+    def get_call_metrics(self, call_id):
+        """Get the quality samples of an active or completed call"""
+        ring = self.get_shard(call_id).metrics.get(call_id)
+        if ring is not None:
+            return ring.to_list()
+        return self.history_store.get_call_metrics(call_id)
             
     def is_call_active(self, call_id):
         """Check if a call is currently active"""
-        with self.lock:
-            return call_id in self.active_calls
+        return call_id in self.get_shard(call_id).calls
             
-    def has_updates(self):
-        """Check if there are new updates"""
-        if self.has_new_updates:
-            self.has_new_updates = False
-            return True
-        return False
+    def wait_for_updates(self, seen=0, timeout=None):
+        """Block until calls changed after update sequence `seen` (see UpdateNotifier.wait)"""
+        return self.updates.wait(seen, timeout)
         
     def get_summary_stats(self):
         """Get summary statistics"""
-        with self.lock:
-            now = datetime.now()
-            today_start = datetime.combine(now.date(), datetime.min.time())
-            today_end = datetime.combine(now.date(), datetime.max.time())
-            
-            # Count today's calls (including active ones)
-            today_calls_count = 0
-            
-            # Count completed calls from today
-            for call in self.call_history:
-                call_time = datetime.fromisoformat(call['start_time'])
-                if today_start <= call_time <= today_end:
-                    today_calls_count += 1
-            
-            # Count active calls started today
-            for call_id, call_data in self.active_calls.items():
-                call_time = datetime.fromisoformat(call_data['start_time'])
-                if today_start <= call_time <= today_end:
-                    today_calls_count += 1
-            
-            # Calculate statistics for different time periods
-            stats = {
-                'total_calls': len(self.call_history),
-                'active_calls': len(self.active_calls),
-                'today_calls': today_calls_count,  # Add explicit today count
-                'today': self._get_period_stats(now.date(), now.date()),
-                'last_24h': self._get_period_stats(now - timedelta(days=1), now),
-                'last_7d': self._get_period_stats(now - timedelta(days=7), now),
-                'last_30d': self._get_period_stats(now - timedelta(days=30), now)
-            }
-            
-            print(f"DEBUG: Today's calls count: {today_calls_count} (active: {len(self.active_calls)}, completed: {stats['today']['call_count']})")
-            
-            return stats
-            
-    def _get_period_stats(self, start_time, end_time):
-        """Get statistics for a specific time period"""
-        period_calls = []
+        now = datetime.now()
+        today_start = datetime.combine(now.date(), datetime.min.time())
+        today_end = datetime.combine(now.date(), datetime.max.time())
         
-        for call in self.call_history:
-            call_time = datetime.fromisoformat(call['start_time'])
-            
-            # Handle date vs datetime comparison
-            if hasattr(start_time, 'date'):
-                start_check = start_time
-            else:
-                start_check = datetime.combine(start_time, datetime.min.time())
-                
-            if hasattr(end_time, 'date'):
-                end_check = end_time
-            else:
-                end_check = datetime.combine(end_time, datetime.max.time())
-                
-            if start_check <= call_time <= end_check:
-                period_calls.append(call)
-                
-        if not period_calls:
-            return {
-                'call_count': 0,
-                'avg_duration': 0,
-                'avg_mos': 0,
-                'avg_packet_loss': 0,
-                'avg_jitter': 0,
-                'quality_distribution': {}
-            }
-            
-        # Calculate statistics
-        total_duration = sum(call['duration'] for call in period_calls)
-        total_mos = sum(call['avg_mos'] for call in period_calls if call['avg_mos'] > 0)
-        total_packet_loss = sum(call['packet_loss_rate'] for call in period_calls)
-        total_jitter = sum(call['avg_jitter'] for call in period_calls)
+        # Count active calls started today
+        active_count = 0
+        active_today = 0
+        for call_id, call_data, ring in self.iter_active_calls():
+            active_count += 1
+            if today_start <= datetime.fromisoformat(call_data['start_time']) <= today_end:
+                active_today += 1
         
-        avg_mos = total_mos / len(period_calls) if total_mos > 0 else 0
+        # Completed calls come from the history store
+        store = self.history_store
+        today_stats = store.get_period_stats(today_start, today_end)
+        today_calls_count = today_stats['call_count'] + active_today
         
-        # Quality distribution
-        quality_dist = defaultdict(int)
-        for call in period_calls:
-            if call['avg_mos'] >= 4.0:
-                quality_dist['excellent'] += 1
-            elif call['avg_mos'] >= 3.5:
-                quality_dist['good'] += 1
-            elif call['avg_mos'] >= 3.0:
-                quality_dist['fair'] += 1
-            elif call['avg_mos'] >= 2.0:
-                quality_dist['poor'] += 1
-            else:
-                quality_dist['bad'] += 1
-                
-        return {
-            'call_count': len(period_calls),
-            'avg_duration': total_duration / len(period_calls),
-            'avg_mos': avg_mos,
-            'avg_packet_loss': total_packet_loss / len(period_calls),
-            'avg_jitter': total_jitter / len(period_calls),
-            'quality_distribution': dict(quality_dist)
+        # Calculate statistics for different time periods
+        stats = {
+            'total_calls': store.count_calls(),
+            'active_calls': active_count,
+            'today_calls': today_calls_count,  # Add explicit today count
+            'today': today_stats,
+            'last_24h': store.get_period_stats(now - timedelta(days=1), now),
+            'last_7d': store.get_period_stats(now - timedelta(days=7), now),
+            'last_30d': store.get_period_stats(now - timedelta(days=30), now)
         }
+        
+        print(f"DEBUG: Today's calls count: {today_calls_count} (active: {active_count}, completed: {today_stats['call_count']})")
+        
+        return stats
     
     def clear_call_history(self):
         """Clear all call history"""
-        with self.lock:
-            self.call_history = []
-            self.save_call_history()
-            self.has_new_updates = True
-            print("Call history cleared")
-        
-    def save_call_history(self):
-        """Save call history to file"""
-        try:
-            with open(self.data_file, 'w') as f:
-                json.dump(self.call_history, f, indent=2)
-        except Exception as e:
-            print(f"Error saving call history: {e}")
-            
-    def load_call_history(self):
-        """Load call history from file"""
-        try:
-            if os.path.exists(self.data_file):
-                with open(self.data_file, 'r') as f:
-                    self.call_history = json.load(f)
-                print(f"Loaded {len(self.call_history)} calls from history")
-        except Exception as e:
-            print(f"Error loading call history: {e}")
-            self.call_history = []
+        self.history_store.clear()
+        # Clearing changes no active call, so the delta stays empty; the
+        # broadcaster watches this version to resend the summary
+        self.history_version += 1
+        self.updates.notify()
+        print("Call history cleared")
     
-    def cleanup_orphaned_calls(self):
-        """Clean up calls that have been active too long (likely orphaned)"""
-        with self.lock:
-            current_time = datetime.now()
-            orphaned_calls = []
+    def check_orphaned_call(self, call_id):
+        """Timer callback: end a call that looks orphaned, or check it again later"""
+        shard = self.get_shard(call_id)
+        with shard.lock:
+            call_data = shard.calls.get(call_id)
+            if call_data is None:
+                return
+            call_start = datetime.fromisoformat(call_data['start_time'])
+            duration = (datetime.now() - call_start).total_seconds()
             
-            for call_id, call_data in self.active_calls.items():
-                call_start = datetime.fromisoformat(call_data['start_time'])
-                duration = (current_time - call_start).total_seconds()
-                
-                # Consider calls orphaned if active for more than 10 minutes without metrics
-                if duration > 600 and len(call_data['quality_metrics']) == 0:
-                    orphaned_calls.append(call_id)
-                # Or if active for more than 30 minutes regardless
-                elif duration > 1800:
-                    orphaned_calls.append(call_id)
-            
-            for call_id in orphaned_calls:
-                print(f"Cleaning up orphaned call: {call_id}")
-                self.end_call(call_id)
-    
-    def start_cleanup_timer(self):
-        """Start periodic cleanup of orphaned calls"""
-        def cleanup_loop():
-            import time
-            while True:
-                time.sleep(300)  # Check every 5 minutes
-                try:
-                    self.cleanup_orphaned_calls()
-                except Exception as e:
-                    print(f"Error in cleanup loop: {e}")
+            # Orphaned if active for more than 10 minutes without metrics,
+            # or for more than 30 minutes regardless
+            orphaned = ((duration >= self.orphan_timeout and not shard.metrics.get(call_id))
+                        or duration >= self.max_call_duration)
+            if not orphaned:
+                shard.timers[call_id] = self.timers.call_later(
+                    self.max_call_duration - duration, self.check_orphaned_call, call_id)
+                return
         
-        cleanup_thread = threading.Thread(target=cleanup_loop, daemon=True)
-        cleanup_thread.start()
+        # end_call takes the shard lock itself
+        print(f"Cleaning up orphaned call: {call_id}")
+        self.end_call(call_id)
@@ -0,0 +1,89 @@
+"""
+Per-call quality metric storage for VoIP Quality Monitor
+Keeps the most recent RTP metric samples of an active call in a fixed-size
+NumPy ring buffer (one row per metric, one column per sample)
+"""
+import time
+import numpy as np
+
+# Stored metric columns, in row order
+METRIC_FIELDS = ('timestamp', 'mos_score', 'packet_loss_rate', 'jitter', 'delay', 'packets_received')
+TIMESTAMP, MOS, LOSS, JITTER, DELAY, PACKETS = range(len(METRIC_FIELDS))
+
+class MetricsRing:
+    """Fixed-capacity ring of metric samples, O(1) append without allocation"""
+    __slots__ = ('capacity', 'data', 'versions', 'head', 'count')
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.data = np.zeros((len(METRIC_FIELDS), capacity), dtype=np.float64)
+        self.versions = np.zeros(capacity, dtype=np.int64)  # CallManager change version per sample
+        self.head = 0   # Next column to write
+        self.count = 0  # Valid samples (<= capacity)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, metrics, version=0):
+        """Store a metrics dict from RTPProcessor, overwriting the oldest sample when full"""
+        head = self.head
+        self.versions[head] = version
+        # One column assignment, so lock-free readers never see half a sample
+        self.data[:, head] = (
+            metrics.get('timestamp') or time.time(),
+            metrics.get('mos_score', 0),
+            metrics.get('packet_loss_rate', 0),
+            metrics.get('jitter', 0),
+            metrics.get('delay', 0),
+            metrics.get('packets_received', 0)
+        )
+
+        self.head = (head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def ordered(self):
+        """Get the valid samples as a (fields, count) array, oldest first"""
+        head, count = self.head, self.count
+        if count < self.capacity:
+            return self.data[:, :count]
+        return np.concatenate((self.data[:, head:], self.data[:, :head]), axis=1)
+
+    def summary(self):
+        """Get average/min/max statistics over the stored samples"""
+        if not self.count:
+            return None
+
+        # Reductions do not depend on sample order, so use the raw columns
+        samples = self.data[:, :self.count]
+        mos = samples[MOS]
+        averages = samples.mean(axis=1)
+        return {
+            'avg_mos': float(averages[MOS]),
+            'min_mos': float(mos.min()),
+            'max_mos': float(mos.max()),
+            'avg_packet_loss': float(averages[LOSS]),
+            'avg_jitter': float(averages[JITTER]),
+            'avg_delay': float(averages[DELAY])
+        }
+
+    def to_list(self):
+        """Serialize the samples as a list of metric dicts (API and history format)"""
+        return self._serialize(self.ordered())
+
+    def between_versions(self, low, high):
+        """Serialize the samples with low < version <= high, oldest first, tagged with their version"""
+        versions = self.versions[:self.count]
+        selected = np.nonzero((versions > low) & (versions <= high))[0]
+        if not len(selected):
+            return []
+        selected = selected[np.argsort(versions[selected], kind='stable')]
+        samples = self._serialize(self.data[:, selected])
+        for sample, version in zip(samples, versions[selected].tolist()):
+            sample['version'] = version
+        return samples
+
+    def _serialize(self, samples):
+        columns = samples.tolist()
+        columns[PACKETS] = [int(value) for value in columns[PACKETS]]
+        return [dict(zip(METRIC_FIELDS, sample)) for sample in zip(*columns)]
@@ -0,0 +1,178 @@
+"""
+Time-bucketed call statistics for VoIP Quality Monitor
+Completed calls are folded into per-minute, per-hour and per-day buckets when
+they end, so period statistics are computed from at most a few hundred
+buckets instead of scanning the whole call history
+"""
+import threading
+from datetime import datetime
+
+# Buckets are keyed by "naive epoch" minutes: local wall-clock time counted as
+# if it were UTC, so day buckets start at local midnight like the dashboard's "today"
+NAIVE_EPOCH = datetime(1970, 1, 1)
+MINUTES_PER_HOUR = 60
+MINUTES_PER_DAY = 1440
+
+# Dashboard quality classes, best first
+QUALITY_CLASSES = ('excellent', 'good', 'fair', 'poor', 'bad')
+
+# Bucket layout: count, sum duration, sum MOS (> 0 only), sum loss, sum jitter,
+# then one counter per quality class
+COUNT, DURATION, MOS, LOSS, JITTER = range(5)
+QUALITY_OFFSET = 5
+BUCKET_SIZE = QUALITY_OFFSET + len(QUALITY_CLASSES)
+
+def classify_quality(mos):
+    """Map an average MOS to the dashboard quality class"""
+    if mos >= 4.0:
+        return 'excellent'
+    elif mos >= 3.5:
+        return 'good'
+    elif mos >= 3.0:
+        return 'fair'
+    elif mos >= 2.0:
+        return 'poor'
+    return 'bad'
+
+def empty_period_stats():
+    """Statistics of a period without completed calls"""
+    return {
+        'call_count': 0,
+        'avg_duration': 0,
+        'avg_mos': 0,
+        'avg_packet_loss': 0,
+        'avg_jitter': 0,
+        'quality_distribution': {}
+    }
+
+def naive_minute(moment):
+    """Minute index of a naive local datetime"""
+    return int((moment - NAIVE_EPOCH).total_seconds() // 60)
+
+class CallRollups:
+    def __init__(self, minute_retention_days=32, hour_retention_days=400):
+        # Minute buckets must cover the longest summary period (30 days) for
+        # exact edges; older ranges fall back to hour/day resolution
+        self.minute_retention = minute_retention_days * MINUTES_PER_DAY
+        self.hour_retention = hour_retention_days * 24
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drop every bucket"""
+        with self.lock:
+            self.minutes = {}  # {minute index: bucket}
+            self.hours = {}    # {hour index: bucket}
+            self.days = {}     # {day index: bucket}
+            self.total = 0
+            self.newest_minute = 0
+
+    def add(self, call):
+        """Fold a completed call record into its minute, hour and day buckets"""
+        minute = naive_minute(datetime.fromisoformat(call['start_time']))
+        avg_mos = call.get('avg_mos', 0) or 0
+        values = (
+            call.get('duration', 0) or 0,
+            avg_mos if avg_mos > 0 else 0,
+            call.get('packet_loss_rate', 0) or 0,
+            call.get('avg_jitter', 0) or 0
+        )
+        quality = QUALITY_OFFSET + QUALITY_CLASSES.index(classify_quality(avg_mos))
+
+        with self.lock:
+            for buckets, key in ((self.minutes, minute),
+                                 (self.hours, minute // MINUTES_PER_HOUR),
+                                 (self.days, minute // MINUTES_PER_DAY)):
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = [0] * BUCKET_SIZE
+                bucket[COUNT] += 1
+                bucket[DURATION] += values[0]
+                bucket[MOS] += values[1]
+                bucket[LOSS] += values[2]
+                bucket[JITTER] += values[3]
+                bucket[quality] += 1
+
+            self.total += 1
+            if minute > self.newest_minute:
+                self.newest_minute = minute
+                self._prune()
+
+    def _prune(self):
+        """Drop fine-grained buckets past their retention (insertion order is roughly time order)"""
+        minute_cutoff = self.newest_minute - self.minute_retention
+        while self.minutes and next(iter(self.minutes)) < minute_cutoff:
+            self.minutes.pop(next(iter(self.minutes)))
+
+        hour_cutoff = self.newest_minute // MINUTES_PER_HOUR - self.hour_retention
+        while self.hours and next(iter(self.hours)) < hour_cutoff:
+            self.hours.pop(next(iter(self.hours)))
+
+    def _collect(self, first_minute, last_minute):
+        """Sum the buckets covering [first_minute, last_minute], coarsest first"""
+        totals = [0] * BUCKET_SIZE
+        minute = first_minute
+        end = last_minute + 1
+
+        with self.lock:
+            # Edges older than the minute retention are rounded to whole hours
+            pruned_before = self.newest_minute - self.minute_retention
+            while minute < end:
+                if minute % MINUTES_PER_DAY == 0 and minute + MINUTES_PER_DAY <= end:
+                    bucket = self.days.get(minute // MINUTES_PER_DAY)
+                    minute += MINUTES_PER_DAY
+                elif minute % MINUTES_PER_HOUR == 0 and (minute + MINUTES_PER_HOUR <= end or minute < pruned_before):
+                    bucket = self.hours.get(minute // MINUTES_PER_HOUR)
+                    minute += MINUTES_PER_HOUR
+                elif minute < pruned_before:
+                    bucket = None
+                    minute += MINUTES_PER_HOUR - minute % MINUTES_PER_HOUR
+                else:
+                    bucket = self.minutes.get(minute)
+                    minute += 1
+
+                if bucket:
+                    for index, value in enumerate(bucket):
+                        totals[index] += value
+
+        return totals
+
+    def count(self, start_time=None, end_time=None):
+        """Count calls started in [start_time, end_time] (minute resolution)"""
+        if start_time is None and end_time is None:
+            return self.total
+        return self._collect(*self._bounds(start_time, end_time))[COUNT]
+
+    def period_stats(self, start_time, end_time):
+        """Get statistics of the calls started in [start_time, end_time] (minute resolution)
+
+        Returns:
+            dict: call_count, avg_duration, avg_mos, avg_packet_loss, avg_jitter
+                  (averages over the counted calls) and quality_distribution
+                  ({quality class: call count}, classes without calls omitted)
+        """
+        totals = self._collect(*self._bounds(start_time, end_time))
+        count = totals[COUNT]
+        if not count:
+            return empty_period_stats()
+
+        return {
+            'call_count': count,
+            'avg_duration': totals[DURATION] / count,
+            'avg_mos': totals[MOS] / count,
+            'avg_packet_loss': totals[LOSS] / count,
+            'avg_jitter': totals[JITTER] / count,
+            'quality_distribution': {
+                name: totals[QUALITY_OFFSET + index]
+                for index, name in enumerate(QUALITY_CLASSES)
+                if totals[QUALITY_OFFSET + index]
+            }
+        }
+
+    def _bounds(self, start_time, end_time):
+        """Minute range of a period, open ends clamped to the stored buckets"""
+        with self.lock:
+            known = list(self.days)
+        first = naive_minute(start_time) if start_time is not None else min(known, default=0) * MINUTES_PER_DAY
+        last = naive_minute(end_time) if end_time is not None else (max(known, default=0) + 1) * MINUTES_PER_DAY - 1
+        return first, last
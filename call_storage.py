@@ -0,0 +1,425 @@
+"""
+Call history storage backends for VoIP Quality Monitor
+CallManager keeps active calls in memory and hands completed calls to a
+history store: the JSON Lines journal (default) or a SQL database through
+SQLAlchemy (SQLite locally, PostgreSQL in production)
+"""
+import base64
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from sqlalchemy import (MetaData, Table, Column, Integer, String, Float, DateTime, ForeignKey,
+                        create_engine, select, delete, func, case, or_, and_)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import StaticPool
+from call_journal import CallJournal
+from call_rollups import CallRollups, empty_period_stats
+
+# Filters accepted by query_calls: {'from', 'to', 'status', 'min_mos', 'max_mos'}
+HISTORY_FILTERS = ('from', 'to', 'status', 'min_mos', 'max_mos')
+
+def encode_cursor(call):
+    """Opaque pagination cursor pointing just after a returned call"""
+    position = json.dumps([call['start_time'], call['call_id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor into (start_time, call_id), raising ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        start_time, call_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(start_time), str(call_id)
+    except Exception:
+        raise ValueError(f"Invalid history cursor: {cursor}")
+
+def match_filters(call, filters):
+    """Check a call record against query_calls filters"""
+    if filters.get('from') and filters['from'].lower() not in (call.get('from_address') or '').lower():
+        return False
+    if filters.get('to') and filters['to'].lower() not in (call.get('to_address') or '').lower():
+        return False
+    if filters.get('status') and call.get('status') != filters['status']:
+        return False
+    if filters.get('min_mos') is not None and (call.get('avg_mos') or 0) < filters['min_mos']:
+        return False
+    if filters.get('max_mos') is not None and (call.get('avg_mos') or 0) > filters['max_mos']:
+        return False
+    return True
+
+class CallHistoryStore:
+    """Interface of a completed-call history backend"""
+
+    def add_call(self, call_data):
+        """Persist a completed call record (including its quality_metrics samples)"""
+        raise NotImplementedError
+
+    def get_calls(self, limit=100):
+        """Get completed calls, most recent first"""
+        return self.query_calls(limit)[0]
+
+    def query_calls(self, limit=100, cursor=None, offset=0, start_time=None, end_time=None, filters=None):
+        """Get a page of completed calls, most recent first
+
+        Args:
+            limit: Maximum number of calls returned
+            cursor: Value of next_cursor from the previous page
+            offset: Matching calls to skip (after the cursor, if any)
+            start_time, end_time: Inclusive datetime bounds on call start time
+            filters: Dict with any of HISTORY_FILTERS
+
+        Returns:
+            tuple: (list of calls, next_cursor or None when there are no more pages)
+        """
+        raise NotImplementedError
+
+    def get_call_metrics(self, call_id):
+        """Get the stored quality samples of a completed call"""
+        raise NotImplementedError
+
+    def count_calls(self, start_time=None, end_time=None):
+        """Count completed calls started in [start_time, end_time]"""
+        raise NotImplementedError
+
+    def get_period_stats(self, start_time, end_time):
+        """Get statistics of the calls started in [start_time, end_time]"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Delete the whole call history"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release files, threads and connections"""
+        pass
+
+class JournalHistoryStore(CallHistoryStore):
+    """In-memory history persisted to the append-only JSON Lines journal
+
+    Only call summaries are kept in memory; quality samples stay in the
+    journal and are read back by offset in get_call_metrics
+    """
+
+    def __init__(self, path='data/calls.jsonl', legacy_file='data/calls.json'):
+        self.journal = CallJournal(path, legacy_file=legacy_file)
+        self.lock = threading.Lock()
+        try:
+            calls = self.journal.load()
+        except Exception as e:
+            print(f"Error loading call history: {e}")
+            calls = []
+            self.journal.start()
+
+        # Calls are kept ordered by start time, with the ISO start times in a
+        # parallel list for bisect (ties keep insertion order)
+        self.calls = sorted(calls, key=lambda x: x['start_time'])
+        self.start_times = [call['start_time'] for call in self.calls]
+        print(f"Loaded {len(self.calls)} calls from history")
+
+        # Summary statistics come from time buckets, never from a history scan
+        self.rollups = CallRollups()
+        for call in self.calls:
+            self._add_rollup(call)
+
+    def _add_rollup(self, call):
+        try:
+            self.rollups.add(call)
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Skipping call {call.get('call_id')} in summary statistics: {e}")
+
+    def add_call(self, call_data):
+        start_time = call_data['start_time']
+        summary = self.journal.append(call_data)
+        with self.lock:
+            # Calls usually end in start order, so this is almost always an append
+            index = bisect_right(self.start_times, start_time)
+            self.start_times.insert(index, start_time)
+            self.calls.insert(index, summary)
+        self._add_rollup(summary)
+
+    def _cursor_index(self, cursor):
+        """Index of the call a cursor points at (the next page ends just below it)"""
+        start_time, call_id = decode_cursor(cursor)
+        low = bisect_left(self.start_times, start_time)
+        high = bisect_right(self.start_times, start_time)
+        for index in range(high - 1, low - 1, -1):
+            if self.calls[index]['call_id'] == call_id:
+                return index
+        return low
+
+    def query_calls(self, limit=100, cursor=None, offset=0, start_time=None, end_time=None, filters=None):
+        filters = {key: value for key, value in (filters or {}).items() if value not in (None, '')}
+        with self.lock:
+            low = 0
+            high = len(self.calls)
+            if start_time is not None:
+                low = bisect_left(self.start_times, start_time.isoformat())
+            if end_time is not None:
+                # '\0' sorts after the exact end time but before any longer timestamp
+                high = bisect_left(self.start_times, end_time.isoformat() + '\0')
+            if cursor:
+                high = min(high, self._cursor_index(cursor))
+
+            if not filters:
+                # Unfiltered pages are a slice of the ordered list
+                stop = max(high - offset, low)
+                start = max(stop - limit, low)
+                page = self.calls[start:stop][::-1]
+                more = start > low
+            else:
+                page = []
+                skipped = 0
+                index = high - 1
+                while index >= low and len(page) < limit:
+                    call = self.calls[index]
+                    if match_filters(call, filters):
+                        if skipped < offset:
+                            skipped += 1
+                        else:
+                            page.append(call)
+                    index -= 1
+                more = index >= low
+
+        next_cursor = encode_cursor(page[-1]) if page and more else None
+        return page, next_cursor
+
+    def get_call_metrics(self, call_id):
+        record = self.journal.read_record(call_id)
+        return record.get('quality_metrics', []) if record else []
+
+    def count_calls(self, start_time=None, end_time=None):
+        return self.rollups.count(start_time, end_time)
+
+    def get_period_stats(self, start_time, end_time):
+        return self.rollups.period_stats(start_time, end_time)
+
+    def clear(self):
+        with self.lock:
+            self.calls = []
+            self.start_times = []
+        self.rollups.clear()
+        self.journal.compact([])
+
+    def close(self):
+        self.journal.close()
+
+# Schema of the call history tables, identical to models.CallRecord and
+# models.QualityMetric so the Flask app and CallManager can share a database
+metadata = MetaData()
+
+call_records = Table(
+    'call_records', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('call_id', String(255), unique=True, nullable=False),
+    Column('start_time', DateTime, nullable=False, index=True),
+    Column('end_time', DateTime, nullable=True),
+    Column('duration', Float, default=0),
+    Column('from_address', String(255), nullable=True),
+    Column('to_address', String(255), nullable=True),
+    Column('status', String(50), default='active'),
+    Column('avg_mos', Float, default=0),
+    Column('min_mos', Float, default=5.0),
+    Column('max_mos', Float, default=1.0),
+    Column('packet_loss_rate', Float, default=0),
+    Column('avg_jitter', Float, default=0),
+    Column('avg_delay', Float, default=0),
+    Column('created_at', DateTime, default=datetime.now),
+    Column('updated_at', DateTime, default=datetime.now, onupdate=datetime.now),
+)
+
+quality_metrics = Table(
+    'quality_metrics', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('call_id', String(255), ForeignKey('call_records.call_id'), nullable=False, index=True),
+    Column('timestamp', DateTime, nullable=False),
+    Column('mos_score', Float, nullable=False),
+    Column('packet_loss_rate', Float, default=0),
+    Column('jitter', Float, default=0),
+    Column('delay', Float, default=0),
+    Column('packets_received', Integer, default=0),
+    Column('packets_lost', Integer, default=0),
+)
+
+CALL_COLUMNS = ('call_id', 'duration', 'from_address', 'to_address', 'status', 'avg_mos',
+                'min_mos', 'max_mos', 'packet_loss_rate', 'avg_jitter', 'avg_delay')
+
+class SQLHistoryStore(CallHistoryStore):
+    """Call history in a SQL database, queried through the start_time/call_id indexes"""
+
+    def __init__(self, url):
+        # Heroku/Replit style URLs use the scheme SQLAlchemy 1.4+ no longer accepts
+        if url.startswith('postgres://'):
+            url = 'postgresql://' + url[len('postgres://'):]
+
+        options = {'pool_pre_ping': True}
+        if url.startswith('sqlite'):
+            options['connect_args'] = {'check_same_thread': False}
+            path = url.split(':///', 1)[1] if ':///' in url else ''
+            if not path or path == ':memory:':
+                # In-memory databases exist per connection, share a single one
+                options['poolclass'] = StaticPool
+            elif os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.engine = create_engine(url, **options)
+        metadata.create_all(self.engine)
+        print(f"Call history stored in {self.engine.url.render_as_string(hide_password=True)}")
+
+    def add_call(self, call_data):
+        row = {column: call_data[column] for column in CALL_COLUMNS if column in call_data}
+        row['call_id'] = call_data['call_id']
+        row['from_address'] = call_data.get('from_address') or call_data.get('from')
+        row['to_address'] = call_data.get('to_address') or call_data.get('to')
+        row['start_time'] = datetime.fromisoformat(call_data['start_time'])
+        row['end_time'] = datetime.fromisoformat(call_data['end_time']) if call_data.get('end_time') else None
+
+        samples = [
+            {
+                'call_id': row['call_id'],
+                'timestamp': datetime.fromtimestamp(sample['timestamp']),
+                'mos_score': sample['mos_score'],
+                'packet_loss_rate': sample.get('packet_loss_rate', 0),
+                'jitter': sample.get('jitter', 0),
+                'delay': sample.get('delay', 0),
+                'packets_received': sample.get('packets_received', 0),
+                'packets_lost': sample.get('packets_lost', 0)
+            }
+            for sample in call_data.get('quality_metrics', [])
+        ]
+
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(call_records.insert(), [row])
+                if samples:
+                    # executemany: one round trip for all the samples of the call
+                    conn.execute(quality_metrics.insert(), samples)
+        except IntegrityError as e:
+            print(f"Call {row['call_id']} already stored in history: {e.orig}")
+
+    def _row_to_call(self, row):
+        call = dict(row._mapping)
+        call.pop('id', None)
+        for column in ('start_time', 'end_time', 'created_at', 'updated_at'):
+            if call.get(column) is not None:
+                call[column] = call[column].isoformat()
+        call['from'] = call['from_address']
+        call['to'] = call['to_address']
+        return call
+
+    def query_calls(self, limit=100, cursor=None, offset=0, start_time=None, end_time=None, filters=None):
+        c = call_records.c
+        filters = filters or {}
+        query = self._period(select(call_records), start_time, end_time)
+
+        if cursor:
+            # Keyset pagination on the (start_time, call_id) order, served by the start_time index
+            cursor_start, cursor_id = decode_cursor(cursor)
+            cursor_start = datetime.fromisoformat(cursor_start)
+            query = query.where(or_(c.start_time < cursor_start,
+                                    and_(c.start_time == cursor_start, c.call_id < cursor_id)))
+        if filters.get('from'):
+            query = query.where(c.from_address.ilike(f"%{filters['from']}%"))
+        if filters.get('to'):
+            query = query.where(c.to_address.ilike(f"%{filters['to']}%"))
+        if filters.get('status'):
+            query = query.where(c.status == filters['status'])
+        if filters.get('min_mos') is not None:
+            query = query.where(c.avg_mos >= filters['min_mos'])
+        if filters.get('max_mos') is not None:
+            query = query.where(c.avg_mos <= filters['max_mos'])
+
+        # Fetch one extra row to know whether another page exists
+        query = query.order_by(c.start_time.desc(), c.call_id.desc()).offset(offset).limit(limit + 1)
+        with self.engine.connect() as conn:
+            page = [self._row_to_call(row) for row in conn.execute(query)]
+
+        more = len(page) > limit
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1]) if page and more else None
+        return page, next_cursor
+
+    def get_call_metrics(self, call_id):
+        query = (select(quality_metrics)
+                 .where(quality_metrics.c.call_id == call_id)
+                 .order_by(quality_metrics.c.timestamp))
+        with self.engine.connect() as conn:
+            metrics = []
+            for row in conn.execute(query):
+                sample = dict(row._mapping)
+                sample.pop('id', None)
+                sample.pop('call_id', None)
+                sample['timestamp'] = sample['timestamp'].timestamp()
+                metrics.append(sample)
+            return metrics
+
+    def _period(self, query, start_time, end_time):
+        if start_time is not None:
+            query = query.where(call_records.c.start_time >= start_time)
+        if end_time is not None:
+            query = query.where(call_records.c.start_time <= end_time)
+        return query
+
+    def count_calls(self, start_time=None, end_time=None):
+        query = self._period(select(func.count()).select_from(call_records), start_time, end_time)
+        with self.engine.connect() as conn:
+            return conn.execute(query).scalar() or 0
+
+    def get_period_stats(self, start_time, end_time):
+        c = call_records.c
+        totals = self._period(select(
+            func.count(),
+            func.sum(c.duration),
+            func.sum(case((c.avg_mos > 0, c.avg_mos), else_=0)),
+            func.sum(c.packet_loss_rate),
+            func.sum(c.avg_jitter)
+        ), start_time, end_time)
+
+        quality = case(
+            (c.avg_mos >= 4.0, 'excellent'),
+            (c.avg_mos >= 3.5, 'good'),
+            (c.avg_mos >= 3.0, 'fair'),
+            (c.avg_mos >= 2.0, 'poor'),
+            else_='bad'
+        ).label('quality')
+        distribution = self._period(select(quality, func.count()), start_time, end_time).group_by(quality)
+
+        with self.engine.connect() as conn:
+            count, duration, mos, packet_loss, jitter = conn.execute(totals).one()
+            if not count:
+                return empty_period_stats()
+            quality_dist = {name: total for name, total in conn.execute(distribution)}
+
+        return {
+            'call_count': count,
+            'avg_duration': (duration or 0) / count,
+            'avg_mos': (mos or 0) / count,
+            'avg_packet_loss': (packet_loss or 0) / count,
+            'avg_jitter': (jitter or 0) / count,
+            'quality_distribution': quality_dist
+        }
+
+    def clear(self):
+        with self.engine.begin() as conn:
+            conn.execute(delete(quality_metrics))
+            conn.execute(delete(call_records))
+
+    def close(self):
+        self.engine.dispose()
+
+def create_history_store(url=None):
+    """Create the history backend: SQL when CALL_HISTORY_URL is set, else the journal
+
+    Args:
+        url: SQLAlchemy URL, e.g. sqlite:///data/calls.db or postgresql://user@host/db
+
+    Returns:
+        CallHistoryStore: The configured backend
+    """
+    url = url or os.environ.get('CALL_HISTORY_URL')
+    if url:
+        try:
+            return SQLHistoryStore(url)
+        except Exception as e:
+            print(f"Error opening call history database, falling back to journal: {e}")
+    return JournalHistoryStore()
@@ -45,7 +45,7 @@ class CallRecord(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     call_id = db.Column(db.String(255), unique=True, nullable=False)
-    start_time = db.Column(db.DateTime, nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False, index=True)
     end_time = db.Column(db.DateTime, nullable=True)
     duration = db.Column(db.Float, default=0)
     from_address = db.Column(db.String(255), nullable=True)
@@ -68,7 +68,7 @@ class QualityMetric(db.Model):
     __tablename__ = 'quality_metrics'
     
     id = db.Column(db.Integer, primary_key=True)
-    call_id = db.Column(db.String(255), db.ForeignKey('call_records.call_id'), nullable=False)
+    call_id = db.Column(db.String(255), db.ForeignKey('call_records.call_id'), nullable=False, index=True)
     timestamp = db.Column(db.DateTime, nullable=False)
     
     # Metrics
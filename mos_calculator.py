@@ -1,21 +1,58 @@
 import math
 import numpy as np
 
+# Codecs known to the E-model, indexed by the codec ids used for batch scoring
+CODECS = ('G.711', 'G.729', 'G.729A', 'G.729AB', 'G.723.1', 'GSM', 'iLBC', 'Opus', 'OPUS', 'Unknown')
+CODEC_IDS = {codec: index for index, codec in enumerate(CODECS)}
+
+def codec_id(codec):
+    """Map a codec name to its batch scoring id"""
+    return CODEC_IDS.get(codec, CODEC_IDS['Unknown'])
+
+# Base equipment impairment for different codecs (optimized for Welcome Italia)
+CODEC_IMPAIRMENTS = {
+    'G.711': 0,      # PCMU/PCMA - Lossless (alaw/ulaw)
+    'G.729': 11,     # G.729 - 8kbps (Welcome Italia primary codec)
+    'G.729A': 11,    # G.729 Annex A variant
+    'G.729AB': 11,   # G.729 Annex A+B variant
+    'G.723.1': 15,   # G.723.1 - 5.3/6.3kbps
+    'GSM': 20,       # GSM - 13kbps
+    'iLBC': 8,       # iLBC - 15.2kbps
+    'Opus': 2,       # Opus - Variable bitrate, high quality
+    'OPUS': 2        # Opus uppercase variant
+}
+
+# Packet loss robustness factor Bpl (codec dependent)
+CODEC_ROBUSTNESS = {
+    'G.711': 1,      # Low robustness - uncompressed
+    'G.729': 2,      # Medium robustness
+    'G.723.1': 2,    # Medium robustness
+    'GSM': 2,        # Medium robustness
+    'iLBC': 1.5,     # Better than G.711, designed for packet loss
+    'Opus': 1.2,     # High robustness - modern codec with error correction
+    'OPUS': 1.2      # Opus uppercase variant
+}
+
+# Per codec id lookup arrays for MOSCalculator.calculate_mos_batch
+IMPAIRMENT_BY_ID = np.array([CODEC_IMPAIRMENTS.get(codec, 0) for codec in CODECS], dtype=np.float64)
+ROBUSTNESS_BY_ID = np.array([CODEC_ROBUSTNESS.get(codec, 2) for codec in CODECS], dtype=np.float64)
+
 class MOSCalculator:
     """
     Calculate Mean Opinion Score (MOS) using E-Model algorithm
     for no-reference quality assessment
     """
     
-    def __init__(self):
+    def __init__(self, debug=False):
         # E-Model parameters
         self.Ro = 93.2  # Basic signal-to-noise ratio
         self.Is = 1.41  # Simultaneous impairment factor
         self.Id = 0     # Delay impairment factor (calculated)
         self.Ie_eff = 0 # Equipment impairment factor (calculated)
         self.A = 0      # Advantage factor
+        self.debug = debug
         
-    def calculate_mos(self, packet_loss_rate=0, jitter=0, delay=0, codec='G.711'):
+    def calculate_mos(self, packet_loss_rate=0, jitter=0, delay=0, codec='G.711', burst_ratio=1.0):
         """
         Calculate MOS score using E-Model algorithm
         
@@ -24,17 +61,18 @@ class MOSCalculator:
             jitter: Jitter in milliseconds
             delay: One-way delay in milliseconds
             codec: Audio codec used
+            burst_ratio: Burst ratio BurstR (1 for random loss, >1 for bursty loss)
             
         Returns:
             MOS score (1.0 - 5.0)
         """
         try:
-            # Debug logging
-            print(f"DEBUG MOS: Calculating with Loss={packet_loss_rate}%, Jitter={jitter}ms, Delay={delay}ms, Codec={codec}")
+            if self.debug:
+                print(f"DEBUG MOS: Calculating with Loss={packet_loss_rate}%, Jitter={jitter}ms, Delay={delay}ms, Codec={codec}, BurstR={burst_ratio:.2f}")
             
             # Calculate impairment factors
             Id = self._calculate_delay_impairment(delay)
-            Ie_eff = self._calculate_equipment_impairment(packet_loss_rate, jitter, codec)
+            Ie_eff = self._calculate_equipment_impairment(packet_loss_rate, jitter, codec, burst_ratio)
             
             # Calculate R-factor
             R = self.Ro - self.Is - Id - Ie_eff + self.A
@@ -45,7 +83,8 @@ class MOSCalculator:
             # Convert R-factor to MOS
             mos = self._r_to_mos(R)
             
-            print(f"DEBUG MOS: R-factor={R:.2f}, Final MOS={mos:.2f}")
+            if self.debug:
+                print(f"DEBUG MOS: R-factor={R:.2f}, Final MOS={mos:.2f}")
             
             return round(mos, 2)
             
@@ -53,6 +92,51 @@ class MOSCalculator:
             print(f"Error calculating MOS: {e}")
             return 1.0  # Return minimum MOS on error
             
+    def calculate_mos_batch(self, packet_loss_rate, jitter, delay, codec_ids, burst_ratio=None):
+        """
+        Vectorized calculate_mos over NumPy arrays
+        
+        Args:
+            packet_loss_rate: Packet loss percentages (0-100)
+            jitter: Jitters in milliseconds
+            delay: One-way delays in milliseconds
+            codec_ids: Codec ids (see codec_id) or a single id for all rows
+            burst_ratio: Optional burst ratios, random loss when omitted
+            
+        Returns:
+            Array of MOS scores rounded like calculate_mos
+        """
+        packet_loss_rate, jitter, delay, codec_ids = np.broadcast_arrays(
+            np.asarray(packet_loss_rate, dtype=np.float64),
+            np.asarray(jitter, dtype=np.float64),
+            np.asarray(delay, dtype=np.float64),
+            np.asarray(codec_ids, dtype=np.intp)
+        )
+        burst_ratio = np.maximum(1.0, np.asarray(1.0 if burst_ratio is None else burst_ratio, dtype=np.float64))
+        
+        # Delay impairment Id
+        Id = np.where(
+            delay <= 100, 0.0,
+            np.where(delay <= 200, 0.024 * delay - 2.4, 0.11 * (delay - 177.3) + 2.4)
+        )
+        
+        # Equipment impairment Ie_eff (G.107 packet loss model)
+        Ie = IMPAIRMENT_BY_ID[codec_ids]
+        Bpl = ROBUSTNESS_BY_ID[codec_ids]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            loss_impairment = Ie + (95 - Ie) * (packet_loss_rate / (packet_loss_rate / burst_ratio + Bpl))
+        Ie = np.where(packet_loss_rate > 0, loss_impairment, Ie)
+        Ie = Ie + np.where(jitter > 20, np.minimum(20, (jitter - 20) * 0.5), 0.0)
+        
+        R = np.clip(self.Ro - self.Is - Id - Ie + self.A, 0, 100)
+        return np.round(self._r_to_mos_batch(R), 2)
+        
+    def _r_to_mos_batch(self, R):
+        """Vectorized _r_to_mos"""
+        mos = 1.0 + 0.035 * R + 7e-6 * R * (R - 60) * (100 - R)
+        mos = np.where(R < 6.5, 1.0, mos)
+        return np.where(R >= 93.2, 4.5, mos)
+        
     def _calculate_delay_impairment(self, delay):
         """Calculate delay impairment factor Id"""
         if delay <= 100:
@@ -62,42 +146,19 @@ class MOSCalculator:
         else:
             return 0.11 * (delay - 177.3) + 2.4
             
-    def _calculate_equipment_impairment(self, packet_loss_rate, jitter, codec):
+    def _calculate_equipment_impairment(self, packet_loss_rate, jitter, codec, burst_ratio=1.0):
         """Calculate equipment impairment factor Ie_eff"""
-        # Base equipment impairment for different codecs (optimized for Welcome Italia)
-        codec_impairments = {
-            'G.711': 0,      # PCMU/PCMA - Lossless (alaw/ulaw)
-            'G.729': 11,     # G.729 - 8kbps (Welcome Italia primary codec)
-            'G.729A': 11,    # G.729 Annex A variant
-            'G.729AB': 11,   # G.729 Annex A+B variant
-            'G.723.1': 15,   # G.723.1 - 5.3/6.3kbps
-            'GSM': 20,       # GSM - 13kbps
-            'iLBC': 8,       # iLBC - 15.2kbps
-            'Opus': 2,       # Opus - Variable bitrate, high quality
-            'OPUS': 2        # Opus uppercase variant
-        }
-        
-        Ie = codec_impairments.get(codec, 0)
+        Ie = CODEC_IMPAIRMENTS.get(codec, 0)
         
         # Packet loss impairment
         if packet_loss_rate > 0:
-            # Burstiness factor (simplified)
-            Bpl = 1  # Random packet loss assumption
-            
-            # Packet loss robustness factor (codec dependent)
-            codec_robustness = {
-                'G.711': 1,      # Low robustness - uncompressed
-                'G.729': 2,      # Medium robustness
-                'G.723.1': 2,    # Medium robustness
-                'GSM': 2,        # Medium robustness
-                'iLBC': 1.5,     # Better than G.711, designed for packet loss
-                'Opus': 1.2,     # High robustness - modern codec with error correction
-                'OPUS': 1.2      # Opus uppercase variant
-            }
-            Ppl = codec_robustness.get(codec, 2)
+            # Burst ratio measured on the RTP stream (1 = random loss)
+            BurstR = max(1.0, burst_ratio)
+            Bpl = CODEC_ROBUSTNESS.get(codec, 2)
+            Ppl = packet_loss_rate
             
-            # Calculate packet loss impairment
-            loss_impairment = Ie + (95 - Ie) * (packet_loss_rate / (packet_loss_rate + Bpl))
+            # ITU-T G.107: Ie_eff = Ie + (95 - Ie) * Ppl / (Ppl / BurstR + Bpl)
+            loss_impairment = Ie + (95 - Ie) * (Ppl / (Ppl / BurstR + Bpl))
             Ie = loss_impairment
             
         # Jitter impairment (simplified model)
@@ -155,15 +216,15 @@ class MOSCalculator:
             
         return recommendations
         
-    def calculate_detailed_metrics(self, packet_loss_rate, jitter, delay, codec='G.711'):
+    def calculate_detailed_metrics(self, packet_loss_rate, jitter, delay, codec='G.711', burst_ratio=1.0):
         """Calculate detailed quality metrics and analysis"""
-        mos_score = self.calculate_mos(packet_loss_rate, jitter, delay, codec)
+        mos_score = self.calculate_mos(packet_loss_rate, jitter, delay, codec, burst_ratio)
         quality_category = self.calculate_quality_category(mos_score)
         recommendations = self.get_quality_recommendations(packet_loss_rate, jitter, delay)
         
         # Calculate R-factor components for detailed analysis
         Id = self._calculate_delay_impairment(delay)
-        Ie_eff = self._calculate_equipment_impairment(packet_loss_rate, jitter, codec)
+        Ie_eff = self._calculate_equipment_impairment(packet_loss_rate, jitter, codec, burst_ratio)
         R = self.Ro - self.Is - Id - Ie_eff + self.A
         
         return {
@@ -180,6 +241,76 @@ class MOSCalculator:
                 'packet_loss_rate': packet_loss_rate,
                 'jitter': jitter,
                 'delay': delay,
-                'codec': codec
+                'codec': codec,
+                'burst_ratio': burst_ratio
             }
         }
+
+
+class MOSGrid:
+    """
+    Precomputed MOS grid (loss x jitter x delay per codec) with trilinear
+    interpolation, for rescoring large batches of random-loss samples.
+    Rows outside the grid range fall back to the exact vectorized E-model.
+    """
+    
+    def __init__(self, calculator=None, max_loss=100.0, loss_step=0.5,
+                 max_jitter=60.0, jitter_step=2.0, max_delay=500.0, delay_step=10.0):
+        self.calculator = calculator or MOSCalculator()
+        self.axes = (
+            np.arange(0, max_loss + loss_step / 2, loss_step),
+            np.arange(0, max_jitter + jitter_step / 2, jitter_step),
+            np.arange(0, max_delay + delay_step / 2, delay_step)
+        )
+        self.steps = np.array([loss_step, jitter_step, delay_step])
+        self.limits = np.array([axis[-1] for axis in self.axes])
+        self.grids = {}  # {codec_id: float32 array}, built on first use
+        
+    def get_grid(self, codec_id):
+        """Build (once) and return the grid for a codec id"""
+        grid = self.grids.get(codec_id)
+        if grid is None:
+            loss, jitter, delay = np.meshgrid(*self.axes, indexing='ij')
+            grid = self.calculator.calculate_mos_batch(loss, jitter, delay, codec_id).astype(np.float32)
+            self.grids[codec_id] = grid
+        return grid
+        
+    def lookup(self, packet_loss_rate, jitter, delay, codec_ids):
+        """Interpolated MOS scores for arrays of samples (random loss)"""
+        points = np.stack(np.broadcast_arrays(
+            np.asarray(packet_loss_rate, dtype=np.float64),
+            np.asarray(jitter, dtype=np.float64),
+            np.asarray(delay, dtype=np.float64)
+        ), axis=-1)
+        codec_ids = np.broadcast_to(np.asarray(codec_ids, dtype=np.intp), points.shape[:-1])
+        
+        # Jitter impairment is saturated past the grid, so jitter can be clamped
+        points[..., 1] = np.minimum(points[..., 1], self.limits[1])
+        inside = np.all((points >= 0) & (points <= self.limits), axis=-1)
+        
+        mos = np.empty(points.shape[:-1])
+        if not np.all(inside):
+            outside = ~inside
+            mos[outside] = self.calculator.calculate_mos_batch(
+                points[outside, 0], points[outside, 1], points[outside, 2], codec_ids[outside]
+            )
+        
+        scaled = points[inside] / self.steps
+        lower = np.minimum(np.floor(scaled).astype(np.intp), [len(axis) - 2 for axis in self.axes])
+        fraction = scaled - lower
+        ids = codec_ids[inside]
+        
+        result = np.empty(len(scaled))
+        for cid in np.unique(ids):
+            rows = ids == cid
+            grid = self.get_grid(int(cid))
+            i, j, k = lower[rows].T
+            fi, fj, fk = fraction[rows].T
+            value = 0.0
+            for di, wi in ((0, 1 - fi), (1, fi)):
+                for dj, wj in ((0, 1 - fj), (1, fj)):
+                    for dk, wk in ((0, 1 - fk), (1, fk)):
+                        value = value + wi * wj * wk * grid[i + di, j + dj, k + dk]
+            result[rows] = value
+        mos[inside] = np.round(result, 2)
+        return mos
@@ -0,0 +1,284 @@
+"""
+RTP ingestion engine for VoIP Quality Monitor
+Owns the RTP sockets of every monitored call and demultiplexes packets to
+per-call RTPProcessor state from a single selector loop
+"""
+import selectors
+import socket
+import threading
+import time
+import numpy as np
+from rtp_processor import RTPProcessor, decode_rtp_headers
+from rtp_ports import RTPPortAllocator
+
+class RTPEngine:
+    def __init__(self, call_manager, host='0.0.0.0', port_min=10000, port_max=20000):
+        self.call_manager = call_manager
+        self.host = host
+        self.port_allocator = RTPPortAllocator(port_min, port_max)
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.idle_check_interval = 1.0  # Seconds between inactive call sweeps
+        self.leak_check_interval = 30   # Seconds between leaked port sweeps
+
+        # Preallocated receive ring: one contiguous buffer split in fixed slots,
+        # drained with recvfrom_into so no per-packet bytes objects are created
+        self.batch_size = 64    # Max datagrams drained per socket wakeup
+        self.slot_size = 2048   # Bytes per slot (larger than any RTP packet on Ethernet)
+        self.recv_buffer = bytearray(self.batch_size * self.slot_size)
+        recv_view = memoryview(self.recv_buffer)
+        self.recv_slots = [
+            recv_view[i * self.slot_size:(i + 1) * self.slot_size]
+            for i in range(self.batch_size)
+        ]
+        self.slot_offsets = np.arange(self.batch_size, dtype=np.int64) * self.slot_size
+
+        # Port and stream registry
+        # 'unbound' holds the streams of a port still waiting for their first packet
+        self.ports = {}    # {port: {'socket': sock, 'streams': {call_id: processor}, 'unbound': {call_id: None}}}
+        self.streams = {}  # {call_id: processor}
+        self.routes = {}   # {(port, source_addr) or (port, ssrc): call_id}
+        self.call_routes = {}  # {call_id: [route keys]}, so detaching never scans routes
+        self.expected_sources = {}  # {call_id: remote_ip announced in SDP}
+
+        # Socket registrations are applied by the loop thread only, so the
+        # selector is never mutated while select() is running
+        self.pending = []
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+
+    def start(self):
+        """Start the selector loop thread"""
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ, None)
+        self.thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.thread.start()
+        print("RTP engine started")
+
+    def stop(self):
+        """Stop the selector loop and close all RTP sockets"""
+        self.running = False
+        self.wakeup()
+        if self.thread:
+            self.thread.join(timeout=2)
+
+        with self.lock:
+            for port_info in self.ports.values():
+                try:
+                    port_info['socket'].close()
+                except OSError:
+                    pass
+            self.ports.clear()
+            self.streams.clear()
+            self.routes.clear()
+            self.call_routes.clear()
+            self.expected_sources.clear()
+
+    def wakeup(self):
+        """Interrupt a blocking select() from another thread"""
+        try:
+            self.wakeup_writer.send(b'\0')
+        except OSError:
+            pass
+
+    def allocate_port(self, call_id):
+        """Reserve a dedicated RTP port for a call"""
+        return self.port_allocator.allocate(call_id)
+
+    def add_stream(self, call_id, port, remote_ip=None):
+        """Attach a call to an RTP port, binding the port on first use"""
+        if not self.running:
+            self.start()
+
+        processor = RTPProcessor(call_id, port, self.call_manager)
+
+        with self.lock:
+            port_info = self.ports.get(port)
+            if port_info is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    sock.bind((self.host, port))
+                    sock.setblocking(False)
+                except OSError:
+                    # The port is unusable; don't keep it reserved for this call
+                    sock.close()
+                    self.port_allocator.release(call_id)
+                    raise
+                port_info = {'socket': sock, 'streams': {}, 'unbound': {}}
+                self.ports[port] = port_info
+                self.pending.append(('register', sock, port))
+
+            port_info['streams'][call_id] = processor
+            if call_id not in self.call_routes:
+                port_info['unbound'][call_id] = None
+            self.streams[call_id] = processor
+            self.expected_sources[call_id] = remote_ip
+
+        self.wakeup()
+        print(f"RTP stream for call {call_id} attached to port {port} (streams on port: {len(port_info['streams'])})")
+        return processor
+
+    def remove_stream(self, call_id):
+        """Detach a call, closing its port when no other stream uses it"""
+        self.port_allocator.release(call_id)
+
+        with self.lock:
+            processor = self.streams.pop(call_id, None)
+            self.expected_sources.pop(call_id, None)
+            if processor is None:
+                return
+
+            for key in self.call_routes.pop(call_id, ()):
+                if self.routes.get(key) == call_id:
+                    del self.routes[key]
+
+            port_info = self.ports.get(processor.port)
+            if port_info:
+                port_info['streams'].pop(call_id, None)
+                port_info['unbound'].pop(call_id, None)
+                if not port_info['streams']:
+                    del self.ports[processor.port]
+                    self.pending.append(('unregister', port_info['socket'], processor.port))
+
+        self.wakeup()
+        print(f"RTP stream for call {call_id} detached from port {processor.port}")
+
+    def get_stream(self, call_id):
+        """Get the RTPProcessor state of a call"""
+        return self.streams.get(call_id)
+
+    def apply_pending(self):
+        """Apply socket registrations queued by other threads"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+
+        for action, sock, port in pending:
+            try:
+                if action == 'register':
+                    self.selector.register(sock, selectors.EVENT_READ, port)
+                else:
+                    self.selector.unregister(sock)
+                    sock.close()
+            except (KeyError, ValueError, OSError) as e:
+                print(f"Error updating RTP selector for port {port}: {e}")
+
+    def run_loop(self):
+        """Single selector loop serving every RTP port"""
+        last_check = last_leak_check = time.time()
+
+        while self.running:
+            try:
+                self.apply_pending()
+                events = self.selector.select(timeout=self.idle_check_interval)
+
+                for key, _ in events:
+                    if key.data is None:
+                        try:
+                            while self.wakeup_reader.recv(64):
+                                pass
+                        except (BlockingIOError, OSError):
+                            pass
+                        continue
+
+                    self.handle_readable(key.fileobj, key.data)
+
+                now = time.time()
+                if now - last_check >= self.idle_check_interval:
+                    last_check = now
+                    self.remove_inactive_streams()
+
+                if now - last_leak_check >= self.leak_check_interval:
+                    last_leak_check = now
+                    self.port_allocator.release_leaked(self.call_manager.is_call_active)
+
+            except Exception as e:
+                print(f"Error in RTP engine loop: {e}")
+
+    def handle_readable(self, sock, port):
+        """Drain up to batch_size datagrams from a port and dispatch them per stream"""
+        lengths = []
+        addrs = []
+        arrivals = []
+        recv_into = sock.recvfrom_into
+        clock = time.time
+
+        for slot in self.recv_slots:
+            try:
+                nbytes, addr = recv_into(slot)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                print(f"Error receiving RTP on port {port}: {e}")
+                break
+            lengths.append(nbytes)
+            addrs.append(addr)
+            arrivals.append(clock())
+
+        if not lengths:
+            return
+
+        # Decode every header of the wakeup in one vectorized pass
+        offsets = self.slot_offsets[:len(lengths)]
+        headers = decode_rtp_headers(self.recv_buffer, offsets, lengths, arrivals)
+
+        # Group packets per stream, keeping arrival order inside each group
+        groups = {}  # {processor: ([row indexes], addr)}
+        for row, (ssrc, slot) in enumerate(zip(headers['ssrc'].tolist(), headers['index'].tolist())):
+            addr = addrs[slot]
+            processor = self.demultiplex(port, addr, ssrc)
+            if processor is not None:
+                group = groups.get(processor)
+                if group is None:
+                    group = groups[processor] = ([], addr)
+                group[0].append(row)
+
+        for processor, (rows, addr) in groups.items():
+            processor.process_batch(headers[rows], addr)
+
+    def demultiplex(self, port, addr, ssrc):
+        """Find the stream a packet belongs to by source address, then SSRC"""
+        call_id = self.routes.get((port, addr))
+        if call_id is None:
+            call_id = self.routes.get((port, ssrc))
+            if call_id is None:
+                call_id = self.learn_route(port, addr, ssrc)
+
+        if call_id is None:
+            return None
+        return self.streams.get(call_id)
+
+    def learn_route(self, port, addr, ssrc):
+        """Bind an unknown source to a stream still waiting for its first packet"""
+        with self.lock:
+            port_info = self.ports.get(port)
+            if not port_info or not port_info['unbound']:
+                return None  # Stray packet: nothing on this port is waiting for a source
+
+            # Prefer the stream whose SDP announced this source address
+            candidates = port_info['unbound']
+            call_id = next((call_id for call_id in candidates if self.expected_sources.get(call_id) == addr[0]),
+                           next(iter(candidates)))
+            del candidates[call_id]
+
+            keys = [(port, addr), (port, ssrc)]
+            for key in keys:
+                self.routes[key] = call_id
+            self.call_routes[call_id] = keys
+
+        print(f"RTP source {addr} (SSRC {ssrc:#010x}) bound to call {call_id} on port {port}")
+        return call_id
+
+    def remove_inactive_streams(self):
+        """Detach streams whose call is no longer active"""
+        for call_id in list(self.streams.keys()):
+            if not self.call_manager.is_call_active(call_id):
+                print(f"Call {call_id} no longer active, stopping RTP processing")
+                self.remove_stream(call_id)
@@ -0,0 +1,77 @@
+"""
+RTP port allocator for VoIP Quality Monitor
+Hands out even-numbered RTP ports (RTCP uses port + 1) from a configurable range
+"""
+import threading
+import time
+from collections import deque
+
+class RTPPortAllocator:
+    def __init__(self, port_min=10000, port_max=20000):
+        # RTP ports are even (RFC 3550 section 11), the odd neighbour is left for RTCP
+        self.port_min = port_min + (port_min % 2)
+        self.port_max = port_max
+        self.lock = threading.Lock()
+
+        self.free_ports = deque(range(self.port_min, self.port_max, 2))
+        self.allocated = {}   # {port: {'call_id': call_id, 'allocated_at': timestamp}}
+        self.call_ports = {}  # {call_id: port}
+
+    def allocate(self, call_id):
+        """Reserve a port for a call, returning None when the range is exhausted"""
+        with self.lock:
+            port = self.call_ports.get(call_id)
+            if port is not None:
+                return port
+
+            if not self.free_ports:
+                print(f"RTP port range {self.port_min}-{self.port_max} exhausted, cannot allocate port for call {call_id}")
+                return None
+
+            port = self.free_ports.popleft()
+            self.allocated[port] = {'call_id': call_id, 'allocated_at': time.time()}
+            self.call_ports[call_id] = port
+            return port
+
+    def release(self, call_id):
+        """Return the port of a call to the pool"""
+        with self.lock:
+            port = self.call_ports.pop(call_id, None)
+            if port is None:
+                return None
+
+            del self.allocated[port]
+            self.free_ports.append(port)
+            return port
+
+    def get_port(self, call_id):
+        """Get the port currently allocated to a call"""
+        return self.call_ports.get(call_id)
+
+    def release_leaked(self, is_call_active, min_age=30):
+        """Release ports whose call ended without freeing them (BYE lost, orphaned calls)"""
+        now = time.time()
+        with self.lock:
+            leaked = [
+                info['call_id'] for info in self.allocated.values()
+                if now - info['allocated_at'] >= min_age
+            ]
+
+        released = []
+        for call_id in leaked:
+            if not is_call_active(call_id):
+                port = self.release(call_id)
+                if port is not None:
+                    print(f"Reclaimed leaked RTP port {port} from call {call_id}")
+                    released.append(port)
+        return released
+
+    def get_stats(self):
+        """Get allocator usage statistics"""
+        with self.lock:
+            return {
+                'port_min': self.port_min,
+                'port_max': self.port_max,
+                'allocated': len(self.allocated),
+                'free': len(self.free_ports)
+            }
@@ -1,74 +1,140 @@
-import socket
 import struct
-import threading
 import time
-from datetime import datetime
 import numpy as np
 from mos_calculator import MOSCalculator
+from rtp_stats import JitterEstimator, SequenceTracker, BurstGapTracker, CODEC_CLOCK_RATES, DEFAULT_CLOCK_RATE
+
+# Column layout returned by decode_rtp_headers, one record per packet
+RTP_HEADER_DTYPE = np.dtype([
+    ('version', np.uint8),
+    ('payload_type', np.uint8),
+    ('marker', np.uint8),
+    ('sequence', np.uint16),
+    ('timestamp', np.uint32),
+    ('ssrc', np.uint32),
+    ('length', np.uint32),
+    ('arrival_time', np.float64),
+    ('index', np.uint32),  # Position of the packet in the decoded batch
+])
+
+_RTP_HEADER_OFFSETS = np.arange(12)
+
+def decode_rtp_headers(buffer, offsets, lengths, arrival_times):
+    """
+    Decode the fixed RTP headers of N packets stored in one contiguous buffer
+    
+    Args:
+        buffer: bytes-like object holding the packets
+        offsets: start offset of each packet in the buffer
+        lengths: length in bytes of each packet
+        arrival_times: arrival time of each packet (seconds since epoch)
+        
+    Returns:
+        Structured array with RTP_HEADER_DTYPE, packets shorter than the
+        12-byte fixed header or not RTP version 2 are dropped
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.uint32)
+    arrival_times = np.asarray(arrival_times, dtype=np.float64)
+    
+    valid = lengths >= 12
+    index = np.flatnonzero(valid)
+    offsets = offsets[valid]
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    
+    # Gather the 12 header bytes of every packet into an (N, 12) matrix
+    header = raw[offsets[:, None] + _RTP_HEADER_OFFSETS]
+    
+    decoded = np.empty(len(offsets), dtype=RTP_HEADER_DTYPE)
+    decoded['version'] = header[:, 0] >> 6
+    decoded['marker'] = header[:, 1] >> 7
+    decoded['payload_type'] = header[:, 1] & 0x7F
+    decoded['sequence'] = (header[:, 2].astype(np.uint16) << 8) | header[:, 3]
+    decoded['timestamp'] = np.ascontiguousarray(header[:, 4:8]).view('>u4').ravel()
+    decoded['ssrc'] = np.ascontiguousarray(header[:, 8:12]).view('>u4').ravel()
+    decoded['length'] = lengths[valid]
+    decoded['arrival_time'] = arrival_times[valid]
+    decoded['index'] = index
+    
+    return decoded[decoded['version'] == 2]
+
+# Standard payload types (RFC 3551) + Welcome Italia compatibility
+STANDARD_PAYLOAD_TYPES = {
+    0: 'G.711',    # PCMU
+    8: 'G.711',    # PCMA (alaw - Welcome Italia)
+    18: 'G.729',   # G.729 (Welcome Italia primary)
+    19: 'G.729',   # G.729A (Welcome Italia variant)
+    4: 'G.723.1',  # G.723
+    3: 'GSM',      # GSM
+    97: 'iLBC',    # iLBC (dynamic)
+    98: 'G.729',   # G.729 (alternative dynamic type)
+    99: 'G.729A',  # G.729A (alternative dynamic type)
+    111: 'Opus',   # Opus (commonly used dynamic type)
+    120: 'Opus',   # Opus (alternative dynamic type)
+}
 
 class RTPProcessor:
+    """Per-call RTP quality state, fed with packets by the RTPEngine
+
+    Only counters and estimator state live on the instance (no __dict__),
+    so tens of thousands of streams can stay resident; the MOS calculator
+    is stateless and shared by every stream.
+    """
+    __slots__ = ('call_id', 'port', 'call_manager', 'packets_received',
+                 'jitter_estimator', 'sequence_tracker', 'burst_tracker',
+                 'detected_codec', 'last_payload_type')
+
+    mos_calculator = MOSCalculator()
+
     def __init__(self, call_id, port, call_manager):
         self.call_id = call_id
         self.port = port
         self.call_manager = call_manager
-        self.socket = None
-        self.running = False
-        self.mos_calculator = MOSCalculator()
         
         # Quality metrics
         self.packets_received = 0
-        self.packets_lost = 0
-        self.jitter_buffer = []
-        self.last_packet_time = None
-        self.sequence_numbers = []
-        self.timestamps = []
+        self.jitter_estimator = JitterEstimator()
+        self.sequence_tracker = SequenceTracker()
+        self.burst_tracker = BurstGapTracker()
         self.detected_codec = 'G.711'  # Default codec, updated from RTP packets
+        self.last_payload_type = None
         
-    def start_processing(self):
-        """Start processing RTP packets"""
+    def process_batch(self, headers, addr=None):
+        """Process a batch of decoded RTP headers (see decode_rtp_headers)"""
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.socket.bind(('0.0.0.0', self.port))
-            self.socket.settimeout(1.0)
-            self.running = True
-            
-            print(f"RTP Processor listening on port {self.port} for call {self.call_id}")
-            
-            packet_count = 0
-            while self.running:
-                try:
-                    data, addr = self.socket.recvfrom(1024)
-                    packet_count += 1
-                    if packet_count <= 5:  # Log first 5 packets
-                        print(f"RTP packet #{packet_count} received from {addr} ({len(data)} bytes) for call {self.call_id}")
-                    elif packet_count == 6:
-                        print(f"RTP processing active for call {self.call_id} - logging reduced")
-                    
-                    self.process_packet(data, addr)
-                    
-                except socket.timeout:
-                    # Check if call is still active
-                    if not self.call_manager.is_call_active(self.call_id):
-                        print(f"Call {self.call_id} no longer active, stopping RTP processing")
-                        break
-                    continue
-                    
-                except Exception as e:
-                    print(f"Error processing RTP packet for call {self.call_id}: {e}")
+            if not len(headers):
+                return
+                
+            if self.packets_received == 0:
+                print(f"RTP stream for call {self.call_id} started from {addr}, PT={headers['payload_type'][0]}")
+                
+            payload_types = headers['payload_type']
+            if payload_types[-1] != self.last_payload_type:
+                self.last_payload_type = int(payload_types[-1])
+                self.set_codec(self.get_codec_from_payload_type(self.last_payload_type))
+                
+            # Jitter for the whole batch in one vectorized pass
+            jitter_ms = self.jitter_estimator.update_batch(headers['timestamp'], headers['arrival_time'])
+            
+            update_sequence = self.sequence_tracker.update
+            update_burst = self.burst_tracker.update
+            for index, sequence in enumerate(headers['sequence'].tolist()):
+                self.packets_received += 1
+                lost = update_sequence(sequence)
+                if lost is not None:
+                    update_burst(lost)
+                
+                # Update call metrics every 10 packets
+                if self.packets_received % 10 == 0:
+                    self.update_call_metrics(jitter_ms[index])
                     
         except Exception as e:
-            print(f"Error starting RTP processor: {e}")
-        finally:
-            self.stop_processing()
-            
-    def stop_processing(self):
-        """Stop processing RTP packets"""
-        self.running = False
-        if self.socket:
-            self.socket.close()
-            
-    def process_packet(self, data, addr):
-        """Process individual RTP packet"""
+            print(f"Error processing RTP batch: {e}")
+            import traceback
+            traceback.print_exc()
+            
+    def process_packet(self, data, addr, arrival_time=None):
+        """Process individual RTP packet (per-packet debugging path)"""
         try:
             if len(data) < 12:  # RTP header is at least 12 bytes
                 print(f"DEBUG RTP: Packet too short ({len(data)} bytes) from {addr}")
@@ -79,28 +145,23 @@ class RTPProcessor:
             
             if rtp_header:
                 self.packets_received += 1
-                current_time = time.time()
+                current_time = arrival_time if arrival_time is not None else time.time()
                 
-                print(f"DEBUG RTP: Packet #{self.packets_received} from {addr}, seq={rtp_header['sequence']}, PT={rtp_header.get('payload_type', 'unknown')}")
+                print(f"DEBUG RTP: Packet #{self.packets_received} from {addr}, seq={rtp_header['sequence']}, PT={rtp_header['payload_type']}")
                 
                 # Update detected codec from RTP header
-                if 'codec' in rtp_header:
-                    self.detected_codec = rtp_header['codec']
-                    print(f"DEBUG RTP: Codec detected: {self.detected_codec}")
+                self.set_codec(rtp_header['codec'])
                 
-                # Calculate packet loss
-                self.calculate_packet_loss(rtp_header['sequence'])
+                # Track sequence numbers for packet loss and burstiness
+                lost = self.sequence_tracker.update(rtp_header['sequence'])
+                if lost is not None:
+                    self.burst_tracker.update(lost)
                 
                 # Calculate jitter
-                if self.last_packet_time:
-                    inter_arrival = current_time - self.last_packet_time
-                    self.calculate_jitter(inter_arrival)
-                    
-                self.last_packet_time = current_time
+                self.jitter_estimator.update(rtp_header['timestamp'], current_time)
                 
                 # Update call metrics every 10 packets
                 if self.packets_received % 10 == 0:
-                    print(f"DEBUG RTP: Updating metrics after {self.packets_received} packets")
                     self.update_call_metrics()
             else:
                 print(f"DEBUG RTP: Failed to parse RTP header from {addr}")
@@ -110,11 +171,18 @@ class RTPProcessor:
             import traceback
             traceback.print_exc()
             
+    def set_codec(self, codec):
+        """Update detected codec and the RTP clock rate used for jitter"""
+        if codec != self.detected_codec:
+            self.detected_codec = codec
+            print(f"RTP codec for call {self.call_id}: {self.detected_codec}")
+        self.jitter_estimator.set_clock_rate(CODEC_CLOCK_RATES.get(codec, DEFAULT_CLOCK_RATE))
+            
     def parse_rtp_header(self, data):
         """Parse RTP header"""
         try:
             # RTP header format (first 12 bytes)
-            header = struct.unpack('!BBHII', data[:12])
+            header = struct.unpack_from('!BBHII', data)
             
             version = (header[0] >> 6) & 0x3
             padding = (header[0] >> 5) & 0x1
@@ -147,21 +215,6 @@ class RTPProcessor:
     
     def get_codec_from_payload_type(self, payload_type):
         """Map RTP payload type to codec name"""
-        # Standard payload types (RFC 3551) + Welcome Italia compatibility
-        standard_payload_types = {
-            0: 'G.711',    # PCMU
-            8: 'G.711',    # PCMA (alaw - Welcome Italia)
-            18: 'G.729',   # G.729 (Welcome Italia primary)
-            19: 'G.729',   # G.729A (Welcome Italia variant)
-            4: 'G.723.1',  # G.723
-            3: 'GSM',      # GSM
-            97: 'iLBC',    # iLBC (dynamic)
-            98: 'G.729',   # G.729 (alternative dynamic type)
-            99: 'G.729A',  # G.729A (alternative dynamic type)
-            111: 'Opus',   # Opus (commonly used dynamic type)
-            120: 'Opus',   # Opus (alternative dynamic type)
-        }
-        
         # Check for dynamic payload types that could be Opus
         if payload_type >= 96 and payload_type <= 127:
             # Dynamic payload type - assume Opus for common ranges
@@ -169,54 +222,30 @@ class RTPProcessor:
                 return 'Opus'
             return 'Unknown'
         
-        return standard_payload_types.get(payload_type, 'G.711')
-            
-    def calculate_packet_loss(self, sequence):
-        """Calculate packet loss percentage"""
-        self.sequence_numbers.append(sequence)
-        
-        if len(self.sequence_numbers) > 100:
-            # Keep only last 100 sequences
-            self.sequence_numbers = self.sequence_numbers[-100:]
-            
-        if len(self.sequence_numbers) > 1:
-            expected_packets = max(self.sequence_numbers) - min(self.sequence_numbers) + 1
-            received_packets = len(set(self.sequence_numbers))
-            self.packets_lost = expected_packets - received_packets
-            
-    def calculate_jitter(self, inter_arrival):
-        """Calculate jitter using RFC 3550 algorithm"""
-        self.jitter_buffer.append(inter_arrival)
-        
-        if len(self.jitter_buffer) > 50:
-            # Keep only last 50 measurements
-            self.jitter_buffer = self.jitter_buffer[-50:]
+        return STANDARD_PAYLOAD_TYPES.get(payload_type, 'G.711')
             
     def get_jitter(self):
-        """Get current jitter value in milliseconds"""
-        if len(self.jitter_buffer) < 2:
-            return 0
-            
-        # Calculate jitter as standard deviation of inter-arrival times
-        jitter = np.std(self.jitter_buffer) * 1000  # Convert to milliseconds
-        return jitter
+        """Get current RFC 3550 interarrival jitter in milliseconds"""
+        return self.jitter_estimator.get_jitter_ms()
+        
+    @property
+    def packets_lost(self):
+        """Cumulative packets lost (RFC 3550 expected - received)"""
+        return self.sequence_tracker.lost
         
     def get_packet_loss_rate(self):
-        """Get packet loss rate as percentage"""
-        if self.packets_received == 0:
-            return 0
-            
-        total_expected = self.packets_received + self.packets_lost
-        if total_expected == 0:
-            return 0
-            
-        return (self.packets_lost / total_expected) * 100
+        """Get cumulative packet loss rate as percentage"""
+        return self.sequence_tracker.loss_rate()
         
-    def update_call_metrics(self):
+    def update_call_metrics(self, jitter=None):
         """Update call quality metrics"""
         try:
-            jitter = self.get_jitter()
+            if jitter is None:
+                jitter = self.get_jitter()
+            jitter = float(jitter)
             packet_loss = self.get_packet_loss_rate()
+            interval = self.sequence_tracker.interval_report()
+            bursts = self.burst_tracker.report()
             
             # Estimate delay (simplified - in production would use RTCP)
             delay = 50  # Default assumption of 50ms delay
@@ -226,15 +255,23 @@ class RTPProcessor:
                 packet_loss_rate=int(packet_loss),
                 jitter=int(jitter),
                 delay=delay,
-                codec=self.detected_codec
+                codec=self.detected_codec,
+                burst_ratio=bursts['burst_ratio']
             )
             
             # Update call manager with metrics
             metrics = {
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': time.time(),  # Epoch seconds, formatted by consumers
                 'packets_received': self.packets_received,
                 'packets_lost': self.packets_lost,
                 'packet_loss_rate': packet_loss,
+                'interval_packet_loss_rate': interval['loss_rate'],
+                'packets_discarded': self.sequence_tracker.discarded,
+                'max_reorder_depth': self.sequence_tracker.max_reorder_depth,
+                'burst_ratio': bursts['burst_ratio'],
+                'burst_density': bursts['burst_density'],
+                'gap_density': bursts['gap_density'],
+                'burst_duration': bursts['burst_duration'],
                 'jitter': jitter,
                 'delay': delay,
                 'mos_score': mos_score,
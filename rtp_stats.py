@@ -0,0 +1,376 @@
+"""
+Streaming RTP statistics for VoIP Quality Monitor
+Constant-time per-packet estimators used by RTPProcessor, with vectorized
+variants for replaying whole captures
+"""
+import numpy as np
+
+# RTP clock rates per codec (RFC 3551 / RFC 7587), G.722 keeps the 8 kHz RTP clock
+CODEC_CLOCK_RATES = {
+    'G.711': 8000,
+    'G.722': 8000,
+    'G.723.1': 8000,
+    'G.729': 8000,
+    'G.729A': 8000,
+    'GSM': 8000,
+    'iLBC': 8000,
+    'Opus': 48000,
+    'OPUS': 48000,
+}
+
+DEFAULT_CLOCK_RATE = 8000
+
+# RFC 3550 jitter filter gain: J(i) = J(i-1) + (|D(i-1,i)| - J(i-1)) / 16
+JITTER_GAIN = 1.0 / 16
+_JITTER_DECAY = 1.0 - JITTER_GAIN
+_JITTER_BLOCK = 512  # Block length keeping (16/15)**block well inside float64 range
+
+def _timestamp_deltas(rtp_timestamps):
+    """Consecutive RTP timestamp differences as signed 32-bit values (wraparound safe)"""
+    deltas = np.diff(np.asarray(rtp_timestamps, dtype=np.int64))
+    return ((deltas + 2**31) % 2**32) - 2**31
+
+def estimate_jitter_batch(rtp_timestamps, arrival_times, clock_rate=DEFAULT_CLOCK_RATE, initial_jitter=0.0):
+    """
+    Vectorized RFC 3550 interarrival jitter over a packet sequence
+
+    Args:
+        rtp_timestamps: RTP timestamps of the packets, in arrival order
+        arrival_times: arrival times in seconds
+        clock_rate: RTP clock rate of the payload
+        initial_jitter: jitter before the first packet, in timestamp units
+
+    Returns:
+        Array with the jitter (timestamp units) after each packet but the first
+    """
+    arrival_times = np.asarray(arrival_times, dtype=np.float64)
+    transit_deltas = np.abs(np.diff(arrival_times) * clock_rate - _timestamp_deltas(rtp_timestamps))
+
+    # The recursion is a first-order IIR filter; inside each block it is solved
+    # in closed form: J(k) = a^k * (J(0) + g * sum(a^-i * D(i), i = 1..k))
+    jitter = np.empty(len(transit_deltas))
+    exponents = np.arange(1, _JITTER_BLOCK + 1)
+    growth = _JITTER_DECAY ** -exponents
+    decay = _JITTER_DECAY ** exponents
+
+    current = float(initial_jitter)
+    for start in range(0, len(transit_deltas), _JITTER_BLOCK):
+        block = transit_deltas[start:start + _JITTER_BLOCK]
+        size = len(block)
+        accumulated = np.cumsum(block * growth[:size])
+        jitter[start:start + size] = decay[:size] * (current + JITTER_GAIN * accumulated)
+        current = jitter[start + size - 1]
+
+    return jitter
+
+class JitterEstimator:
+    """RFC 3550 section 6.4.1 interarrival jitter, O(1) per packet"""
+    __slots__ = ('clock_rate', 'jitter', 'last_timestamp', 'last_arrival')
+
+    def __init__(self, clock_rate=DEFAULT_CLOCK_RATE):
+        self.clock_rate = clock_rate
+        self.jitter = 0.0           # Timestamp units
+        self.last_timestamp = None
+        self.last_arrival = None
+
+    def set_clock_rate(self, clock_rate):
+        """Switch clock rate (codec change), restarting the transit reference"""
+        if clock_rate != self.clock_rate:
+            self.jitter = self.jitter * clock_rate / self.clock_rate
+            self.clock_rate = clock_rate
+            self.last_timestamp = None
+            self.last_arrival = None
+
+    def update(self, rtp_timestamp, arrival_time):
+        """Feed one packet, returning the jitter in milliseconds"""
+        if self.last_arrival is not None:
+            timestamp_delta = ((rtp_timestamp - self.last_timestamp + 2**31) % 2**32) - 2**31
+            transit_delta = abs((arrival_time - self.last_arrival) * self.clock_rate - timestamp_delta)
+            self.jitter += (transit_delta - self.jitter) * JITTER_GAIN
+
+        self.last_timestamp = rtp_timestamp
+        self.last_arrival = arrival_time
+        return self.get_jitter_ms()
+
+    def update_batch(self, rtp_timestamps, arrival_times):
+        """Feed a batch of packets, returning the jitter in milliseconds after each one"""
+        count = len(rtp_timestamps)
+        if count == 0:
+            return np.empty(0)
+
+        if self.last_arrival is not None:
+            rtp_timestamps = np.concatenate(([self.last_timestamp], rtp_timestamps))
+            arrival_times = np.concatenate(([self.last_arrival], arrival_times))
+            jitter = estimate_jitter_batch(rtp_timestamps, arrival_times, self.clock_rate, self.jitter)
+        else:
+            jitter = np.concatenate((
+                [self.jitter],
+                estimate_jitter_batch(rtp_timestamps, arrival_times, self.clock_rate, self.jitter)
+            ))
+
+        self.jitter = float(jitter[-1])
+        self.last_timestamp = int(rtp_timestamps[-1])
+        self.last_arrival = float(arrival_times[-1])
+        return jitter * (1000.0 / self.clock_rate)
+
+    def get_jitter_ms(self):
+        """Current jitter in milliseconds"""
+        return self.jitter * 1000.0 / self.clock_rate
+
+# RFC 3550 appendix A.1 source validation constants
+RTP_SEQ_MOD = 1 << 16
+MAX_DROPOUT = 3000
+MAX_MISORDER = 100
+MIN_SEQUENTIAL = 2
+REORDER_WINDOW = 128  # Sequence numbers behind the highest one tracked in the bitmap (> MAX_MISORDER)
+_WINDOW_MASK = (1 << REORDER_WINDOW) - 1
+
+class SequenceTracker:
+    """
+    RFC 3550 appendix A.1 extended sequence number tracking
+
+    Handles 16-bit wraparound, source restarts and probation, and keeps a
+    bitmap of the last REORDER_WINDOW sequence numbers (bit d set when
+    extended_max - d was received) so duplicates are discarded and late
+    packets are recognised, all in O(1) per packet.
+    """
+    __slots__ = (
+        'max_seq', 'cycles', 'base_seq', 'bad_seq', 'probation',
+        'received', 'expected_prior', 'received_prior',
+        'duplicates', 'discarded', 'reordered', 'max_reorder_depth',
+        'window', 'initialized'
+    )
+
+    def __init__(self):
+        self.max_seq = 0
+        self.cycles = 0
+        self.base_seq = 0
+        self.bad_seq = RTP_SEQ_MOD + 1
+        self.probation = MIN_SEQUENTIAL
+        self.received = 0
+        self.expected_prior = 0
+        self.received_prior = 0
+        self.duplicates = 0
+        self.discarded = 0       # Duplicates plus packets rejected by validation
+        self.reordered = 0
+        self.max_reorder_depth = 0
+        self.window = 0
+        self.initialized = False
+
+    def init_seq(self, seq):
+        """Restart tracking from seq (RFC 3550 init_seq)"""
+        self.base_seq = seq
+        self.max_seq = seq
+        self.bad_seq = RTP_SEQ_MOD + 1
+        self.cycles = 0
+        self.received = 0
+        self.received_prior = 0
+        self.expected_prior = 0
+        self.window = 1
+
+    def update(self, seq):
+        """
+        Feed one sequence number
+
+        Returns:
+            Number of packets skipped before this one when it advances the
+            stream (0 for in-order or late packets), or None when the packet
+            is discarded (duplicate, probation, invalid jump)
+        """
+        if not self.initialized:
+            self.initialized = True
+            self.init_seq(seq)
+            self.max_seq = (seq - 1) & 0xFFFF
+            self.probation = MIN_SEQUENTIAL
+
+        udelta = (seq - self.max_seq) & 0xFFFF
+        gap = 0
+
+        if self.probation:
+            # Packets must be in sequence before the source is considered valid
+            if seq == (self.max_seq + 1) & 0xFFFF:
+                self.probation -= 1
+                self.max_seq = seq
+                if self.probation == 0:
+                    self.init_seq(seq)
+                    self.received += 1
+                    return 0
+            else:
+                self.probation = MIN_SEQUENTIAL - 1
+                self.max_seq = seq
+            self.discarded += 1
+            return None
+        elif 0 < udelta < MAX_DROPOUT:
+            # In order, with permissible gap
+            if seq < self.max_seq:
+                self.cycles += RTP_SEQ_MOD
+            self.max_seq = seq
+            self.window = ((self.window << udelta) | 1) & _WINDOW_MASK
+            gap = udelta - 1
+        elif udelta == 0 or udelta > RTP_SEQ_MOD - MAX_MISORDER:
+            # Duplicate or reordered packet
+            depth = (self.max_seq - seq) & 0xFFFF
+            if depth >= REORDER_WINDOW or (self.window >> depth) & 1:
+                self.duplicates += 1
+                self.discarded += 1
+                return None
+            self.window |= 1 << depth
+            self.reordered += 1
+            if depth > self.max_reorder_depth:
+                self.max_reorder_depth = depth
+        else:
+            # Very large jump: accept only if the next packet confirms a restart
+            if seq == self.bad_seq:
+                self.init_seq(seq)
+            else:
+                self.bad_seq = (seq + 1) & 0xFFFF
+                self.discarded += 1
+                return None
+
+        self.received += 1
+        return gap
+
+    @property
+    def extended_max(self):
+        return self.cycles + self.max_seq
+
+    @property
+    def expected(self):
+        """Packets expected since the first valid packet"""
+        if self.probation:
+            return 0
+        return self.extended_max - self.base_seq + 1
+
+    @property
+    def lost(self):
+        """Cumulative packets lost (late arrivals are credited back)"""
+        return max(0, self.expected - self.received)
+
+    def loss_rate(self):
+        """Cumulative packet loss percentage"""
+        expected = self.expected
+        if expected <= 0:
+            return 0.0
+        return self.lost / expected * 100
+
+    def interval_report(self):
+        """Loss since the previous report (RFC 3550 appendix A.3), resetting the interval"""
+        expected = self.expected
+        expected_interval = expected - self.expected_prior
+        received_interval = self.received - self.received_prior
+        self.expected_prior = expected
+        self.received_prior = self.received
+
+        lost_interval = max(0, expected_interval - received_interval)
+        return {
+            'expected': expected_interval,
+            'received': received_interval,
+            'lost': lost_interval,
+            'loss_rate': lost_interval / expected_interval * 100 if expected_interval > 0 else 0.0
+        }
+
+# RFC 3611 section 4.7.2 burst/gap threshold
+GMIN = 16
+
+class BurstGapTracker:
+    """
+    Incremental burst/gap loss analysis (RFC 3611 style) and Gilbert-Elliott
+    transition counts
+
+    A burst is the longest run starting and ending with a loss that contains
+    fewer than GMIN consecutive received packets; isolated losses belong to
+    the gap. Each update costs a few integer operations.
+    """
+    __slots__ = (
+        'gmin', 'received_run', 'pending_lost', 'pending_received', 'has_loss',
+        'burst_count', 'burst_lost', 'burst_received', 'gap_lost', 'gap_received',
+        'received_to_received', 'received_to_lost', 'lost_to_lost', 'lost_to_received'
+    )
+
+    def __init__(self, gmin=GMIN):
+        self.gmin = gmin
+        self.received_run = 0      # Packets received since the last loss
+        self.pending_lost = 0      # Candidate burst not yet closed by GMIN receptions
+        self.pending_received = 0
+        self.has_loss = False
+        self.burst_count = 0
+        self.burst_lost = 0
+        self.burst_received = 0
+        self.gap_lost = 0
+        self.gap_received = 0
+        self.received_to_received = 0
+        self.received_to_lost = 0
+        self.lost_to_lost = 0
+        self.lost_to_received = 0
+
+    def update(self, lost):
+        """Feed one received packet preceded by `lost` missing packets"""
+        if lost:
+            # Gilbert-Elliott transitions: received -> lost, lost -> lost, lost -> received
+            self.received_to_lost += 1
+            self.lost_to_lost += lost - 1
+            self.lost_to_received += 1
+
+            if self.received_run >= self.gmin or not self.has_loss:
+                self._close_pending()
+                self.gap_received += self.received_run
+                self.pending_lost = lost
+                self.pending_received = 0
+                self.has_loss = True
+            else:
+                self.pending_lost += lost
+                self.pending_received += self.received_run
+            self.received_run = 1
+        else:
+            self.received_to_received += 1
+            self.received_run += 1
+
+    def _close_pending(self):
+        if self.pending_lost == 1:
+            self.gap_lost += 1
+        elif self.pending_lost > 1:
+            self.burst_count += 1
+            self.burst_lost += self.pending_lost
+            self.burst_received += self.pending_received
+        self.pending_lost = 0
+        self.pending_received = 0
+
+    def burst_ratio(self):
+        """
+        BurstR for the ITU-T G.107 E-model: 1 / (p + q), where p and q are the
+        Gilbert model received->lost and lost->received transition probabilities
+        """
+        from_received = self.received_to_received + self.received_to_lost
+        from_lost = self.lost_to_lost + self.lost_to_received
+        if not from_received or not from_lost:
+            return 1.0
+        p = self.received_to_lost / from_received
+        q = self.lost_to_received / from_lost
+        return 1.0 / (p + q) if p + q > 0 else 1.0
+
+    def report(self, packet_time_ms=20):
+        """Burst/gap densities (%) and mean durations (ms), counting the open burst as closed"""
+        burst_count = self.burst_count
+        burst_lost = self.burst_lost
+        burst_received = self.burst_received
+        gap_lost = self.gap_lost
+        gap_received = self.gap_received
+
+        if self.pending_lost == 1:
+            gap_lost += 1
+        elif self.pending_lost > 1:
+            burst_count += 1
+            burst_lost += self.pending_lost
+            burst_received += self.pending_received
+        gap_received += self.received_run  # A burst always ends with a loss
+
+        burst_packets = burst_lost + burst_received
+        gap_packets = gap_lost + gap_received
+        return {
+            'burst_density': burst_lost / burst_packets * 100 if burst_packets else 0.0,
+            'gap_density': gap_lost / gap_packets * 100 if gap_packets else 0.0,
+            'burst_duration': burst_packets / burst_count * packet_time_ms if burst_count else 0.0,
+            'gap_duration': gap_packets / (burst_count + 1) * packet_time_ms,
+            'burst_count': burst_count,
+            'burst_ratio': self.burst_ratio()
+        }
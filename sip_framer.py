@@ -0,0 +1,99 @@
+"""
+Incremental SIP message framing for stream transports (TCP/TLS)
+Received bytes are appended to one bytearray consumed through a read offset;
+the header-end search resumes where the previous read stopped and the
+Content-Length of a partially received message is remembered, so pipelined
+messages are framed in linear time with a single copy per message
+"""
+import re
+
+# Content-Length or its compact form "l", at the start of a header line
+CONTENT_LENGTH_PATTERN = re.compile(rb'\r\n(?:content-length|l)[ \t]*:[ \t]*(\d+)', re.IGNORECASE)
+HEADER_END = b'\r\n\r\n'
+
+class SIPFramingError(ValueError):
+    """The peer sent more unframed data than allowed; the connection should be closed"""
+
+class SIPStreamFramer:
+    __slots__ = ('buffer', 'start', 'scan', 'header_end', 'content_length', 'max_buffer')
+
+    def __init__(self, max_buffer=65536):
+        self.buffer = bytearray()
+        self.start = 0            # Offset of the first unconsumed byte
+        self.scan = 0             # Offset where the header-end search resumes
+        self.header_end = None    # End of the current message's headers, once found
+        self.content_length = 0   # Body length of the current message
+        self.max_buffer = max_buffer  # Bytes of one incomplete message we are willing to hold
+
+    def __len__(self):
+        return len(self.buffer) - self.start
+
+    def feed(self, data):
+        """Append received bytes and return the complete messages they finish
+
+        Args:
+            data: Bytes read from the connection
+
+        Returns:
+            list: Complete SIP messages as bytes, in order
+
+        Raises:
+            SIPFramingError: An incomplete message exceeds max_buffer
+        """
+        buffer = self.buffer
+        buffer += data
+        messages = []
+
+        while True:
+            if self.header_end is None:
+                # Skip CRLF keepalives (RFC 5626) between messages
+                start = self.start
+                while buffer[start:start + 2] == b'\r\n':
+                    start += 2
+                if start != self.start:
+                    self.start = start
+                    self.scan = max(self.scan, start)
+
+                index = buffer.find(HEADER_END, self.scan)
+                if index < 0:
+                    # The terminator may straddle the next read
+                    self.scan = max(self.start, len(buffer) - 3)
+                    break
+
+                self.header_end = index + 4
+                match = CONTENT_LENGTH_PATTERN.search(buffer, self.start, self.header_end)
+                # Content-Length is mandatory on streams; a missing one means no body
+                self.content_length = int(match.group(1)) if match else 0
+                if self.content_length > self.max_buffer:
+                    raise SIPFramingError(f"Content-Length {self.content_length} exceeds {self.max_buffer} bytes")
+
+            end = self.header_end + self.content_length
+            if len(buffer) < end:
+                break
+
+            with memoryview(buffer) as view:
+                messages.append(bytes(view[self.start:end]))
+            self.start = self.scan = end
+            self.header_end = None
+
+        self.compact()
+        if len(self) > self.max_buffer:
+            raise SIPFramingError(f"Incomplete SIP message exceeds {self.max_buffer} bytes")
+        return messages
+
+    def compact(self):
+        """Drop consumed bytes once they make up most of the buffer (amortized O(1) per byte)"""
+        start = self.start
+        if not start:
+            return
+        if start == len(self.buffer):
+            self.buffer.clear()
+        elif start >= len(self.buffer) // 2:
+            del self.buffer[:start]
+        else:
+            return
+
+        self.start = 0
+        self.scan -= start
+        if self.header_end is not None:
+            self.header_end -= start
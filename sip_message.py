@@ -0,0 +1,232 @@
+"""
+Lazy SIP message parser for VoIP Quality Monitor
+A SIPMessage decodes and splits the received bytes once and only parses the
+method up front, so routing and load shedding never touch the headers. On
+first access the header lines are indexed in one pass into a plain dict of
+stripped values, which handlers read directly. Unlike the old header dict
+it keeps repeated headers, understands compact names and exposes the body.
+"""
+
+# RFC 3261 section 7.3.3 compact header names (plus common extensions)
+COMPACT_HEADERS = {
+    'a': 'accept-contact', 'b': 'referred-by', 'c': 'content-type', 'd': 'request-disposition',
+    'e': 'content-encoding', 'f': 'from', 'i': 'call-id', 'j': 'reject-contact',
+    'k': 'supported', 'l': 'content-length', 'm': 'contact', 'o': 'event',
+    'r': 'refer-to', 's': 'subject', 't': 'to', 'u': 'allow-events',
+    'v': 'via', 'x': 'session-expires', 'y': 'identity', 'n': 'identity-info'
+}
+
+# Headers whose comma-separated values are separate entries (RFC 3261 section 7.3.1)
+LIST_HEADERS = frozenset(('via', 'route', 'record-route', 'contact', 'allow', 'supported',
+                          'require', 'proxy-require', 'unsupported', 'accept', 'allow-events'))
+
+# Raw header names as they appear on the wire ("Via", "CSeq", "l ") -> index key,
+# so most lines cost one dict hit instead of strip/lower/compact lookups
+HEADER_NAMES = {}
+MAX_HEADER_NAMES = 512
+
+def split_header_values(value):
+    """Split a comma-separated header value, ignoring commas inside quotes and <...>"""
+    if ',' not in value:
+        value = value.strip()
+        return [value] if value else []
+    values = []
+    depth = 0
+    quoted = False
+    start = 0
+    for index, char in enumerate(value):
+        if char == '"' and (index == 0 or value[index - 1] != '\\'):
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif char == '<':
+            depth += 1
+        elif char == '>':
+            depth -= 1
+        elif char == ',' and depth <= 0:
+            values.append(value[start:index].strip())
+            start = index + 1
+    values.append(value[start:].strip())
+    return [item for item in values if item]
+
+class SIPMessage:
+    __slots__ = ('data', 'lines', 'start_line', 'method', 'headers', 'repeated')
+
+    def __init__(self, data):
+        """Decode a SIP message and parse its method from the start line
+
+        Args:
+            data: Complete message as bytes (a datagram or a framed stream message)
+
+        Raises:
+            ValueError: The message has no valid start line
+        """
+        self.data = data
+        # One decode and one split into lines, like the old parser (splitting
+        # the body too is cheaper than searching for the blank line first);
+        # the header lines are only indexed on first access
+        self.lines = lines = data.decode('utf-8', 'replace').split('\r\n')
+        self.start_line = start_line = lines.pop(0)
+        method, separator, _ = start_line.partition(' ')
+        if not method or not separator:
+            raise ValueError(f"Invalid SIP start line: {start_line[:80]!r}")
+        self.method = None if method.startswith('SIP/') else method
+
+        self.headers = None   # {lowercase long name: stripped value}, built by index()
+        self.repeated = None  # {lowercase long name: [later values]} of repeated non-list headers
+
+    @property
+    def request_uri(self):
+        return self.start_line.split(' ', 2)[1] if self.method is not None else None
+
+    @property
+    def status_code(self):
+        if self.method is not None:
+            return None
+        code = self.start_line.split(' ', 2)[1]
+        return int(code) if code.isdigit() else 0
+
+    @property
+    def reason(self):
+        if self.method is not None:
+            return None
+        parts = self.start_line.split(' ', 2)
+        return parts[2] if len(parts) > 2 else ''
+
+    @property
+    def is_request(self):
+        return self.method is not None
+
+    def index(self):
+        """Header dict of the message, built on first use
+
+        Keys are lowercase long header names, values are stripped; repeated
+        list headers (Via, Route, ...) are combined into one comma-separated
+        value as RFC 3261 section 7.3.1 allows. Handlers read it with plain
+        dict .get(), which is what keeps header access cheaper than the old
+        split/dict parser.
+
+        Returns:
+            dict: {lowercase long name: value}
+        """
+        headers = self.headers
+        if headers is not None:
+            return headers
+        lines = self.lines
+        # One partition, one dict hit and one strip per line while every raw
+        # name is already known and none repeats; the blank line ending the
+        # headers is no known name, so the pass stops there without touching
+        # the body. Anything else (including a message without the blank
+        # line) takes index_lines
+        headers = {}
+        get = HEADER_NAMES.get
+        line = ''
+        for line in lines:
+            # Splitting at ': ' leaves the usual value already stripped, so strip() copies nothing
+            name, _, value = line.partition(': ')
+            key = get(name)
+            if key is None:
+                break
+            headers[key] = value.strip()
+        if line or (lines and len(headers) < lines.index('')):
+            headers = self.index_lines(lines)
+        self.headers = headers
+        return headers
+
+    def index_lines(self, lines):
+        """Index header lines with unfolding, new raw names and repeated headers"""
+        headers = {}
+        repeated = None
+        key = None
+        for line in lines:
+            if not line:
+                break
+            if line[:1] in (' ', '\t'):
+                # Folded continuation of the previous header line
+                if key is not None:
+                    if repeated and key in repeated:
+                        repeated[key][-1] = f"{repeated[key][-1]} {line.strip()}".strip()
+                    else:
+                        headers[key] = f"{headers[key]} {line.strip()}".strip()
+                continue
+            name, separator, value = line.partition(':')
+            if not separator or not name.strip():
+                key = None
+                continue
+            key = HEADER_NAMES.get(name)
+            if key is None:
+                key = self.canonical(name.strip())
+                if len(HEADER_NAMES) < MAX_HEADER_NAMES:
+                    HEADER_NAMES[name] = key
+            value = value.strip()
+            if key not in headers:
+                headers[key] = value
+            elif key in LIST_HEADERS:
+                headers[key] = f"{headers[key]}, {value}"
+            else:
+                if repeated is None:
+                    repeated = {}
+                repeated.setdefault(key, []).append(value)
+        self.repeated = repeated
+        return headers
+
+    def canonical(self, name):
+        """Index key of a header name as handlers write it ('Call-ID', 'i', 'via')"""
+        name = name.lower()
+        return COMPACT_HEADERS.get(name, name)
+
+    def get_all(self, name):
+        """Get every value of a header, in order, with comma-separated list headers split
+
+        Args:
+            name: Header name in any case, long or compact form
+
+        Returns:
+            list: Stripped values (empty if the header is absent)
+        """
+        headers = self.headers if self.headers is not None else self.index()
+        name = self.canonical(name)
+        value = headers.get(name)
+        if value is None:
+            return []
+        if name in LIST_HEADERS:
+            return split_header_values(value)
+        if self.repeated and name in self.repeated:
+            return [value] + self.repeated[name]
+        return [value]
+
+    def get(self, name, default=None):
+        """Get the value of a header (dict-style; handlers normally use index() directly)"""
+        headers = self.headers if self.headers is not None else self.index()
+        value = headers.get(name)
+        if value is None:
+            value = headers.get(self.canonical(name))
+            if value is None:
+                return default
+        return value
+
+    def __contains__(self, name):
+        headers = self.headers if self.headers is not None else self.index()
+        return name in headers or self.canonical(name) in headers
+
+    @property
+    def body(self):
+        """Message body bytes after the blank line, limited by Content-Length when present"""
+        header_end = self.data.find(b'\r\n\r\n')
+        if header_end < 0:
+            return b''
+        length = self.get('content-length')
+        start = header_end + 4
+        if length and length.isdigit():
+            return self.data[start:start + int(length)]
+        return self.data[start:]
+
+    @property
+    def body_text(self):
+        """Message body decoded as text (SDP)"""
+        return self.body.decode('utf-8', errors='ignore')
+
+    @property
+    def text(self):
+        """Whole message decoded as text (for logging and the SIP trace)"""
+        return self.data.decode('utf-8', errors='ignore')
@@ -4,18 +4,30 @@ Handles registration and call routing for Asterisk-based gateways
 """
 import socket
 import ssl
-import threading
 import re
 import select
-import time
 import os
+import threading
 from datetime import datetime, timedelta
-from rtp_processor import RTPProcessor
+from rtp_engine import RTPEngine
+from socket_rooms import RoomPublisher, extension_room
+from sip_workers import SIPWorkerPool
+from sip_framer import SIPStreamFramer, SIPFramingError
+from sip_message import SIPMessage
+from sip_responses import LocalAddress, SIPResponseBuilder, via_lines
+from sip_transactions import ServerTransactionTable
+from sip_transport import AsyncSIPTransport
+
+# From/To header user parts, for routing SIP traffic to per-extension rooms
+SIP_URI_USER = re.compile(r'sips?:([^@;>\s]+)@', re.IGNORECASE)
+SIP_PARTY_PATTERN = re.compile(r'^(?:From|To|f|t)[ \t]*:[^\r\n]*?sips?:([^@;>\s]+)@', re.IGNORECASE | re.MULTILINE)
 
 class SIPRegistrar:
-    def __init__(self, call_manager, socketio):
+    def __init__(self, call_manager, socketio, publisher=None):
         self.call_manager = call_manager
         self.socketio = socketio
+        # Dashboard events go through rate-limited rooms instead of to every client
+        self.publisher = publisher or RoomPublisher(socketio)
         self.host = '0.0.0.0'
         self.udp_port = 5060
         self.tcp_port = 5060
@@ -25,13 +37,36 @@ class SIPRegistrar:
         self.tls_socket = None
         self.running = False
         self.ssl_context = None
+        # 'asyncio' serves all transports from one event loop; 'select' is the legacy loop
+        self.transport_backend = os.environ.get('SIP_TRANSPORT', 'asyncio')
+        self.async_transport = None
         
         # Registry for connected devices
         self.registered_devices = {}  # {extension: {contact, expires, last_seen, transport}}
+        self.registrations_lock = threading.Lock()  # Expiry timers race with re-REGISTERs
         self.active_calls = {}
         self.tcp_connections = {}
         self.tls_connections = {}  # Track TLS connections
         
+        # Bounded, per-source fair worker pool instead of a thread per message
+        self.sip_workers = SIPWorkerPool(self.handle_sip_message, self.reject_sip_message)
+        
+        # Responses are rendered from templates with a cached local address and SDP
+        self.local_address = LocalAddress()
+        self.responses = SIPResponseBuilder(self.local_address, self.udp_port)
+        
+        # Every SIP timer (answers, registration expiry, transactions) runs on the
+        # call manager's timing wheel instead of sleeping threads and periodic scans
+        self.timers = call_manager.timers
+        self.answer_delay = 2.0   # Seconds an unregistered destination rings before we answer
+        self.pending_answers = {}  # {call_id: (answer Timer, INVITE headers, addr, transport, client_socket)}
+        self.transactions = ServerTransactionTable(self.timers, self.send_data)
+        
+        # Shared RTP ingestion engine for all monitored calls
+        self.rtp_port_min = 10000  # Even-numbered RTP ports, RTCP on port + 1
+        self.rtp_port_max = 20000
+        self.rtp_engine = RTPEngine(call_manager, port_min=self.rtp_port_min, port_max=self.rtp_port_max)
+        
         # Configuration for FXS gateway and Welcome Italia compatibility
         self.domain = "voip-monitor.local"
         self.registration_expires = 3600  # 1 hour (compatible with Welcome Italia)
@@ -56,25 +91,32 @@ class SIPRegistrar:
     def start(self):
         """Start SIP Registrar and Proxy services"""
         try:
-            self.start_udp_server()
-            self.start_tcp_server()
-            self.start_tls_server()
-            
-            print(f"SIP Registrar listening on UDP {self.host}:{self.udp_port}")
-            print(f"SIP Registrar listening on TCP {self.host}:{self.tcp_port}")
-            if self.tls_socket:
-                print(f"SIP Registrar listening on TLS {self.host}:{self.tls_port}")
+            use_asyncio = self.transport_backend == 'asyncio'
+            self.responses.sip_port = self.udp_port
+            if use_asyncio:
+                # The asyncio transport binds its own listeners
+                self.load_tls_context()
             else:
-                print(f"TLS not available - certificates not found")
+                self.start_udp_server()
+                self.start_tcp_server()
+                self.start_tls_server()
+                
+                print(f"SIP Registrar listening on UDP {self.host}:{self.udp_port}")
+                print(f"SIP Registrar listening on TCP {self.host}:{self.tcp_port}")
+                if self.tls_socket:
+                    print(f"SIP Registrar listening on TLS {self.host}:{self.tls_port}")
+                else:
+                    print(f"TLS not available - certificates not found")
             
             self.running = True
-            
-            # Start registration cleanup thread
-            cleanup_thread = threading.Thread(target=self.cleanup_expired_registrations, daemon=True)
-            cleanup_thread.start()
+            self.sip_workers.start()
             
             # Main server loop
-            self.server_loop()
+            if use_asyncio:
+                self.async_transport = AsyncSIPTransport(self)
+                self.async_transport.run()
+            else:
+                self.server_loop()
             
         except Exception as e:
             print(f"Error starting SIP Registrar: {e}")
@@ -94,8 +136,12 @@ class SIPRegistrar:
         self.tcp_socket.listen(5)
         self.tcp_socket.setblocking(False)
 
-    def start_tls_server(self):
-        """Initialize TLS socket with SSL context"""
+    def load_tls_context(self):
+        """Create the server SSL context from the generated certificates
+        
+        Returns:
+            bool: True if TLS is available
+        """
         try:
             # Check if certificates exist
             cert_dir = "certificates"
@@ -105,11 +151,22 @@ class SIPRegistrar:
             if not os.path.exists(cert_file) or not os.path.exists(key_file):
                 print("TLS certificates not found - TLS server not started")
                 print("Generate certificates at /certificates to enable TLS")
-                return
+                return False
                 
-            # Create SSL context
             self.ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
             self.ssl_context.load_cert_chain(cert_file, key_file)
+            return True
+            
+        except Exception as e:
+            print(f"Error loading TLS certificates: {e}")
+            self.ssl_context = None
+            return False
+
+    def start_tls_server(self):
+        """Initialize TLS socket with SSL context"""
+        try:
+            if not self.load_tls_context():
+                return
             
             # Create TLS socket
             self.tls_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -130,10 +187,18 @@ class SIPRegistrar:
                 read_sockets = [self.udp_socket, self.tcp_socket]
                 if self.tls_socket:
                     read_sockets.append(self.tls_socket)
-                read_sockets.extend(self.tcp_connections.keys())
-                read_sockets.extend(self.tls_connections.keys())
                 
-                ready_sockets, _, error_sockets = select.select(read_sockets, [], read_sockets, 1.0)
+                # Stop reading from connections whose source has a full worker queue,
+                # so TCP flow control pushes back on the sender
+                paused = False
+                for connections in (self.tcp_connections, self.tls_connections):
+                    for sock, conn_info in list(connections.items()):
+                        if self.sip_workers.is_saturated(conn_info['addr'][0]):
+                            paused = True
+                        else:
+                            read_sockets.append(sock)
+                
+                ready_sockets, _, error_sockets = select.select(read_sockets, [], read_sockets, 0.05 if paused else 1.0)
                 
                 for sock in ready_sockets:
                     if sock == self.udp_socket:
@@ -160,11 +225,7 @@ class SIPRegistrar:
         """Handle incoming UDP data"""
         try:
             data, addr = self.udp_socket.recvfrom(4096)
-            threading.Thread(
-                target=self.handle_sip_message,
-                args=(data, addr, 'UDP'),
-                daemon=True
-            ).start()
+            self.sip_workers.submit(addr[0], data, addr, 'UDP')
         except socket.error:
             pass
             
@@ -175,7 +236,7 @@ class SIPRegistrar:
             client_socket.setblocking(False)
             self.tcp_connections[client_socket] = {
                 'addr': addr,
-                'buffer': b'',
+                'framer': SIPStreamFramer(),
                 'transport': 'TCP'
             }
             print(f"New TCP connection from gateway at {addr}")
@@ -191,7 +252,7 @@ class SIPRegistrar:
             ssl_socket.setblocking(False)
             self.tls_connections[ssl_socket] = {
                 'addr': addr,
-                'buffer': b'',
+                'framer': SIPStreamFramer(),
                 'transport': 'TLS'
             }
             print(f"New TLS connection from {addr}")
@@ -206,47 +267,32 @@ class SIPRegistrar:
                 self.close_tcp_connection(client_socket)
                 return
                 
-            conn_info = self.tcp_connections[client_socket]
-            conn_info['buffer'] += data
-            
-            self.process_tcp_buffer(client_socket)
+            self.process_tcp_buffer(client_socket, data)
             
         except socket.error:
             self.close_tcp_connection(client_socket)
             
-    def process_tcp_buffer(self, client_socket):
-        """Process buffered TCP data for complete SIP messages"""
-        conn_info = self.tcp_connections[client_socket]
-        buffer = conn_info['buffer']
+    def process_tcp_buffer(self, client_socket, data):
+        """Frame received TCP data into SIP messages and queue them"""
+        if not self.process_stream_data(self.tcp_connections[client_socket], data, client_socket):
+            self.close_tcp_connection(client_socket)
         
-        while b'\r\n\r\n' in buffer:
-            header_end = buffer.find(b'\r\n\r\n') + 4
-            headers_data = buffer[:header_end]
-            content_length = self.extract_content_length(headers_data)
-            total_length = header_end + content_length
-            
-            if len(buffer) >= total_length:
-                message = buffer[:total_length]
-                buffer = buffer[total_length:]
-                
-                threading.Thread(
-                    target=self.handle_sip_message,
-                    args=(message, conn_info['addr'], 'TCP', client_socket),
-                    daemon=True
-                ).start()
-            else:
-                break
-                
-        conn_info['buffer'] = buffer
+    def process_stream_data(self, conn_info, data, client_socket):
+        """Feed a TCP/TLS connection's framer and queue the complete messages
         
-    def extract_content_length(self, headers_data):
-        """Extract Content-Length from SIP headers"""
+        Returns:
+            bool: False if the peer exceeded the buffer limit and must be disconnected
+        """
         try:
-            headers_str = headers_data.decode('utf-8', errors='ignore')
-            match = re.search(r'Content-Length:\s*(\d+)', headers_str, re.IGNORECASE)
-            return int(match.group(1)) if match else 0
-        except:
-            return 0
+            messages = conn_info['framer'].feed(data)
+        except SIPFramingError as e:
+            print(f"Closing {conn_info['transport']} connection from {conn_info['addr']}: {e}")
+            return False
+        
+        addr = conn_info['addr']
+        for message in messages:
+            self.sip_workers.submit(addr[0], message, addr, conn_info['transport'], client_socket)
+        return True
             
     def close_tcp_connection(self, client_socket):
         """Close TCP connection"""
@@ -266,11 +312,8 @@ class SIPRegistrar:
                 self.close_tls_connection(client_socket)
                 return
                 
-            conn_info = self.tls_connections[client_socket]
-            conn_info['buffer'] += data
-            
             # Process complete SIP messages
-            self.process_tls_buffer(client_socket)
+            self.process_tls_buffer(client_socket, data)
             
         except ssl.SSLWantReadError:
             # SSL handshake in progress, continue
@@ -279,34 +322,10 @@ class SIPRegistrar:
             print(f"Error handling TLS data: {e}")
             self.close_tls_connection(client_socket)
 
-    def process_tls_buffer(self, client_socket):
-        """Process buffered TLS data for complete SIP messages"""
-        conn_info = self.tls_connections[client_socket]
-        buffer = conn_info['buffer']
-        
-        while b'\r\n\r\n' in buffer:
-            # Find end of headers
-            headers_end = buffer.find(b'\r\n\r\n') + 4
-            headers_data = buffer[:headers_end]
-            
-            # Check for Content-Length
-            content_length = self.extract_content_length(headers_data)
-            total_length = headers_end + content_length
-            
-            if len(buffer) >= total_length:
-                # Complete SIP message
-                message = buffer[:total_length]
-                buffer = buffer[total_length:]
-                
-                threading.Thread(
-                    target=self.handle_sip_message,
-                    args=(message, conn_info['addr'], 'TLS', client_socket),
-                    daemon=True
-                ).start()
-            else:
-                break
-                
-        conn_info['buffer'] = buffer
+    def process_tls_buffer(self, client_socket, data):
+        """Frame received TLS data into SIP messages and queue them"""
+        if not self.process_stream_data(self.tls_connections[client_socket], data, client_socket):
+            self.close_tls_connection(client_socket)
 
     def close_tls_connection(self, client_socket):
         """Close TLS connection"""
@@ -321,32 +340,33 @@ class SIPRegistrar:
     def handle_sip_message(self, data, addr, transport='UDP', client_socket=None):
         """Handle incoming SIP message from gateway or phones"""
         try:
-            message = data.decode('utf-8', errors='ignore')
-            lines = message.split('\r\n')
-            
-            if not lines:
+            sip = SIPMessage(data)
+            # Retransmissions are answered from the transaction table without reprocessing
+            if sip.method is not None and not self.transactions.receive(sip, addr, transport, client_socket):
                 return
-                
-            request_line = lines[0]
-            headers = self.parse_headers(lines[1:])
+            
+            request_line = sip.start_line
+            # Handlers read the header dict directly
+            headers = sip.index()
             
             print(f"Received SIP {transport} from {addr}: {request_line}")
             
             # Broadcast SIP message to dashboard
-            self.broadcast_sip_message(message, addr, transport, 'incoming')
+            self.broadcast_sip_message(sip, addr, transport, 'incoming')
             
-            # Route based on SIP method
-            if request_line.startswith('REGISTER'):
+            # Route based on SIP method (None for responses)
+            method = sip.method
+            if method == 'REGISTER':
                 self.handle_register(request_line, headers, addr, transport, client_socket)
-            elif request_line.startswith('INVITE'):
-                self.handle_invite(request_line, headers, addr, transport, client_socket)
-            elif request_line.startswith('ACK'):
+            elif method == 'INVITE':
+                self.handle_invite(request_line, headers, addr, transport, client_socket, sip.body_text)
+            elif method == 'ACK':
                 self.handle_ack(request_line, headers, addr, transport, client_socket)
-            elif request_line.startswith('BYE'):
+            elif method == 'BYE':
                 self.handle_bye(request_line, headers, addr, transport, client_socket)
-            elif request_line.startswith('OPTIONS'):
+            elif method == 'OPTIONS':
                 self.handle_options(request_line, headers, addr, transport, client_socket)
-            elif request_line.startswith('CANCEL'):
+            elif method == 'CANCEL':
                 self.handle_cancel(request_line, headers, addr, transport, client_socket)
             else:
                 print(f"Unhandled SIP method: {request_line}")
@@ -354,14 +374,18 @@ class SIPRegistrar:
         except Exception as e:
             print(f"Error handling SIP {transport} message: {e}")
             
-    def parse_headers(self, header_lines):
-        """Parse SIP headers"""
-        headers = {}
-        for line in header_lines:
-            if ':' in line:
-                key, value = line.split(':', 1)
-                headers[key.strip().lower()] = value.strip()
-        return headers
+    def reject_sip_message(self, data, addr, transport='UDP', client_socket=None):
+        """Answer a request the worker pool has no room for with 503 and Retry-After"""
+        try:
+            sip = SIPMessage(data)
+        except ValueError:
+            return
+        # ACKs and responses cannot be answered
+        if sip.method is None or sip.method == 'ACK':
+            return
+        print(f"SIP worker queue full, rejecting {sip.start_line} from {addr}")
+        self.send_response(addr, '503', 'Service Unavailable', sip, transport, client_socket,
+                           extra_headers={'Retry-After': self.sip_workers.retry_after})
         
     def handle_register(self, request_line, headers, addr, transport, client_socket=None):
         """Handle REGISTER requests from gateway/phones with authentication"""
@@ -395,9 +419,13 @@ class SIPRegistrar:
                 return
             
             if extension:
+                previous = self.registered_devices.get(extension)
+                if previous is not None:
+                    previous['expiry_timer'].cancel()
+                
                 if expires > 0:
                     # Register the device
-                    self.registered_devices[extension] = {
+                    device = {
                         'contact': contact_uri,
                         'expires': datetime.now() + timedelta(seconds=expires),
                         'last_seen': datetime.now(),
@@ -408,11 +436,14 @@ class SIPRegistrar:
                             'to_header': to_header
                         }
                     }
+                    device['expiry_timer'] = self.timers.call_later(expires, self.expire_registration, extension, device)
+                    with self.registrations_lock:
+                        self.registered_devices[extension] = device
                     print(f"Registered extension {extension} from {addr} via {transport}")
                     print(f"Contact: {contact_uri}")
                     
                     # Notify dashboard of new registration
-                    self.socketio.emit('device_registered', {
+                    self.publish_device_event('device_registered', {
                         'extension': extension,
                         'contact': contact_uri,
                         'transport': transport,
@@ -420,11 +451,12 @@ class SIPRegistrar:
                     })
                 else:
                     # Unregister the device
-                    if extension in self.registered_devices:
-                        del self.registered_devices[extension]
+                    with self.registrations_lock:
+                        removed = self.registered_devices.pop(extension, None)
+                    if removed is not None:
                         print(f"Unregistered extension {extension}")
                         
-                        self.socketio.emit('device_unregistered', {
+                        self.publish_device_event('device_unregistered', {
                             'extension': extension,
                             'timestamp': datetime.now().isoformat()
                         })
@@ -439,7 +471,7 @@ class SIPRegistrar:
             print(f"Error handling REGISTER: {e}")
             self.send_response(addr, '500', 'Internal Server Error', headers, transport, client_socket)
             
-    def handle_invite(self, request_line, headers, addr, transport, client_socket=None):
+    def handle_invite(self, request_line, headers, addr, transport, client_socket=None, body=''):
         """Handle INVITE requests for call setup"""
         try:
             call_id = headers.get('call-id', f"call_{datetime.now().timestamp()}")
@@ -449,7 +481,12 @@ class SIPRegistrar:
             from_ext = self.extract_extension(from_header)
             to_ext = self.extract_extension(to_header)
             
-            print(f"Call setup: {from_ext} -> {to_ext} (Call-ID: {call_id})")
+            # Caller media address from the SDP offer (falls back to the signaling address)
+            remote_sdp = self.parse_sdp(body)
+            remote_rtp_ip = remote_sdp.get('connection_ip') or addr[0]
+            remote_rtp_port = remote_sdp.get('audio_port')
+            
+            print(f"Call setup: {from_ext} -> {to_ext} (Call-ID: {call_id}), caller RTP {remote_rtp_ip}:{remote_rtp_port}")
             
             # Track call for quality monitoring
             session_info = {
@@ -459,6 +496,7 @@ class SIPRegistrar:
                 'to_address': to_ext or self.extract_address(to_header),
                 'transport': transport,
                 'remote_addr': addr,
+                'remote_rtp': f"{remote_rtp_ip}:{remote_rtp_port}" if remote_rtp_port else None,
                 'call_type': 'FXS_Gateway'
             }
             
@@ -470,32 +508,37 @@ class SIPRegistrar:
                 self.forward_invite(request_line, headers, to_ext, transport, client_socket)
             else:
                 # Handle all calls (including test extensions and unknown destinations)
+                rtp_port = self.rtp_engine.allocate_port(call_id)
+                if rtp_port is None:
+                    self.call_manager.end_call(call_id)
+                    self.send_response(addr, '503', 'Service Unavailable', headers, transport, client_socket)
+                    return
+                
                 # Send 180 Ringing first
                 self.send_response(addr, '180', 'Ringing', headers, transport, client_socket)
                 print(f"Extension {to_ext} ringing - call monitoring active: {from_ext} -> {to_ext}")
                 
                 # Send 200 OK with SDP after brief delay to simulate pickup
-                def delayed_answer():
-                    import time
-                    time.sleep(2)  # Ring for 2 seconds
-                    
-                    # Use fixed RTP port for consistency
-                    rtp_port = 5004
-                    print(f"Starting RTP processing for call {call_id} on port {rtp_port}")
-                    self.start_rtp_processing(call_id, rtp_port, addr[0])
-                    
-                    # Send 200 OK with SDP using the same RTP port
-                    self.send_ok_with_sdp(addr, headers, transport, client_socket, call_id, rtp_port)
-                    print(f"Call answered - monitoring RTP stream for {to_ext} on port {rtp_port}")
-                
-                # Execute delayed answer in separate thread
-                import threading
-                threading.Thread(target=delayed_answer, daemon=True).start()
+                timer = self.timers.call_later(self.answer_delay, self.answer_call, call_id, rtp_port,
+                                               remote_rtp_ip, to_ext, headers, addr, transport, client_socket)
+                self.pending_answers[call_id] = (timer, headers, addr, transport, client_socket)
                     
         except Exception as e:
             print(f"Error handling INVITE: {e}")
             self.send_response(addr, '500', 'Internal Server Error', headers, transport, client_socket)
             
+    def answer_call(self, call_id, rtp_port, remote_rtp_ip, to_ext, headers, addr, transport, client_socket):
+        """Timer callback: pick up a ringing call and start monitoring its RTP"""
+        if self.pending_answers.pop(call_id, None) is None:
+            return  # Cancelled while ringing
+        
+        print(f"Starting RTP processing for call {call_id} on port {rtp_port}")
+        self.start_rtp_processing(call_id, rtp_port, remote_rtp_ip)
+        
+        # Send 200 OK with SDP using the same RTP port
+        self.send_ok_with_sdp(addr, headers, transport, client_socket, call_id, rtp_port)
+        print(f"Call answered - monitoring RTP stream for {to_ext} on port {rtp_port}")
+            
     def handle_ack(self, request_line, headers, addr, transport, client_socket=None):
         """Handle ACK requests"""
         call_id = headers.get('call-id')
@@ -509,7 +552,12 @@ class SIPRegistrar:
         """Handle BYE requests"""
         call_id = headers.get('call-id')
         if call_id:
+            # A call still ringing must not be answered after its BYE
+            pending = self.pending_answers.pop(call_id, None)
+            if pending is not None:
+                pending[0].cancel()
             self.call_manager.end_call(call_id)
+            self.rtp_engine.remove_stream(call_id)
             self.send_response(addr, '200', 'OK', headers, transport, client_socket)
             print(f"Call {call_id} terminated via {transport}")
             
@@ -521,25 +569,38 @@ class SIPRegistrar:
         """Handle CANCEL requests"""
         self.send_response(addr, '200', 'OK', headers, transport, client_socket)
         
-    def handle_test_extension_call(self, extension, call_id, headers, addr, transport, client_socket):
+        # A call still ringing is never answered; its INVITE gets 487
+        call_id = headers.get('call-id')
+        pending = self.pending_answers.pop(call_id, None)
+        if pending is not None:
+            timer, invite_headers, invite_addr, invite_transport, invite_socket = pending
+            timer.cancel()
+            self.rtp_engine.remove_stream(call_id)
+            self.call_manager.end_call(call_id)
+            self.send_response(invite_addr, '487', 'Request Terminated', invite_headers, invite_transport, invite_socket)
+            print(f"Call {call_id} cancelled while ringing")
+        
+    def handle_test_extension_call(self, extension, call_id, headers, addr, transport, client_socket, body=''):
         """Handle calls to test extensions with REAL RTP analysis"""
         test_info = self.test_extensions[extension]
         
         print(f"Test call to {extension} ({test_info['name']}) - Call-ID: {call_id}")
         
-        # Send 200 OK with SDP for test extension
-        self.send_ok_with_sdp(addr, headers, transport, client_socket, call_id)
-        
         # Start REAL RTP processing - same as normal calls
-        rtp_port = self.parse_sdp_port(headers)
+        rtp_port = self.rtp_engine.allocate_port(call_id)
         if rtp_port:
+            remote_rtp_ip = self.parse_sdp(body).get('connection_ip') or addr[0]
             print(f"Starting REAL RTP analysis for test extension {extension} on port {rtp_port}")
-            self.start_rtp_processing(call_id, rtp_port, addr[0])
+            self.start_rtp_processing(call_id, rtp_port, remote_rtp_ip)
+            
+            # Send 200 OK with SDP for test extension
+            self.send_ok_with_sdp(addr, headers, transport, client_socket, call_id, rtp_port)
         else:
-            print(f"Warning: Could not parse RTP port for test extension {extension}")
+            print(f"Warning: No RTP port available for test extension {extension}")
+            self.send_response(addr, '503', 'Service Unavailable', headers, transport, client_socket)
         
         # Notify dashboard of test call
-        self.socketio.emit('test_call_started', {
+        self.publisher.publish('summary', 'test_call_started', {
             'call_id': call_id,
             'extension': extension,
             'test_name': test_info['name'],
@@ -554,93 +615,57 @@ class SIPRegistrar:
         # Implementation for call forwarding
         pass
         
-    def send_response(self, addr, code, reason, request_headers, transport='UDP', client_socket=None):
+    def send_response(self, addr, code, reason, request_headers, transport='UDP', client_socket=None, extra_headers=None):
         """Send SIP response"""
         try:
-            via = request_headers.get('via', '')
-            call_id_header = request_headers.get('call-id', 'unknown')
-            from_header = request_headers.get('from', '')
-            to_header = request_headers.get('to', '')
-            cseq = request_headers.get('cseq', '1 REGISTER')
-            
-            response = f"SIP/2.0 {code} {reason}\r\n"
-            response += f"Via: {via}\r\n"
-            response += f"Call-ID: {call_id_header}\r\n"
-            response += f"From: {from_header}\r\n"
-            response += f"To: {to_header}\r\n"
-            response += f"CSeq: {cseq}\r\n"
-            response += f"Server: VoIP-Quality-Monitor-Registrar/1.0\r\n"
-            
-            if code == '200' and 'REGISTER' in cseq:
-                response += f"Contact: {request_headers.get('contact', '')}\r\n"
-                response += f"Expires: {self.registration_expires}\r\n"
-                
-            response += "Content-Length: 0\r\n\r\n"
-            
-            # Send via appropriate transport
-            if transport == 'TCP' and client_socket:
-                client_socket.send(response.encode('utf-8'))
-            elif transport == 'TLS' and client_socket:
-                client_socket.send(response.encode('utf-8'))
-            else:
-                self.udp_socket.sendto(response.encode('utf-8'), addr)
-                
+            if code == '200' and 'REGISTER' in request_headers.get('cseq', ''):
+                register_headers = {
+                    'Contact': request_headers.get('contact', ''),
+                    'Expires': self.registration_expires
+                }
+                extra_headers = {**register_headers, **extra_headers} if extra_headers else register_headers
+            
+            response = self.responses.response(code, reason, request_headers, extra_headers)
+            self.send_message(response, addr, transport, client_socket, request_headers)
             print(f"Sent {code} {reason} to {addr} via {transport}")
             
-            # Broadcast outgoing SIP message to dashboard
-            self.broadcast_sip_message(response, addr, transport, 'outgoing')
-            
         except Exception as e:
             print(f"Error sending SIP response: {e}")
             
-    def send_ok_with_sdp(self, addr, request_headers, transport, client_socket, call_id, rtp_port=5004):
+    def send_ok_with_sdp(self, addr, request_headers, transport, client_socket, call_id, rtp_port):
         """Send 200 OK with SDP for INVITE"""
         try:
-            sdp = self.generate_sdp(rtp_port)
-            
-            response = self.build_ok_response(request_headers, len(sdp))
-            response += sdp
-            
-            if transport == 'TCP' and client_socket:
-                client_socket.send(response.encode('utf-8'))
-            elif transport == 'TLS' and client_socket:
-                client_socket.send(response.encode('utf-8'))
-            else:
-                self.udp_socket.sendto(response.encode('utf-8'), addr)
-                
+            response = self.responses.ok_with_sdp(request_headers, rtp_port)
+            self.send_message(response, addr, transport, client_socket, request_headers)
             print(f"Sent 200 OK with SDP to {addr} via {transport}")
             
-            # Broadcast outgoing SIP message to dashboard
-            self.broadcast_sip_message(response, addr, transport, 'outgoing')
-            
         except Exception as e:
             print(f"Error sending OK with SDP: {e}")
             
-    def build_ok_response(self, request_headers, content_length):
-        """Build 200 OK response headers"""
-        via = request_headers.get('via', '')
-        call_id = request_headers.get('call-id', '')
-        from_header = request_headers.get('from', '')
-        to_header = request_headers.get('to', '')
-        cseq = request_headers.get('cseq', '')
-        
-        # Add tag to To header if not present (required for 200 OK responses)
-        if 'tag=' not in to_header:
-            import random
-            tag = f"tag={random.randint(1000000, 9999999)}"
-            to_header += f";{tag}"
-        
-        response = "SIP/2.0 200 OK\r\n"
-        response += f"Via: {via}\r\n"
-        response += f"Call-ID: {call_id}\r\n"
-        response += f"From: {from_header}\r\n"
-        response += f"To: {to_header}\r\n"
-        response += f"CSeq: {cseq}\r\n"
-        response += f"Contact: <sip:{self.get_local_ip()}:{self.udp_port}>\r\n"
-        response += "Content-Type: application/sdp\r\n"
-        response += f"Content-Length: {content_length}\r\n\r\n"
-        
-        return response
+    def send_message(self, message, addr, transport, client_socket=None, request_headers=None):
+        """Send a rendered SIP message over the request's transport and trace it on the dashboard
+        
+        Args:
+            message: Rendered SIP message
+            addr: Destination address
+            transport: 'UDP', 'TCP' or 'TLS'
+            client_socket: Stream connection for TCP/TLS
+            request_headers: Request a response answers, so its transaction can replay it
+        """
+        data = message.encode('utf-8')
+        self.send_data(data, addr, transport, client_socket)
+        if request_headers is not None:
+            self.transactions.respond(request_headers, data)
+        
+        # Broadcast outgoing SIP message to dashboard
+        self.broadcast_sip_message(message, addr, transport, 'outgoing')
+        
+    def send_data(self, data, addr, transport, client_socket=None):
+        """Send encoded SIP data over UDP or the request's stream connection"""
+        if transport in ('TCP', 'TLS') and client_socket:
+            client_socket.send(data)
+        else:
+            self.udp_socket.sendto(data, addr)
         
     def extract_extension(self, header):
         """Extract username from SIP header"""
@@ -660,82 +685,78 @@ class SIPRegistrar:
             return f"{match.group(1)}@{match.group(2)}" if match.group(2) else match.group(1)
         return header.split()[0] if header else 'unknown'
         
-    def parse_sdp_port(self, headers):
-        """Parse RTP port from SDP"""
-        return 8000  # Default RTP port for monitoring
-        
-    def generate_sdp(self, rtp_port=5004):
+    def parse_sdp(self, body):
+        """Parse connection address, audio port and payload types from an SDP body"""
+        sdp_info = {}
+        session_ip = None
+        media_ip = None
+        in_media = False
+        in_audio = False
+        
+        for line in body.splitlines():
+            line = line.strip()
+            if line.startswith('c='):
+                # c=IN IP4 <address>[/ttl] - media-level c= overrides the session-level one
+                parts = line[2:].split()
+                if len(parts) >= 3:
+                    address = parts[2].split('/')[0]
+                    if in_audio:
+                        media_ip = address
+                    elif not in_media:
+                        session_ip = address
+            elif line.startswith('m='):
+                # m=audio <port>[/count] RTP/AVP <fmt list>
+                parts = line[2:].split()
+                in_media = True
+                in_audio = bool(parts) and parts[0] == 'audio' and 'audio_port' not in sdp_info
+                if in_audio and len(parts) >= 2:
+                    try:
+                        sdp_info['audio_port'] = int(parts[1].split('/')[0])
+                    except ValueError:
+                        in_audio = False
+                        continue
+                    sdp_info['payload_types'] = [int(pt) for pt in parts[3:] if pt.isdigit()]
+        
+        if media_ip or session_ip:
+            sdp_info['connection_ip'] = media_ip or session_ip
+        return sdp_info
+        
+    def parse_sdp_port(self, body):
+        """Parse RTP audio port from SDP"""
+        return self.parse_sdp(body).get('audio_port')
+        
+    def generate_sdp(self, rtp_port):
         """Generate SDP for call monitoring with specific RTP port"""
-        local_ip = self.get_local_ip()
-        
-        return f"""v=0\r
-o=voip-monitor 123456 654321 IN IP4 {local_ip}\r
-s=VoIP Quality Monitor\r
-c=IN IP4 {local_ip}\r
-t=0 0\r
-m=audio {rtp_port} RTP/AVP 0 8 18 101\r
-a=rtpmap:0 PCMU/8000\r
-a=rtpmap:8 PCMA/8000\r
-a=rtpmap:18 G729/8000\r
-a=rtpmap:101 telephone-event/8000\r
-a=fmtp:18 annexb=yes\r
-a=sendrecv\r
-"""
+        return self.responses.sdp(rtp_port)
         
     def get_local_ip(self):
-        """Get local IP address"""
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip = s.getsockname()[0]
-            s.close()
-            return ip
-        except:
-            return "127.0.0.1"
+        """Get local IP address (cached, re-probed periodically)"""
+        return self.local_address.get()
             
     def start_rtp_processing(self, call_id, rtp_port, remote_ip):
         """Start RTP stream processing for quality monitoring"""
-        def process_rtp():
-            try:
-                print(f"Creating RTP processor for call {call_id} on port {rtp_port}")
-                rtp_processor = RTPProcessor(call_id, rtp_port, self.call_manager)
-                print(f"Starting RTP processing thread for call {call_id}")
-                rtp_processor.start_processing()
-                print(f"RTP processing started for call {call_id}")
-            except Exception as e:
-                print(f"RTP processing error for call {call_id}: {e}")
-                import traceback
-                traceback.print_exc()
-        
-        rtp_thread = threading.Thread(target=process_rtp, daemon=True)
-        rtp_thread.start()
-        print(f"RTP thread started for call {call_id} monitoring port {rtp_port}")
+        try:
+            self.rtp_engine.add_stream(call_id, rtp_port, remote_ip)
+            print(f"RTP monitoring active for call {call_id} on port {rtp_port}")
+        except Exception as e:
+            print(f"RTP processing error for call {call_id}: {e}")
+            import traceback
+            traceback.print_exc()
         
-    def cleanup_expired_registrations(self):
-        """Clean up expired registrations"""
-        while self.running:
-            try:
-                now = datetime.now()
-                expired = []
-                
-                for extension, info in self.registered_devices.items():
-                    if info['expires'] < now:
-                        expired.append(extension)
-                        
-                for extension in expired:
-                    del self.registered_devices[extension]
-                    print(f"Registration expired for extension {extension}")
-                    
-                    self.socketio.emit('device_expired', {
-                        'extension': extension,
-                        'timestamp': now.isoformat()
-                    })
-                    
-                time.sleep(60)  # Check every minute
-                
-            except Exception as e:
-                print(f"Error in registration cleanup: {e}")
-                time.sleep(60)
+    def expire_registration(self, extension, device):
+        """Timer callback: drop a registration that was not refreshed in time"""
+        # Check and delete together, so a re-REGISTER storing a new device in
+        # between is never dropped
+        with self.registrations_lock:
+            if self.registered_devices.get(extension) is not device:
+                return  # Refreshed or removed since the timer was set
+            del self.registered_devices[extension]
+        print(f"Registration expired for extension {extension}")
+        
+        self.publish_device_event('device_expired', {
+            'extension': extension,
+            'timestamp': datetime.now().isoformat()
+        })
                 
     def get_registered_devices(self):
         """Get list of currently registered devices"""
@@ -752,21 +773,57 @@ a=sendrecv\r
         return devices
     
     def broadcast_sip_message(self, message, addr, transport, direction):
-        """Broadcast SIP message to dashboard via WebSocket"""
+        """Publish a SIP message to the 'sip-trace' room and the rooms of its From/To extensions
+
+        Args:
+            message: Message text, or the received SIPMessage (only decoded
+                     when one of the rooms has subscribers)
+            addr: Remote address
+            transport: 'UDP', 'TCP' or 'TLS'
+            direction: 'incoming' or 'outgoing'
+        """
         try:
-            self.socketio.emit('sip_message', {
-                'message': message,
+            if isinstance(message, SIPMessage):
+                headers = message.index()
+                extensions = set()
+                for name in ('from', 'to'):
+                    match = SIP_URI_USER.search(headers.get(name, ''))
+                    if match:
+                        extensions.add(match.group(1))
+            else:
+                extensions = set(SIP_PARTY_PATTERN.findall(message))
+            rooms = [room for room in ['sip-trace'] + [extension_room(extension) for extension in extensions]
+                     if self.publisher.has_subscribers(room)]
+            if not rooms:
+                return
+
+            event = {
+                'message': message.text if isinstance(message, SIPMessage) else message,
                 'remote_addr': f"{addr[0]}:{addr[1]}",
                 'transport': transport,
                 'direction': direction,
                 'timestamp': datetime.now().isoformat()
-            })
+            }
+            for room in rooms:
+                self.publisher.publish(room, 'sip_message', event)
         except Exception as e:
             print(f"Error broadcasting SIP message: {e}")
+    
+    def publish_device_event(self, event, data):
+        """Publish a registration event to the 'summary' room and the extension's room"""
+        self.publisher.publish('summary', event, data)
+        self.publisher.publish(extension_room(data['extension']), event, data)
         
     def stop(self):
         """Stop the SIP Registrar"""
         self.running = False
+        self.sip_workers.stop()
+        for timer, *_ in list(self.pending_answers.values()):
+            timer.cancel()
+        self.pending_answers.clear()
+        
+        if self.async_transport:
+            self.async_transport.stop()
         
         if self.udp_socket:
             self.udp_socket.close()
@@ -776,6 +833,8 @@ a=sendrecv\r
             
         for client_socket in list(self.tcp_connections.keys()):
             self.close_tcp_connection(client_socket)
+            
+        self.rtp_engine.stop()
     
     def verify_sip_auth(self, authorization, username):
         """Verify SIP authentication credentials using digest authentication"""
@@ -847,37 +906,15 @@ a=sendrecv\r
     def send_auth_challenge(self, addr, request_headers, transport, client_socket=None):
         """Send 401 Unauthorized with authentication challenge"""
         try:
-            via = request_headers.get('via', '')
-            call_id = request_headers.get('call-id', 'unknown')
-            from_header = request_headers.get('from', '')
-            to_header = request_headers.get('to', '')
-            cseq = request_headers.get('cseq', '1 REGISTER')
-            
             # Generate nonce for digest auth
             import hashlib
             import time
             nonce = hashlib.md5(f"{time.time()}{addr}".encode()).hexdigest()
             
-            response = f"SIP/2.0 401 Unauthorized\r\n"
-            response += f"Via: {via}\r\n"
-            response += f"Call-ID: {call_id}\r\n"
-            response += f"From: {from_header}\r\n"
-            response += f"To: {to_header}\r\n"
-            response += f"CSeq: {cseq}\r\n"
-            response += f'WWW-Authenticate: Digest realm="{self.domain}", nonce="{nonce}"\r\n'
-            response += f"Server: VoIP-Quality-Monitor-Registrar/1.0\r\n"
-            response += "Content-Length: 0\r\n\r\n"
-            
-            # Send via appropriate transport
-            if transport == 'TCP' and client_socket:
-                client_socket.send(response.encode('utf-8'))
-            elif transport == 'TLS' and client_socket:
-                client_socket.send(response.encode('utf-8'))
-            else:
-                self.udp_socket.sendto(response.encode('utf-8'), addr)
-            
-            # Broadcast outgoing challenge to dashboard
-            self.broadcast_sip_message(response, addr, transport, 'outgoing')
+            response = self.responses.response('401', 'Unauthorized', request_headers, {
+                'WWW-Authenticate': f'Digest realm="{self.domain}", nonce="{nonce}"'
+            })
+            self.send_message(response, addr, transport, client_socket, request_headers)
             print(f"Sent 401 Unauthorized to {addr} via {transport}")
             
         except Exception as e:
@@ -886,7 +923,7 @@ a=sendrecv\r
     def send_redirect_response(self, addr, request_headers, to_ext, transport, client_socket=None):
         """Send 302 Moved Temporarily redirect response"""
         try:
-            via = request_headers.get('via', '')
+            via = via_lines(request_headers)
             call_id = request_headers.get('call-id', '')
             from_header = request_headers.get('from', '')
             to_header = request_headers.get('to', '')
@@ -903,7 +940,7 @@ a=sendrecv\r
             redirect_uri = f"sip:echo@{local_ip}:5060"
             
             response = "SIP/2.0 302 Moved Temporarily\r\n"
-            response += f"Via: {via}\r\n"
+            response += via
             response += f"Call-ID: {call_id}\r\n"
             response += f"From: {from_header}\r\n"
             response += f"To: {to_header}\r\n"
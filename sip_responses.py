@@ -0,0 +1,173 @@
+"""
+SIP response builder for VoIP Quality Monitor
+Responses are rendered from precompiled templates in a single format call.
+The local address is probed once and re-checked at most every
+refresh_interval seconds instead of opening a socket per response, and SDP
+bodies are cached per codec set with only the RTP port filled in per call.
+"""
+import os
+import random
+import socket
+import threading
+import time
+from sip_message import split_header_values
+
+SERVER_NAME = 'VoIP-Quality-Monitor-Registrar/1.0'
+
+# Offered payload types -> (rtpmap, fmtp or None)
+SDP_CODECS = {
+    0: ('PCMU/8000', None),
+    8: ('PCMA/8000', None),
+    18: ('G729/8000', 'annexb=yes'),
+    101: ('telephone-event/8000', None)
+}
+DEFAULT_PAYLOAD_TYPES = (0, 8, 18, 101)
+
+RESPONSE_TEMPLATE = (
+    "SIP/2.0 {code} {reason}\r\n"
+    "{via}"
+    "Call-ID: {call_id}\r\n"
+    "From: {from_header}\r\n"
+    "To: {to_header}\r\n"
+    "CSeq: {cseq}\r\n"
+    "{extra}"
+    "Content-Length: {length}\r\n"
+    "\r\n"
+    "{body}"
+)
+
+def via_lines(request_headers):
+    """Via lines of a response: every Via of the request, in order (RFC 3261 section 8.2.6.2)"""
+    # Repeated Via lines arrive combined into one comma-separated value
+    values = split_header_values(request_headers.get('via', '')) or ['']
+    return ''.join(f"Via: {value}\r\n" for value in values)
+
+class LocalAddress:
+    """Cached IP address of the interface that routes to the outside world"""
+
+    def __init__(self, refresh_interval=30.0, probe_host='8.8.8.8'):
+        self.refresh_interval = refresh_interval
+        self.probe_host = probe_host
+        # SIP_LOCAL_IP pins the address (NAT, multi-homed hosts) and disables probing
+        self.pinned = os.environ.get('SIP_LOCAL_IP')
+        self.ip = self.pinned
+        self.checked = 0.0
+        self.version = 0  # Bumped whenever the address changes
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Get the local IP, re-probing only when the cached value is stale"""
+        if self.pinned or time.monotonic() - self.checked < self.refresh_interval:
+            return self.ip
+        with self.lock:
+            if time.monotonic() - self.checked >= self.refresh_interval:
+                self.refresh()
+        return self.ip
+
+    def refresh(self):
+        """Probe the routing table (connect() on UDP sends nothing) and record changes"""
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                s.connect((self.probe_host, 80))
+                ip = s.getsockname()[0]
+            finally:
+                s.close()
+        except OSError:
+            ip = '127.0.0.1'
+
+        self.checked = time.monotonic()
+        if ip != self.ip:
+            if self.ip is not None:
+                print(f"Local address changed: {self.ip} -> {ip}")
+            self.ip = ip
+            self.version += 1
+
+    def invalidate(self):
+        """Force a re-probe on the next get(), e.g. after a network error"""
+        self.checked = 0.0
+
+class SIPResponseBuilder:
+    def __init__(self, local_address, sip_port=5060, server_name=SERVER_NAME):
+        self.local_address = local_address
+        self.sip_port = sip_port
+        self.server_name = server_name
+        self.server_line = f"Server: {server_name}\r\n"
+        self.address_key = None  # (address version, SIP port) the cached parts were built for
+        self.sdp_headers = None  # Contact/Content-Type/Server lines of a 200 OK with SDP
+        self.sdp_bodies = {}  # {payload types: (body before the port, body after the port)}
+
+    def check_address(self):
+        """Rebuild the address-dependent template parts if the local IP changed"""
+        local_ip = self.local_address.get()
+        key = (self.local_address.version, self.sip_port)
+        if key != self.address_key:
+            self.address_key = key
+            self.sdp_headers = (f"Contact: <sip:{local_ip}:{self.sip_port}>\r\n"
+                                "Content-Type: application/sdp\r\n" + self.server_line)
+            self.sdp_bodies = {}
+        return local_ip
+
+    def response(self, code, reason, request_headers, extra_headers=None, body='', to_tag=False):
+        """Render a response to a request
+
+        Args:
+            code: Status code
+            reason: Reason phrase
+            request_headers: Request headers (anything with .get(), e.g. a SIPMessage)
+            extra_headers: Optional {name: value} added after the dialog headers
+            body: Optional body (ASCII, e.g. SDP)
+            to_tag: Add a To tag if the request has none (dialog-creating responses)
+
+        Returns:
+            str: The complete response
+        """
+        if extra_headers:
+            extra = ''.join(f"{name}: {value}\r\n" for name, value in extra_headers.items()) + self.server_line
+        else:
+            extra = self.server_line
+        return self.render(code, reason, request_headers, extra, body, to_tag)
+
+    def ok_with_sdp(self, request_headers, rtp_port, payload_types=DEFAULT_PAYLOAD_TYPES):
+        """Render a 200 OK answering an INVITE with our SDP"""
+        body = self.sdp(rtp_port, payload_types)  # Also refreshes sdp_headers
+        return self.render('200', 'OK', request_headers, self.sdp_headers, body, True)
+
+    def render(self, code, reason, request_headers, extra, body, to_tag):
+        to_header = request_headers.get('to', '')
+        if to_tag and 'tag=' not in to_header:
+            to_header = f"{to_header};tag={random.randint(1000000, 9999999)}"
+
+        return RESPONSE_TEMPLATE.format(
+            code=code, reason=reason,
+            via=via_lines(request_headers),
+            call_id=request_headers.get('call-id', 'unknown'),
+            from_header=request_headers.get('from', ''),
+            to_header=to_header,
+            cseq=request_headers.get('cseq', ''),
+            extra=extra, length=len(body), body=body)
+
+    def sdp(self, rtp_port, payload_types=DEFAULT_PAYLOAD_TYPES):
+        """SDP answer for an RTP port, from the cached body of this codec set"""
+        self.check_address()
+        parts = self.sdp_bodies.get(payload_types)
+        if parts is None:
+            parts = self.sdp_bodies[payload_types] = self.build_sdp(payload_types)
+        return f"{parts[0]}{rtp_port}{parts[1]}"
+
+    def build_sdp(self, payload_types):
+        """Render the SDP for a codec set around the RTP port"""
+        local_ip = self.local_address.get()
+        before = (
+            "v=0\r\n"
+            f"o=voip-monitor 123456 654321 IN IP4 {local_ip}\r\n"
+            "s=VoIP Quality Monitor\r\n"
+            f"c=IN IP4 {local_ip}\r\n"
+            "t=0 0\r\n"
+            "m=audio "
+        )
+        after = f" RTP/AVP {' '.join(str(pt) for pt in payload_types)}\r\n"
+        after += ''.join(f"a=rtpmap:{pt} {SDP_CODECS[pt][0]}\r\n" for pt in payload_types)
+        after += ''.join(f"a=fmtp:{pt} {SDP_CODECS[pt][1]}\r\n" for pt in payload_types if SDP_CODECS[pt][1])
+        after += "a=sendrecv\r\n"
+        return before, after
@@ -1,8 +1,9 @@
 import socket
-import threading
 import re
 from datetime import datetime
-from rtp_processor import RTPProcessor
+from rtp_engine import RTPEngine
+from sip_workers import SIPWorkerPool
+from sip_responses import LocalAddress
 
 class SIPServer:
     def __init__(self, call_manager, socketio):
@@ -13,6 +14,9 @@ class SIPServer:
         self.socket = None
         self.running = False
         self.active_sessions = {}
+        self.rtp_engine = RTPEngine(call_manager)
+        self.sip_workers = SIPWorkerPool(self.handle_request, self.reject_request)
+        self.local_address = LocalAddress()
         
     def start(self):
         """Start the SIP server"""
@@ -20,17 +24,14 @@ class SIPServer:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.socket.bind((self.host, self.port))
             self.running = True
+            self.sip_workers.start()
             
             print(f"SIP Server listening on {self.host}:{self.port}")
             
             while self.running:
                 try:
                     data, addr = self.socket.recvfrom(4096)
-                    threading.Thread(
-                        target=self.handle_request,
-                        args=(data, addr),
-                        daemon=True
-                    ).start()
+                    self.sip_workers.submit(addr[0], data, addr)
                     
                 except socket.timeout:
                     continue
@@ -43,8 +44,10 @@ class SIPServer:
     def stop(self):
         """Stop the SIP server"""
         self.running = False
+        self.sip_workers.stop()
         if self.socket:
             self.socket.close()
+        self.rtp_engine.stop()
             
     def handle_request(self, data, addr):
         """Handle incoming SIP request"""
@@ -73,6 +76,15 @@ class SIPServer:
         except Exception as e:
             print(f"Error handling SIP request: {e}")
             
+    def reject_request(self, data, addr):
+        """Answer a request the worker pool has no room for with 503 and Retry-After"""
+        lines = data.decode('utf-8', errors='ignore').split('\r\n')
+        if lines[0].startswith(('ACK', 'SIP/2.0')):
+            return
+        headers = self.parse_headers(lines[1:])
+        self.send_response(addr, '503', 'Service Unavailable', headers,
+                           extra_headers={'Retry-After': self.sip_workers.retry_after})
+            
     def parse_headers(self, header_lines):
         """Parse SIP headers"""
         headers = {}
@@ -150,7 +162,7 @@ class SIPServer:
         # Send 200 OK for registration
         self.send_response(addr, '200', 'OK', headers)
         
-    def send_response(self, addr, code, reason, request_headers):
+    def send_response(self, addr, code, reason, request_headers, extra_headers=None):
         """Send SIP response"""
         call_id = request_headers.get('call-id', 'unknown')
         from_header = request_headers.get('from', '')
@@ -162,6 +174,8 @@ class SIPServer:
         response += f"From: {from_header}\r\n"
         response += f"To: {to_header}\r\n"
         response += f"Call-ID: {call_id}\r\n"
+        for name, value in (extra_headers or {}).items():
+            response += f"{name}: {value}\r\n"
         response += f"Content-Length: 0\r\n\r\n"
         
         self.socket.sendto(response.encode('utf-8'), addr)
@@ -219,21 +233,9 @@ class SIPServer:
         return sdp
         
     def get_local_ip(self):
-        """Get local IP address"""
-        try:
-            # Create a dummy socket to get local IP
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            local_ip = s.getsockname()[0]
-            s.close()
-            return local_ip
-        except:
-            return "127.0.0.1"
+        """Get local IP address (cached, re-probed periodically)"""
+        return self.local_address.get()
             
     def start_rtp_processing(self, call_id, rtp_port, remote_ip):
         """Start RTP stream processing"""
-        def process_rtp():
-            rtp_processor = RTPProcessor(call_id, rtp_port, self.call_manager)
-            rtp_processor.start_processing()
-            
-        threading.Thread(target=process_rtp, daemon=True).start()
+        self.rtp_engine.add_stream(call_id, rtp_port, remote_ip)
@@ -3,7 +3,7 @@ import threading
 import re
 import select
 from datetime import datetime
-from rtp_processor import RTPProcessor
+from rtp_engine import RTPEngine
 
 class SIPServerTCP:
     def __init__(self, call_manager, socketio):
@@ -17,6 +17,7 @@ class SIPServerTCP:
         self.running = False
         self.active_sessions = {}
         self.tcp_connections = {}
+        self.rtp_engine = RTPEngine(call_manager)
         
     def start(self):
         """Start both UDP and TCP SIP servers"""
@@ -189,6 +190,8 @@ class SIPServerTCP:
         if self.tcp_socket:
             self.tcp_socket.close()
             
+        self.rtp_engine.stop()
+            
         # Close all TCP connections
         for client_socket in list(self.tcp_connections.keys()):
             self.close_tcp_connection(client_socket)
@@ -355,12 +358,7 @@ a=rtpmap:0 PCMU/8000
             
     def start_rtp_processing(self, call_id, rtp_port, remote_ip):
         """Start RTP stream processing"""
-        def process_rtp():
-            try:
-                rtp_processor = RTPProcessor(call_id, rtp_port, self.call_manager)
-                rtp_processor.start_processing()
-            except Exception as e:
-                print(f"RTP processing error for call {call_id}: {e}")
-        
-        rtp_thread = threading.Thread(target=process_rtp, daemon=True)
-        rtp_thread.start()
\ No newline at end of file
+        try:
+            self.rtp_engine.add_stream(call_id, rtp_port, remote_ip)
+        except Exception as e:
+            print(f"RTP processing error for call {call_id}: {e}")
\ No newline at end of file
@@ -0,0 +1,225 @@
+"""
+SIP server transactions for VoIP Quality Monitor (RFC 3261 section 17.2)
+Every request is matched to a server transaction by its top Via branch,
+sent-by and CSeq method (Call-ID/CSeq/Via for pre-RFC 3261 clients). A
+retransmitted request is absorbed with the last response replayed instead of
+reaching the handlers again, final INVITE responses are retransmitted over
+UDP until the ACK arrives (RFC 3261 Timer G, RFC 6026 for 2xx), and every
+transaction expires through timers on a shared TimerWheel.
+"""
+import re
+import threading
+
+MAGIC_COOKIE = 'z9hG4bK'
+VIA_SENT_BY = re.compile(r'^\s*SIP\s*/\s*2\.0\s*/\s*[A-Za-z]+\s+([^;,\s]+)', re.IGNORECASE)
+VIA_BRANCH = re.compile(r';\s*branch\s*=\s*([^;,\s]+)', re.IGNORECASE)
+
+# RFC 3261 timer values in seconds
+T1 = 0.5
+T2 = 4.0
+T4 = 5.0
+
+class ServerTransaction:
+    __slots__ = ('key', 'method', 'state', 'response', 'addr', 'transport', 'connection',
+                 'timer', 'retransmit_timer', 'interval', 'dialog_key')
+
+    def __init__(self, key, method, addr, transport, connection):
+        self.key = key
+        self.method = method
+        self.state = 'proceeding' if method == 'INVITE' else 'trying'
+        self.response = None      # Last response sent, as bytes
+        self.addr = addr
+        self.transport = transport
+        self.connection = connection
+        self.timer = None         # Lifetime timer (Timer H/I/J/L or the unanswered timeout)
+        self.retransmit_timer = None
+        self.interval = T1
+        self.dialog_key = None    # (Call-ID, CSeq number) while a 2xx waits for its ACK
+
+class ServerTransactionTable:
+    def __init__(self, timers, send, timeout=64 * T1):
+        self.timers = timers    # TimerWheel driving every transaction timer
+        self.send = send        # send(data, addr, transport, connection) for replays and retransmissions
+        self.timeout = timeout  # Lifetime of a transaction whose request is never answered
+        self.transactions = {}  # {key: ServerTransaction}
+        self.dialogs = {}       # {(Call-ID, CSeq number): INVITE transaction awaiting the ACK of its 2xx}
+        self.lock = threading.Lock()
+        self.stats = {
+            'created': 0, 'absorbed': 0, 'replayed': 0, 'retransmitted': 0,
+            'acks_absorbed': 0, 'ack_timeouts': 0, 'expired': 0
+        }
+
+    def key(self, request):
+        """Transaction key of a request or of the request a response answers
+
+        Args:
+            request: Request headers (anything with .get(), e.g. a SIPMessage)
+
+        Returns:
+            tuple: Matching key (ACK maps to its INVITE), or None without Via/CSeq
+        """
+        via = request.get('via')
+        cseq = request.get('cseq')
+        if not via or not cseq:
+            return None
+        via = via.split(',', 1)[0]
+        number, _, method = cseq.partition(' ')
+        method = method.strip()
+        if method == 'ACK':
+            method = 'INVITE'
+
+        branch = VIA_BRANCH.search(via)
+        if branch and branch.group(1).startswith(MAGIC_COOKIE):
+            sent_by = VIA_SENT_BY.match(via)
+            return (branch.group(1), sent_by.group(1).lower() if sent_by else '', method)
+        # RFC 2543 clients: match on the dialog identifiers instead
+        return (request.get('call-id', ''), number, via.strip(), method)
+
+    def dialog_key(self, request):
+        return (request.get('call-id', ''), request.get('cseq', '').partition(' ')[0])
+
+    def receive(self, request, addr, transport, connection=None):
+        """Match an incoming request against the table
+
+        Args:
+            request: Parsed request (SIPMessage)
+            addr: Source address
+            transport: 'UDP', 'TCP' or 'TLS'
+            connection: Stream connection for TCP/TLS
+
+        Returns:
+            bool: True if the handlers should process it, False if it was absorbed
+        """
+        key = self.key(request)
+        if key is None:
+            return True
+
+        with self.lock:
+            transaction = self.transactions.get(key)
+            if request.method == 'ACK':
+                # ACK of a 2xx is its own request; it only stops the 2xx retransmissions.
+                # Checked first: without a z9hG4bK branch (RFC 2543) it also matches the
+                # key of the INVITE transaction it acknowledges
+                accepted = self.dialogs.pop(self.dialog_key(request), None)
+                if accepted is not None:
+                    self.cancel_retransmit(accepted)
+                    accepted.state = 'confirmed'
+                    accepted.dialog_key = None
+                    return True
+                if transaction is not None:
+                    # ACK of a non-2xx final response belongs to the INVITE transaction
+                    self.confirm(transaction)
+                    self.stats['acks_absorbed'] += 1
+                    return False
+                return True
+
+            if transaction is None:
+                transaction = ServerTransaction(key, key[-1], addr, transport, connection)
+                transaction.timer = self.timers.call_later(self.timeout, self.expire, transaction)
+                self.transactions[key] = transaction
+                self.stats['created'] += 1
+                return True
+
+            self.stats['absorbed'] += 1
+            response = transaction.response
+            if response is not None:
+                self.stats['replayed'] += 1
+
+        if response is not None:
+            self.resend(response, addr, transport, connection)
+        return False
+
+    def respond(self, request, data):
+        """Record a response sent for a request and start the timers of its new state
+
+        Args:
+            request: Headers of the request being answered
+            data: Encoded response (the status code is read from its start line)
+        """
+        key = self.key(request)
+        if key is None or request.get('cseq', '').endswith('ACK'):
+            return
+        code = int(data[8:11]) if data[8:11].isdigit() else 0
+
+        with self.lock:
+            transaction = self.transactions.get(key)
+            if transaction is None:
+                return
+            transaction.response = data
+            if code < 200:
+                transaction.state = 'proceeding'
+                return
+
+            transaction.timer.cancel()
+            self.cancel_retransmit(transaction)
+            reliable = transaction.transport != 'UDP'
+            if transaction.method != 'INVITE':
+                # Timer J: absorb retransmissions over unreliable transports
+                transaction.state = 'completed'
+                transaction.timer = self.timers.call_later(0 if reliable else 64 * T1, self.expire, transaction)
+                return
+
+            if code < 300:
+                # RFC 6026 Accepted state (Timer L); the 2xx is retransmitted until its ACK
+                transaction.state = 'accepted'
+                transaction.dialog_key = self.dialog_key(request)
+                self.dialogs[transaction.dialog_key] = transaction
+            else:
+                transaction.state = 'completed'  # Timer H
+            transaction.timer = self.timers.call_later(64 * T1, self.expire, transaction)
+            if not reliable:
+                transaction.interval = T1
+                transaction.retransmit_timer = self.timers.call_later(T1, self.retransmit, transaction)
+
+    def confirm(self, transaction):
+        """ACK received for a non-2xx final response: stop retransmitting, linger for Timer I"""
+        if transaction.state != 'completed':
+            return
+        transaction.state = 'confirmed'
+        self.cancel_retransmit(transaction)
+        transaction.timer.cancel()
+        delay = 0 if transaction.transport != 'UDP' else T4
+        transaction.timer = self.timers.call_later(delay, self.expire, transaction)
+
+    def cancel_retransmit(self, transaction):
+        if transaction.retransmit_timer is not None:
+            transaction.retransmit_timer.cancel()
+            transaction.retransmit_timer = None
+
+    def retransmit(self, transaction):
+        """Timer G: resend the final INVITE response, doubling the interval up to T2"""
+        with self.lock:
+            if transaction.state not in ('completed', 'accepted') or self.transactions.get(transaction.key) is not transaction:
+                return
+            transaction.interval = min(transaction.interval * 2, T2)
+            transaction.retransmit_timer = self.timers.call_later(transaction.interval, self.retransmit, transaction)
+            self.stats['retransmitted'] += 1
+            response = transaction.response
+        self.resend(response, transaction.addr, transaction.transport, transaction.connection)
+
+    def expire(self, transaction):
+        """Lifetime timer fired: drop the transaction"""
+        with self.lock:
+            if self.transactions.get(transaction.key) is transaction:
+                del self.transactions[transaction.key]
+            if transaction.dialog_key is not None:
+                self.dialogs.pop(transaction.dialog_key, None)
+                self.stats['ack_timeouts'] += 1
+            elif transaction.state == 'completed' and transaction.method == 'INVITE':
+                self.stats['ack_timeouts'] += 1
+            self.cancel_retransmit(transaction)
+            self.stats['expired'] += 1
+
+    def resend(self, data, addr, transport, connection):
+        try:
+            self.send(data, addr, transport, connection)
+        except Exception as e:
+            print(f"Error resending SIP response to {addr}: {e}")
+
+    def get_stats(self):
+        """Get transaction counts"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['active'] = len(self.transactions)
+            stats['awaiting_ack'] = len(self.dialogs)
+        return stats
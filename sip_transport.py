@@ -0,0 +1,155 @@
+"""
+asyncio SIP transports for VoIP Quality Monitor
+One event loop thread serves UDP (DatagramProtocol) and every TCP/TLS
+connection (streams, with TLS handshakes done asynchronously), feeding the
+registrar's existing framing and handler methods. Handlers keep calling
+sendto()/send() from worker threads through thread-safe adapters.
+"""
+import asyncio
+import ssl
+from functools import partial
+from sip_framer import SIPStreamFramer
+
+class DatagramSender:
+    """Thread-safe stand-in for the registrar's UDP socket"""
+
+    def __init__(self, loop, transport):
+        self.loop = loop
+        self.transport = transport
+
+    def sendto(self, data, addr):
+        self.loop.call_soon_threadsafe(self.transport.sendto, bytes(data), addr)
+        return len(data)
+
+    def close(self):
+        # The loop is already gone if AsyncSIPTransport.stop() finished first
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.transport.close)
+
+class StreamConnection:
+    """Thread-safe stand-in for a TCP/TLS client socket, used as the connection key"""
+
+    def __init__(self, loop, writer, max_write_buffer=1024 * 1024):
+        self.loop = loop
+        self.writer = writer
+        self.max_write_buffer = max_write_buffer  # Bytes queued for a peer that stopped reading
+
+    def send(self, data):
+        self.loop.call_soon_threadsafe(self._write, bytes(data))
+        return len(data)
+
+    sendall = send
+
+    def _write(self, data):
+        transport = self.writer.transport
+        if transport.is_closing():
+            return
+        self.writer.write(data)
+        if transport.get_write_buffer_size() > self.max_write_buffer:
+            print(f"Closing SIP connection {self.writer.get_extra_info('peername')}: peer is not reading")
+            transport.abort()
+
+    def close(self):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.writer.close)
+
+class SIPDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, registrar):
+        self.registrar = registrar
+
+    def datagram_received(self, data, addr):
+        self.registrar.sip_workers.submit(addr[0], data, addr, 'UDP')
+
+    def error_received(self, exc):
+        print(f"SIP UDP error: {exc}")
+
+class AsyncSIPTransport:
+    def __init__(self, registrar, read_size=65536, handshake_timeout=10.0):
+        self.registrar = registrar
+        self.read_size = read_size
+        self.handshake_timeout = handshake_timeout  # Seconds before an unfinished TLS handshake is dropped
+        self.loop = None
+        self.stopping = None
+        self.streams = {}  # {handler task: StreamConnection}
+
+    def run(self):
+        """Serve until stop() is called (blocks the calling thread)"""
+        asyncio.run(self.serve())
+
+    def stop(self):
+        """Close listeners and connections; safe to call from any thread"""
+        if self.loop and self.stopping:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def serve(self):
+        registrar = self.registrar
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+
+        udp_transport, _ = await self.loop.create_datagram_endpoint(
+            partial(SIPDatagramProtocol, registrar), local_addr=(registrar.host, registrar.udp_port))
+        registrar.udp_socket = DatagramSender(self.loop, udp_transport)
+        print(f"SIP Registrar listening on UDP {registrar.host}:{registrar.udp_port}")
+
+        servers = [await asyncio.start_server(
+            partial(self.handle_stream, 'TCP'), registrar.host, registrar.tcp_port, reuse_address=True)]
+        print(f"SIP Registrar listening on TCP {registrar.host}:{registrar.tcp_port}")
+
+        if registrar.ssl_context:
+            servers.append(await asyncio.start_server(
+                partial(self.handle_stream, 'TLS'), registrar.host, registrar.tls_port, reuse_address=True,
+                ssl=registrar.ssl_context, ssl_handshake_timeout=self.handshake_timeout))
+            print(f"SIP Registrar listening on TLS {registrar.host}:{registrar.tls_port}")
+        else:
+            print(f"TLS not available - certificates not found")
+
+        try:
+            await self.stopping.wait()
+        finally:
+            for server in servers:
+                server.close()
+            udp_transport.close()
+            # Aborting the connections ends every reader, so handlers clean up normally
+            for connection in list(self.streams.values()):
+                connection.writer.transport.abort()
+            if self.streams:
+                await asyncio.wait(list(self.streams), timeout=1.0)
+
+    async def handle_stream(self, transport_name, reader, writer):
+        """Read one TCP/TLS connection and frame it into SIP messages"""
+        registrar = self.registrar
+        addr = writer.get_extra_info('peername')[:2]
+        connection = StreamConnection(self.loop, writer)
+        task = asyncio.current_task()
+        self.streams[task] = connection
+        if transport_name == 'TLS':
+            connections, process, close = registrar.tls_connections, registrar.process_tls_buffer, registrar.close_tls_connection
+        else:
+            connections, process, close = registrar.tcp_connections, registrar.process_tcp_buffer, registrar.close_tcp_connection
+
+        connections[connection] = {
+            'addr': addr,
+            'framer': SIPStreamFramer(),
+            'transport': transport_name
+        }
+        print(f"New {transport_name} connection from {addr}")
+
+        try:
+            while registrar.running:
+                # Stop reading while this source's worker queue is full so TCP pushes back
+                while registrar.sip_workers.is_saturated(addr[0]):
+                    await asyncio.sleep(0.05)
+
+                data = await reader.read(self.read_size)
+                if not data:
+                    break
+                process(connection, data)
+                if connection not in connections:
+                    break  # Closed by the framer's buffer limit
+        except (ConnectionError, ssl.SSLError) as e:
+            print(f"{transport_name} connection from {addr} failed: {e}")
+        except Exception as e:
+            print(f"Error handling {transport_name} data: {e}")
+        finally:
+            del self.streams[task]
+            close(connection)
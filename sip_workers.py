@@ -0,0 +1,220 @@
+"""
+Bounded SIP message executor for VoIP Quality Monitor
+A fixed set of worker threads handles SIP messages from a bounded queue.
+Sources (remote IPs) are served round-robin so one flooding gateway cannot
+starve the others, and overload is shed in order: OPTIONS keepalives first,
+then everything else is answered with 503 Service Unavailable + Retry-After
+"""
+import threading
+import time
+from collections import deque
+
+# Job layout: [enqueue time, data (None once claimed or shed), handler args]
+ENQUEUED, DATA, ARGS = range(3)
+
+class SIPWorkerPool:
+    def __init__(self, handler, reject=None, workers=8, max_queue=2000, max_per_source=200,
+                 options_share=0.5, retry_after=5, name='sip-worker'):
+        self.handler = handler      # handler(data, *args), run on a worker thread
+        self.reject = reject        # reject(data, *args), run on the submitting thread
+        self.worker_count = workers
+        self.max_queue = max_queue
+        self.max_per_source = max_per_source
+        # OPTIONS are only queued while the queue is below this depth
+        self.options_limit = int(max_queue * options_share)
+        self.retry_after = retry_after  # Seconds advertised in 503 responses
+        self.name = name
+
+        self.condition = threading.Condition()
+        self.queues = {}        # {source: deque of jobs}
+        self.ready = deque()    # Sources with queued jobs, in round-robin order
+        self.options = deque()  # Queued OPTIONS jobs, oldest first, shed before anything else
+        self.depth = 0
+        self.running = False
+        self.threads = []
+
+        self.stats = {
+            'submitted': 0, 'dequeued': 0, 'handled': 0, 'errors': 0, 'dropped_options': 0, 'rejected': 0,
+            'max_depth': 0, 'wait_total': 0.0, 'wait_max': 0.0, 'handle_total': 0.0, 'handle_max': 0.0
+        }
+
+    def start(self):
+        """Start the worker threads"""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        for index in range(self.worker_count):
+            thread = threading.Thread(target=self.worker_loop, name=f"{self.name}-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Stop the workers once they finish their current message; queued messages are discarded"""
+        with self.condition:
+            self.running = False
+            self.queues.clear()
+            self.ready.clear()
+            self.options.clear()
+            self.depth = 0
+            self.condition.notify_all()
+        self.threads = []
+
+    def is_saturated(self, source):
+        """Check whether a source has a full queue (stream transports stop reading from it)"""
+        queue = self.queues.get(source)
+        return queue is not None and len(queue) >= self.max_per_source
+
+    def submit(self, source, data, *args):
+        """Queue a SIP message for handling
+
+        Args:
+            source: Fairness key, normally the remote IP
+            data: Raw SIP message bytes
+            *args: Extra handler arguments (address, transport, connection)
+
+        Returns:
+            bool: True if queued, False if it was dropped or rejected
+        """
+        is_options = data[:8] == b'OPTIONS '
+        with self.condition:
+            self.stats['submitted'] += 1
+            if not self.running:
+                return False
+
+            queue = self.queues.get(source)
+            source_full = queue is not None and len(queue) >= self.max_per_source
+            if is_options and (source_full or self.depth >= self.options_limit):
+                self.stats['dropped_options'] += 1
+                return False
+
+            evicted = None
+            if not source_full and self.depth >= self.max_queue:
+                # Make room by shedding the oldest queued OPTIONS, else the newest
+                # message of the source with the longest queue
+                while self.options and self.options[0][DATA] is None:
+                    self.options.popleft()
+                if self.options:
+                    self.options.popleft()[DATA] = None
+                    self.depth -= 1
+                    self.stats['dropped_options'] += 1
+                else:
+                    longest = max(self.queues.values(), key=len)
+                    if len(longest) > (len(queue) if queue else 0) + 1:
+                        evicted = longest.pop()
+                        if evicted[DATA] is not None:
+                            self.depth -= 1
+                            self.stats['rejected'] += 1
+
+            if source_full or self.depth >= self.max_queue:
+                self.stats['rejected'] += 1
+                rejected = True
+            else:
+                rejected = False
+                job = [time.monotonic(), data, args]
+                if queue is None:
+                    queue = self.queues[source] = deque()
+                    self.ready.append(source)
+                queue.append(job)
+                if is_options:
+                    self.options.append(job)
+                self.depth += 1
+                if self.depth > self.stats['max_depth']:
+                    self.stats['max_depth'] = self.depth
+                self.condition.notify()
+
+        if evicted is not None and evicted[DATA] is not None:
+            self.reject_job(evicted[DATA], evicted[ARGS])
+        if rejected:
+            self.reject_job(data, args)
+            return False
+        return True
+
+    def reject_job(self, data, args):
+        if self.reject:
+            try:
+                self.reject(data, *args)
+            except Exception as e:
+                print(f"Error rejecting SIP message: {e}")
+
+    def next_job(self):
+        """Take the next job, one per source in turn; None when stopping"""
+        with self.condition:
+            while True:
+                while not self.ready:
+                    if not self.running:
+                        return None
+                    self.condition.wait()
+
+                source = self.ready.popleft()
+                queue = self.queues[source]
+                job = queue.popleft()
+                if queue:
+                    self.ready.append(source)
+                else:
+                    del self.queues[source]
+
+                data = job[DATA]
+                if data is None:
+                    continue  # Shed while queued, already taken off depth
+                job[DATA] = None
+                self.depth -= 1
+                while self.options and self.options[0][DATA] is None:
+                    self.options.popleft()
+
+                wait = time.monotonic() - job[ENQUEUED]
+                self.stats['dequeued'] += 1
+                self.stats['wait_total'] += wait
+                if wait > self.stats['wait_max']:
+                    self.stats['wait_max'] = wait
+                return data, job[ARGS]
+
+    def worker_loop(self):
+        """Handle queued SIP messages until the pool stops"""
+        while True:
+            job = self.next_job()
+            if job is None:
+                return
+            data, args = job
+
+            started = time.monotonic()
+            try:
+                self.handler(data, *args)
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Error in SIP worker: {e}")
+            elapsed = time.monotonic() - started
+
+            with self.condition:
+                self.stats['handled'] += 1
+                self.stats['handle_total'] += elapsed
+                if elapsed > self.stats['handle_max']:
+                    self.stats['handle_max'] = elapsed
+
+    def get_stats(self):
+        """Get queue depth, shedding and latency statistics"""
+        with self.condition:
+            stats = dict(self.stats)
+            depth = self.depth
+            sources = len(self.queues)
+
+        handled = stats['handled']
+        dequeued = stats['dequeued']
+        wait_total = stats.pop('wait_total')
+        handle_total = stats.pop('handle_total')
+        return {
+            'workers': self.worker_count,
+            'queue_depth': depth,
+            'queued_sources': sources,
+            'max_queue': self.max_queue,
+            'max_depth': stats['max_depth'],
+            'submitted': stats['submitted'],
+            'handled': handled,
+            'errors': stats['errors'],
+            'dropped_options': stats['dropped_options'],
+            'rejected': stats['rejected'],
+            'avg_wait_ms': 1000 * wait_total / dequeued if dequeued else 0,
+            'max_wait_ms': 1000 * stats['wait_max'],
+            'avg_handle_ms': 1000 * handle_total / handled if handled else 0,
+            'max_handle_ms': 1000 * stats['handle_max']
+        }
@@ -0,0 +1,159 @@
+"""
+Socket.IO room publishing for VoIP Quality Monitor
+Dashboards opt into rooms ("calls", "summary", "sip-trace", "call:<id>",
+"ext:<extension>") and every room is rate limited: the first event of a quiet
+room is sent at once, bursts inside the interval are coalesced into a single
+frame sent when the interval expires
+"""
+import threading
+import time
+from collections import deque
+
+# Rooms clients may join, plus the per-call and per-extension prefixes
+STATIC_ROOMS = ('calls', 'summary', 'sip-trace')
+ROOM_PREFIXES = ('call:', 'ext:')
+MAX_ROOM_NAME = 128
+
+def call_room(call_id):
+    """Room of a single call's metric stream"""
+    return f"call:{call_id}"
+
+def extension_room(extension):
+    """Room of a single extension's SIP traffic and registration events"""
+    return f"ext:{extension}"
+
+def is_valid_room(room):
+    """Check that a client-requested room name is one we publish to"""
+    if not isinstance(room, str) or not room or len(room) > MAX_ROOM_NAME:
+        return False
+    return room in STATIC_ROOMS or (room.startswith(ROOM_PREFIXES) and not room.endswith(':'))
+
+class RoomPublisher:
+    """Per-room rate limiter/coalescer in front of socketio.emit
+
+    Coalescing modes:
+        'batch': queued payloads are sent together as '<event>_batch'
+                 {'room', 'items', 'dropped'}, keeping at most max_batch items
+        'latest': only the newest payload is sent, as the original event
+    """
+
+    def __init__(self, socketio, interval=0.5, max_batch=200, namespace='/'):
+        self.socketio = socketio
+        self.interval = interval    # Minimum seconds between frames of one (room, event)
+        self.max_batch = max_batch  # Items kept per batch frame, older ones are dropped
+        self.namespace = namespace
+        self.condition = threading.Condition()
+        self.pending = {}    # {(room, event): {'mode', 'items' or 'payload', 'dropped'}}
+        self.last_sent = {}  # {(room, event): time of the last frame}
+        self.thread = None
+        self.stats = {'published': 0, 'frames': 0, 'coalesced': 0, 'dropped': 0, 'no_subscribers': 0}
+
+    def has_subscribers(self, room):
+        """Check whether anybody joined a room, so empty rooms cost nothing"""
+        try:
+            rooms = self.socketio.server.manager.rooms.get(self.namespace, {})
+            return bool(rooms.get(room))
+        except Exception:
+            # Unknown server manager layout: assume the room is in use
+            return True
+
+    def publish(self, room, event, payload, mode='batch'):
+        """Send an event to a room, coalescing it with others sent within the interval
+
+        Args:
+            room: Target room name
+            event: Socket.IO event name
+            payload: JSON-serializable event data
+            mode: 'batch' or 'latest' (see class docstring)
+        """
+        if not self.has_subscribers(room):
+            self.stats['no_subscribers'] += 1
+            return
+
+        key = (room, event)
+        now = time.monotonic()
+        with self.condition:
+            self.stats['published'] += 1
+            entry = self.pending.get(key)
+            if entry is None and now - self.last_sent.get(key, 0) >= self.interval:
+                # Quiet room: send immediately, later events in the interval are coalesced
+                self.last_sent[key] = now
+                send_now = True
+            else:
+                send_now = False
+                self.stats['coalesced'] += 1
+                if entry is None:
+                    entry = self.pending[key] = {'mode': mode, 'items': deque(maxlen=self.max_batch),
+                                                 'payload': None, 'dropped': 0}
+                if mode == 'latest':
+                    entry['payload'] = payload
+                else:
+                    items = entry['items']
+                    if len(items) == items.maxlen:
+                        # The full deque drops its oldest item on append
+                        entry['dropped'] += 1
+                        self.stats['dropped'] += 1
+                    items.append(payload)
+                self._ensure_thread()
+                self.condition.notify()
+
+        if send_now:
+            self._emit(room, event, payload)
+
+    def _ensure_thread(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.flush_loop, daemon=True)
+            self.thread.start()
+
+    def flush_loop(self):
+        """Send coalesced frames as soon as their room's interval has expired"""
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+
+                now = time.monotonic()
+                due = []
+                next_due = None
+                for key in list(self.pending):
+                    ready_at = self.last_sent.get(key, 0) + self.interval
+                    if ready_at <= now:
+                        due.append((key, self.pending.pop(key)))
+                        self.last_sent[key] = now
+                    elif next_due is None or ready_at < next_due:
+                        next_due = ready_at
+
+                if not due:
+                    self.condition.wait(next_due - now)
+                    continue
+
+                # Forget rooms that have been quiet for a while (ended calls, gone extensions)
+                if len(self.last_sent) > 1000:
+                    cutoff = now - 60 * self.interval
+                    for key in [key for key, sent in self.last_sent.items() if sent < cutoff and key not in self.pending]:
+                        del self.last_sent[key]
+
+            for (room, event), entry in due:
+                if entry['mode'] == 'latest':
+                    self._emit(room, event, entry['payload'])
+                else:
+                    self._emit(room, f"{event}_batch", {
+                        'room': room,
+                        'items': list(entry['items']),
+                        'dropped': entry['dropped']
+                    })
+
+    def _emit(self, room, event, payload):
+        try:
+            self.socketio.emit(event, payload, to=room, namespace=self.namespace)
+            self.stats['frames'] += 1
+        except Exception as e:
+            print(f"Error emitting {event} to room {room}: {e}")
+
+    def get_stats(self):
+        """Get publishing statistics"""
+        with self.condition:
+            stats = dict(self.stats)
+            stats['pending_rooms'] = len(self.pending)
+        stats['interval'] = self.interval
+        return stats
@@ -3,6 +3,9 @@
 class Dashboard {
     constructor() {
         this.socket = null;
+        this.calls = new Map();   // Active calls by call_id, kept in sync by deltas
+        this.version = null;      // Server change version of this.calls
+        this.resyncPending = false;
         this.mosChart = null;
         this.networkChart = null;
         this.activeCallsTable = null;
@@ -39,11 +42,22 @@ class Dashboard {
         
         this.socket.on('connect', () => {
             console.log('Connected to dashboard updates');
+            // Rooms are per connection, so join them again after every reconnect
+            this.resyncPending = false;
+            this.socket.emit('subscribe', {rooms: ['calls', 'summary']});
+            this.requestResync();
         });
         
-        this.socket.on('call_update', (calls) => {
-            this.updateActiveCalls(calls);
-            this.updateSummaryCards(calls);
+        this.socket.on('summary_update', (data) => {
+            this.updateSummaryStats(data);
+        });
+        
+        this.socket.on('call_snapshot', (data) => {
+            this.applySnapshot(data);
+        });
+        
+        this.socket.on('call_delta', (data) => {
+            this.applyDelta(data);
         });
         
         this.socket.on('quality_update', (data) => {
@@ -60,6 +74,67 @@ class Dashboard {
         });
     }
     
+    requestResync() {
+        if (this.resyncPending) return;
+        this.resyncPending = true;
+        this.socket.emit('resync');
+    }
+    
+    applySnapshot(data) {
+        this.resyncPending = false;
+        this.version = data.version;
+        this.calls = new Map(data.active_calls.map(call => [call.call_id, call]));
+        this.renderCalls(data.summary_stats);
+    }
+    
+    applyDelta(delta) {
+        if (this.version === null || delta.resync || delta.base_version > this.version) {
+            // Missed at least one delta: ask for the full state
+            this.requestResync();
+            return;
+        }
+        if (delta.version <= this.version) return;  // Already covered by our snapshot
+        
+        // Ended calls first: a call present in delta.calls was (re)started afterwards
+        delta.ended.forEach(callId => this.calls.delete(callId));
+        
+        // Changed fields carry current values, so re-applying part of a delta is harmless
+        Object.entries(delta.calls).forEach(([callId, fields]) => {
+            let call = this.calls.get(callId);
+            if (!call || (fields.start_time && fields.start_time !== call.start_time)) {
+                call = { call_id: callId, quality_metrics: [] };  // New call (or new call with a reused id)
+            }
+            Object.assign(call, fields);
+            this.calls.set(callId, call);
+        });
+        
+        Object.entries(delta.metrics).forEach(([callId, samples]) => {
+            const call = this.calls.get(callId);
+            if (!call) return;
+            const fresh = samples.filter(sample => sample.version > this.version);
+            call.quality_metrics = (call.quality_metrics || []).concat(fresh).slice(-100);
+            if (fresh.length) {
+                this.updateQualityCharts({ call_id: callId, metrics: fresh[fresh.length - 1] });
+            }
+        });
+        
+        if (delta.ended.length) {
+            this.refreshCallHistory();
+        }
+        
+        this.version = delta.version;
+        this.renderCalls();
+    }
+    
+    renderCalls(summaryStats) {
+        const calls = Array.from(this.calls.values());
+        this.updateActiveCalls(calls);
+        if (summaryStats) {
+            this.updateSummaryStats(summaryStats);
+        }
+        this.updateSummaryCards(calls);
+    }
+    
     initializeCharts() {
         // MOS Score Chart
         const mosCtx = document.getElementById('mosChart').getContext('2d');
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the journal-backed call history store
+"""
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from call_storage import JournalHistoryStore
+
+def make_call(call_id, start_time):
+    return {
+        'call_id': call_id,
+        'start_time': start_time.isoformat(),
+        'end_time': (start_time + timedelta(seconds=30)).isoformat(),
+        'duration': 30,
+        'from': '201',
+        'to': '202',
+        'status': 'completed',
+        'avg_mos': 4.2,
+        'min_mos': 4.0,
+        'max_mos': 4.4,
+        'packet_loss_rate': 0,
+        'avg_jitter': 1.0,
+        'avg_delay': 20.0,
+        'quality_metrics': []
+    }
+
+def test_clear_then_query():
+    """Queries after clear() must only see calls added afterwards"""
+    with tempfile.TemporaryDirectory() as directory:
+        store = JournalHistoryStore(os.path.join(directory, 'calls.jsonl'), legacy_file=None)
+        try:
+            base = datetime(2025, 6, 1, 12, 0, 0)
+            for index in range(5):
+                store.add_call(make_call(f"old-{index}", base + timedelta(minutes=index)))
+            store.clear()
+
+            for index in range(3):
+                store.add_call(make_call(f"new-{index}", base + timedelta(minutes=index)))
+            assert len(store.start_times) == len(store.calls) == 3
+
+            page, _ = store.query_calls(start_time=base, end_time=base + timedelta(minutes=10))
+            assert [call['call_id'] for call in page] == ['new-2', 'new-1', 'new-0']
+
+            first, cursor = store.query_calls(limit=2)
+            assert [call['call_id'] for call in first] == ['new-2', 'new-1']
+            second, cursor = store.query_calls(limit=2, cursor=cursor)
+            assert [call['call_id'] for call in second] == ['new-0']
+            assert cursor is None
+        finally:
+            store.close()
+
+def test_restart_reads_index_and_recovers_journal_tail():
+    """Startup uses the index, recovers unindexed records and reads samples by offset"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'calls.jsonl')
+        base = datetime(2025, 6, 1, 12, 0, 0)
+        store = JournalHistoryStore(path, legacy_file=None)
+        for index in range(3):
+            call = make_call(f"call-{index}", base + timedelta(minutes=index))
+            call['quality_metrics'] = [{'timestamp': index, 'mos_score': 4.0}]
+            store.add_call(call)
+        store.close()
+
+        # A record the index missed plus a torn write, as left by a crash
+        with open(path, 'ab') as f:
+            f.write(json.dumps(make_call('call-3', base + timedelta(minutes=3))).encode() + b'\n')
+            f.write(b'{"call_id": "torn')
+
+        store = JournalHistoryStore(path, legacy_file=None)
+        try:
+            assert [call['call_id'] for call in store.get_calls()] == ['call-3', 'call-2', 'call-1', 'call-0']
+            assert all('quality_metrics' not in call for call in store.calls)
+            assert store.get_call_metrics('call-1') == [{'timestamp': 1, 'mos_score': 4.0}]
+            with open(path + '.idx') as f:
+                assert len(f.readlines()) == 4
+
+            store.add_call(make_call('call-4', base + timedelta(minutes=4)))
+        finally:
+            store.close()
+
+        store = JournalHistoryStore(path, legacy_file=None)
+        try:
+            assert len(store.calls) == 5
+            assert store.get_call_metrics('call-0') == [{'timestamp': 0, 'mos_score': 4.0}]
+        finally:
+            store.close()
@@ -5,6 +5,7 @@ Test script per verificare il calcolo MOS e debugging del sistema
 
 from mos_calculator import MOSCalculator
 from call_manager import CallManager
+from call_storage import SQLHistoryStore
 import json
 
 def test_mos_calculation():
@@ -41,7 +42,7 @@ def test_call_manager_stats():
     """Test delle statistiche del Call Manager"""
     print("\n=== TEST CALL MANAGER STATS ===")
     
-    call_manager = CallManager()
+    call_manager = CallManager(history_store=SQLHistoryStore('sqlite://'))
     
     # Simula alcune chiamate per testare le statistiche
     test_calls = [
@@ -66,7 +67,8 @@ def test_call_manager_stats():
     ]
     
     # Aggiungi chiamate di test alla cronologia
-    call_manager.call_history = test_calls
+    for call in test_calls:
+        call_manager.history_store.add_call(call)
     
     stats = call_manager.get_summary_stats()
     
@@ -0,0 +1,115 @@
+"""
+Hashed timing wheel for VoIP Quality Monitor
+One thread advances a ring of slots every tick; a timer is hashed into the
+slot of its expiry tick (timers more than one revolution away stay in their
+slot until their tick comes round), so scheduling and cancelling are O(1)
+and each tick only looks at one slot instead of a thread or a table scan
+per timeout
+"""
+import threading
+import time
+
+class Timer:
+    __slots__ = ('wheel', 'expiry_tick', 'callback', 'args', 'cancelled')
+
+    def __init__(self, wheel, expiry_tick, callback, args):
+        self.wheel = wheel
+        self.expiry_tick = expiry_tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancel the timer (no-op if it already fired)"""
+        self.wheel.cancel(self)
+
+class TimerWheel:
+    def __init__(self, tick=0.05, slots=1024, name='timer-wheel'):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]  # Each slot is an insertion-ordered set of timers
+        self.current_tick = 0
+        self.started = time.monotonic()
+        self.name = name
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.stats = {'scheduled': 0, 'cancelled': 0, 'fired': 0, 'errors': 0, 'late_ticks': 0}
+
+    def start(self):
+        """Start advancing the wheel on a daemon thread"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the wheel; pending timers never fire"""
+        self.stopping.set()
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) on the wheel thread after delay seconds
+
+        Args:
+            delay: Seconds from now, rounded up to the next tick
+            callback: Callable run on the wheel thread; it must not block
+            *args: Arguments for the callback
+
+        Returns:
+            Timer: Handle whose cancel() removes the timer in O(1)
+        """
+        with self.lock:
+            # Ticks are counted from the wheel's start time so late ticks don't shift deadlines
+            due = (time.monotonic() + delay - self.started) / self.tick
+            expiry_tick = max(int(due) + (due > int(due)), self.current_tick + 1)
+            timer = Timer(self, expiry_tick, callback, args)
+            self.slots[expiry_tick % len(self.slots)][timer] = None
+            self.stats['scheduled'] += 1
+        return timer
+
+    def cancel(self, timer):
+        with self.lock:
+            slot = self.slots[timer.expiry_tick % len(self.slots)]
+            if timer in slot:
+                del slot[timer]
+                self.stats['cancelled'] += 1
+            timer.cancelled = True
+
+    def advance(self):
+        """Expire every timer whose tick has passed; returns the number fired"""
+        now_tick = int((time.monotonic() - self.started) / self.tick)
+        if now_tick - self.current_tick > 1:
+            self.stats['late_ticks'] += 1
+        fired = 0
+        while self.current_tick < now_tick:
+            with self.lock:
+                self.current_tick += 1
+                slot = self.slots[self.current_tick % len(self.slots)]
+                due = [timer for timer in slot if timer.expiry_tick <= self.current_tick]
+                for timer in due:
+                    del slot[timer]
+                    timer.cancelled = True  # Fired timers can no longer be cancelled
+            for timer in due:
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    print(f"Error in timer callback {getattr(timer.callback, '__name__', timer.callback)}: {e}")
+            fired += len(due)
+        self.stats['fired'] += fired
+        return fired
+
+    def run(self):
+        """Advance the wheel once per tick until stopped"""
+        while not self.stopping.is_set():
+            self.advance()
+            next_tick = self.started + (self.current_tick + 1) * self.tick
+            self.stopping.wait(max(0.0, next_tick - time.monotonic()))
+
+    def get_stats(self):
+        """Get timer counts (pending is computed, so call this sparingly)"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['pending'] = sum(len(slot) for slot in self.slots)
+        stats['tick_ms'] = self.tick * 1000
+        return stats
@@ -0,0 +1,49 @@
+"""
+Change notification for VoIP Quality Monitor
+Writers bump a sequence number under the lock and wake any waiting
+broadcaster; each broadcaster remembers the last sequence it handled, so a
+change made while it was busy is still seen, and several consumers can wait
+on the same notifier
+"""
+import threading
+import time
+
+class UpdateNotifier:
+    def __init__(self, min_latency=0.05):
+        self.min_latency = min_latency  # Seconds to gather a burst of changes into one wakeup
+        self.condition = threading.Condition()
+        self.sequence = 0
+        self.waiters = 0
+
+    def notify(self):
+        """Record a change and wake the waiting broadcasters"""
+        with self.condition:
+            self.sequence += 1
+            if self.waiters:
+                self.condition.notify_all()
+
+    def wait(self, seen, timeout=None):
+        """Block until there were changes after sequence `seen`
+
+        Args:
+            seen: Sequence returned by the previous call (0 initially)
+            timeout: Maximum seconds to wait, None waits forever
+
+        Returns:
+            int: Current sequence; equal to `seen` when the timeout expired
+        """
+        with self.condition:
+            self.waiters += 1
+            try:
+                if self.sequence == seen:
+                    self.condition.wait_for(lambda: self.sequence != seen, timeout)
+            finally:
+                self.waiters -= 1
+
+        if self.sequence == seen:
+            return seen
+
+        # Let the rest of a burst arrive so it goes out in one batch
+        if self.min_latency:
+            time.sleep(self.min_latency)
+        return self.sequence